@@ -0,0 +1,44 @@
+"""Measures the throughput of LogParser over a log file replicated up to
+a target size, parsing it in blocks of bytes the same way the reader does,
+or in blocks of str with --text
+
+Usage: python benchmarks/parse_block.py [DATA_FILE_PATH] [--mb N] [--text]
+"""
+from http_monitor.log_parser import LogParser
+import argparse
+import time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Block parser benchmark")
+    parser.add_argument('DATA_FILE_PATH', nargs='?',
+                        default='log_files/sample_csv.txt')
+    parser.add_argument('--mb', type=int, default=256,
+                        help='Total megabytes of log lines to parse')
+    parser.add_argument('--block_kb', type=int, default=1024,
+                        help='Size of each block handed to the parser')
+    parser.add_argument('--text', action='store_true',
+                        help='Parse blocks of str instead of bytes')
+    args = parser.parse_args()
+
+    with open(args.DATA_FILE_PATH) as data_file:
+        sample = data_file.readlines()[1:]
+
+    # Build one block of whole lines and parse it repeatedly
+    block_lines = sample * (args.block_kb * 1024 // len(''.join(sample)) + 1)
+    block = ''.join(block_lines)
+    if not args.text:
+        block = block.encode()
+    blocks = args.mb * 1024 * 1024 // len(block) + 1
+
+    log_parser = LogParser()
+    start = time.perf_counter()
+    for _ in range(blocks):
+        log_parser.parse_block(block)
+    elapsed = time.perf_counter() - start
+
+    lines = log_parser.parsed_lines + log_parser.malformed_lines
+    print(f'{blocks * len(block) / 1e6:.0f} MB, {lines:,} lines')
+    print(f'{lines / elapsed:,.0f} lines/s, '
+          f'{blocks * len(block) / 1e6 / elapsed:.1f} MB/s')
+    print(f'{log_parser.malformed_lines:,} malformed lines')
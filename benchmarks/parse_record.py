@@ -0,0 +1,84 @@
+"""Compares the bytes and time per line of the parsed log line dicts the
+reader used to produce with the LogRecord tuples it produces now
+
+Usage: python benchmarks/parse_record.py [DATA_FILE_PATH] [--lines N]
+"""
+from http_monitor.log_parser import LogParser
+import argparse
+import time
+import tracemalloc
+
+
+def parse_log_line_dict(log_line):
+    """
+    Previous parser, kept here as the baseline for the comparison
+    """
+    client, _, user_id, time, section, status, size = log_line.split(',')
+
+    data = {}
+    try:
+        data['client'] = client.strip('"')
+        data['user_id'] = user_id.strip('"')
+        data['time'] = int(time)
+        data['status'] = status
+        data['size'] = int(size.rstrip())
+
+        section_parts = section.strip('"').split(' ')
+        data['method'] = section_parts[0]
+        data['section'] = section_parts[1].split('/')[1]
+    except (ValueError, IndexError):
+        return None
+
+    return data
+
+
+def parse_dicts(log_lines):
+    # The alert consumer used to get a separate list of timestamps
+    timestamps, parsed = [], []
+    for log_line in log_lines:
+        data = parse_log_line_dict(log_line)
+        if data:
+            timestamps.append(data['time'])
+            parsed.append(data)
+    return timestamps, parsed
+
+
+def parse_records(log_lines):
+    return LogParser().parse_lines(log_lines)
+
+
+def measure(parse, log_lines):
+    """
+    Returns:
+        tuple: Retained bytes per line and seconds per line
+    """
+    tracemalloc.start()
+    result = parse(log_lines)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    start = time.perf_counter()
+    parse(log_lines)
+    elapsed = time.perf_counter() - start
+
+    return retained / len(log_lines), elapsed / len(log_lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parsed record benchmark")
+    parser.add_argument('DATA_FILE_PATH', nargs='?',
+                        default='log_files/sample_csv.txt')
+    parser.add_argument('--lines', type=int, default=200000)
+    args = parser.parse_args()
+
+    with open(args.DATA_FILE_PATH) as data_file:
+        sample = data_file.readlines()[1:]
+    log_lines = (sample * (args.lines // len(sample) + 1))[:args.lines]
+
+    for name, parse in [('dict', parse_dicts), ('record', parse_records)]:
+        bytes_per_line, seconds_per_line = measure(parse, log_lines)
+        print(
+            f'{name:>8}: {bytes_per_line:8.1f} bytes/line '
+            f'{seconds_per_line * 1e9:8.1f} ns/line'
+        )
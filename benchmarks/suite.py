@@ -0,0 +1,273 @@
+"""Runs the benchmarks of the hot paths over synthetic logs and writes the
+results as JSON, so that runs can be compared to catch regressions
+
+Each benchmark runs in its own process so that its peak RSS and CPU time
+are its own. Lines/s and nanoseconds per line cover a whole run, and the
+latency percentiles are per batch of lines as handed over by the reader
+
+    parse  - LogParser.parse_block
+    alert  - LogAlertConsumer.process_records (sliding window checks)
+    stats  - LogStatsConsumer.process_records (counts and sketches)
+    tail   - Time from a line being written to the tailed file until the
+             alert it triggers is published. Fails when no alert fires
+
+Usage: python benchmarks/suite.py [--lines N] [--sections N] [--skew N]
+    [--output results.json] [--baseline old.json]
+
+Exits with 1 when a benchmark failed or, with a baseline, regressed
+"""
+from http_monitor.batch_queue import BatchQueue
+from http_monitor.log_alert_consumer import LogAlertConsumer
+from http_monitor.log_parser import LogParser
+from http_monitor.log_reader import LogReader
+from http_monitor.log_stats_consumer import LogStatsConsumer
+from synthetic import generate_blocks
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+# Metrics where a larger value is a regression
+LOWER_IS_BETTER = ('ns_per_line', 'batch_p50_ms', 'batch_p99_ms',
+                   'latency_p50_ms', 'latency_max_ms', 'peak_rss_mb',
+                   'cpu_seconds')
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+
+def time_batches(function, batches, lines):
+    """
+    Calls the function with each batch, timing every call
+
+    Returns:
+        dict: Throughput, per line and per batch latency and CPU time
+    """
+    latencies = []
+    cpu_start = cpu_seconds()
+    start = time.perf_counter()
+    for batch in batches:
+        batch_start = time.perf_counter()
+        function(batch)
+        latencies.append(time.perf_counter() - batch_start)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'lines': lines,
+        'lines_per_second': round(lines / elapsed),
+        'ns_per_line': round(elapsed / lines * 1e9),
+        'batch_p50_ms': round(percentile(latencies, 0.5) * 1e3, 3),
+        'batch_p99_ms': round(percentile(latencies, 0.99) * 1e3, 3),
+        'cpu_seconds': round(cpu_seconds() - cpu_start, 3)
+    }
+
+
+def parse_records(blocks):
+    parser = LogParser()
+    return [parser.parse_block(block) for block in blocks]
+
+
+def bench_parse(blocks, options):
+    return time_batches(LogParser().parse_block, blocks, options['lines'])
+
+
+def bench_alert(blocks, options):
+    batches = parse_records(blocks)
+    consumer = LogAlertConsumer(120, 10, None, use_log_time=True)
+    return time_batches(consumer.process_records, batches, options['lines'])
+
+
+def bench_stats(blocks, options):
+    batches = parse_records(blocks)
+    consumer = LogStatsConsumer(
+        10, None, use_log_time=True, top_k=options['top_k']
+    )
+    return time_batches(consumer.process_records, batches, options['lines'])
+
+
+def bench_tail(blocks, options, trials=10):
+    """
+    Tails a file with a LogReader feeding a LogAlertConsumer, and writes a
+    burst of lines that breaches the threshold after a quiet first window
+    """
+    latencies = []
+    cpu_start = cpu_seconds()
+    for trial in range(trials):
+        handle, log_path = tempfile.mkstemp()
+        os.close(handle)
+
+        alert_queue, stats_queue = BatchQueue(), BatchQueue()
+        reader = LogReader(log_path, alert_queue, stats_queue)
+        alerts = LogAlertConsumer(2, 5, alert_queue, use_log_time=True)
+        alerted = []
+        alerts.add_listener(lambda _: alerted.append(time.perf_counter()))
+        reader.start()
+        alerts.start()
+        time.sleep(0.2)
+
+        line = '"10.0.0.1","-","apache",{},"GET /api/user HTTP/1.0",200,100\n'
+        with open(log_path, 'a') as log_file:
+            log_file.write(''.join(line.format(t) for t in range(3)))
+            log_file.flush()
+            time.sleep(0.05)
+            written = time.perf_counter()
+            log_file.write(line.format(3) * 100)
+            log_file.flush()
+
+        deadline = time.time() + 5
+        while not alerted and time.time() < deadline:
+            time.sleep(0.001)
+        if alerted:
+            latencies.append(alerted[0] - written)
+
+        reader.thread_terminated = True
+        alerts.thread_terminated = True
+        reader.join()
+        alerts.join()
+        os.remove(log_path)
+
+    # Without any alert there is no latency to report, which fails the run
+    return {
+        'trials': trials,
+        'alerts': len(latencies),
+        'failed': not latencies,
+        'latency_p50_ms': (
+            round(percentile(latencies, 0.5) * 1e3, 3) if latencies else None
+        ),
+        'latency_max_ms': (
+            round(max(latencies) * 1e3, 3) if latencies else None
+        ),
+        'cpu_seconds': round(cpu_seconds() - cpu_start, 3)
+    }
+
+
+BENCHMARKS = {
+    'parse': bench_parse,
+    'alert': bench_alert,
+    'stats': bench_stats,
+    'tail': bench_tail
+}
+
+
+def run_benchmark(name, options, results):
+    """
+    Runs in a child process so the peak RSS is only that of the benchmark
+    """
+    blocks = generate_blocks(
+        options['lines'], rate=options['rate'],
+        sections=options['sections'], skew=options['skew'],
+        seed=options['seed']
+    )
+    result = BENCHMARKS[name](blocks, options)
+    result['peak_rss_mb'] = peak_rss_mb()
+    results.put(result)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns:
+        list: Description of each metric that regressed by more than the
+            tolerance compared to the baseline
+    """
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        for metric, value in result.items():
+            old = baseline.get('benchmarks', {}).get(name, {}).get(metric)
+            if not old or not isinstance(value, (int, float)):
+                continue
+            if metric == 'lines_per_second':
+                change = (old - value) / old
+            elif metric in LOWER_IS_BETTER:
+                change = (value - old) / old
+            else:
+                continue
+            if change > tolerance:
+                regressions.append(
+                    f'{name}.{metric}: {old} -> {value} ({change:+.0%})'
+                )
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Hot path benchmarks")
+    parser.add_argument('--lines', type=int, default=500000)
+    parser.add_argument('--rate', type=int, default=1000,
+                        help='Lines per second of log time')
+    parser.add_argument('--sections', type=int, default=10,
+                        help='Number of distinct sections')
+    parser.add_argument('--skew', type=int, default=2,
+                        help='Maximum seconds a timestamp is out of order')
+    parser.add_argument('--top_k', type=int,
+                        help='Track sections with a sketch in the stats')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', type=str, default=','.join(BENCHMARKS),
+                        help='Comma separated benchmarks to run')
+    parser.add_argument('--output', type=str,
+                        help='File to write the JSON results to')
+    parser.add_argument('--baseline', type=str,
+                        help='Results to compare to, exits with 1 when a '
+                        'metric regressed by more than the tolerance')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    options = {
+        'lines': args.lines, 'rate': args.rate, 'sections': args.sections,
+        'skew': args.skew, 'top_k': args.top_k, 'seed': args.seed
+    }
+    results = {
+        'options': options,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'benchmarks': {}
+    }
+
+    context = multiprocessing.get_context('spawn')
+    for name in args.only.split(','):
+        queue = context.Queue()
+        process = context.Process(
+            target=run_benchmark, args=(name, options, queue)
+        )
+        process.start()
+        results['benchmarks'][name] = queue.get()
+        process.join()
+        print(name, json.dumps(results['benchmarks'][name]))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    failures = [
+        name for name, result in results['benchmarks'].items()
+        if result.get('failed')
+    ]
+    for name in failures:
+        print(f'FAILED {name}: no alert in any of the trials')
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file),
+                                  args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+    sys.exit(1 if failures or regressions else 0)
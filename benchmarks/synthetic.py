@@ -0,0 +1,84 @@
+"""Generates synthetic log lines in the same format as sample_csv.txt, at a
+given rate of lines per second of log time, number of distinct sections and
+amount of out of order skew in the timestamps
+
+Usage: python benchmarks/synthetic.py OUTPUT_FILE [--lines N] [--rate N]
+    [--sections N] [--skew N] [--seed N]
+"""
+import argparse
+import itertools
+import random
+
+HEADER = '"remotehost","rfc931","authuser","date","request","status","bytes"\n'
+START_TIME = 1549573860
+METHODS = ['GET', 'GET', 'GET', 'POST', 'PUT', 'DELETE']
+STATUSES = [200] * 16 + [301, 404, 404, 500]
+
+
+def generate_lines(lines, rate=1000, sections=10, skew=0, seed=0,
+                   start_time=START_TIME):
+    """
+    Args:
+        lines (int): Number of lines to generate
+        rate (int): Lines per second of log time
+        sections (int): Number of distinct sections, hit with a Zipf like
+            distribution so a few sections get most of the traffic
+        skew (int): Maximum number of seconds a timestamp is behind the
+            current second, 0 for timestamps in order
+        seed (int): Seed so that runs are reproducible
+
+    Yields:
+        str: Log line, ending with a newline
+    """
+    rng = random.Random(seed)
+    names = [f'section{i}' for i in range(sections)]
+    cum_weights = list(itertools.accumulate(
+        1 / (i + 1) for i in range(sections)
+    ))
+    clients = [f'10.0.{i // 256}.{i % 256}' for i in range(1000)]
+
+    for i in range(lines):
+        timestamp = start_time + i // rate
+        if skew:
+            timestamp -= rng.randint(0, skew)
+        section = rng.choices(names, cum_weights=cum_weights)[0]
+        yield (
+            f'"{rng.choice(clients)}","-","apache",{timestamp},'
+            f'"{rng.choice(METHODS)} /{section}/{rng.randint(0, 99)} '
+            f'HTTP/1.0",{rng.choice(STATUSES)},{rng.randint(100, 5000)}\n'
+        )
+
+
+def generate_blocks(lines, block_lines=10000, **options):
+    """
+    Returns:
+        list: Blocks of block_lines complete lines each, as handed to the
+            parser by the reader
+    """
+    generated = generate_lines(lines, **options)
+    blocks = []
+    while True:
+        block = ''.join(itertools.islice(generated, block_lines))
+        if not block:
+            return blocks
+        blocks.append(block)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Synthetic log generator")
+    parser.add_argument('OUTPUT_FILE', type=str)
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--rate', type=int, default=1000,
+                        help='Lines per second of log time')
+    parser.add_argument('--sections', type=int, default=10,
+                        help='Number of distinct sections')
+    parser.add_argument('--skew', type=int, default=0,
+                        help='Maximum seconds a timestamp is out of order')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.OUTPUT_FILE, 'w') as output_file:
+        output_file.write(HEADER)
+        output_file.writelines(generate_lines(
+            args.lines, args.rate, args.sections, args.skew, args.seed
+        ))
@@ -1,41 +1,299 @@
-from collections import deque
+from http_monitor.aggregation import AggregateShipper
+from http_monitor.aggregation import Aggregator
+from http_monitor.aggregation import SHIP_QUEUE_CAPACITY
+from http_monitor.aggregation import parse_address
+from http_monitor.alert_rules import parse_rule
+from http_monitor.batch_queue import BLOCK
+from http_monitor.batch_queue import BatchQueue
+from http_monitor.batch_queue import DROP
+from http_monitor.batch_queue import POLICIES
+from http_monitor.checkpoint import CHECKPOINT_FILE
+from http_monitor.checkpoint import Checkpointer
+from http_monitor.checkpoint import load_checkpoint
+from http_monitor.checkpoint import restore_checkpoint
+from http_monitor.checkpoint import start_positions
+from http_monitor.compression import compression_format
 from http_monitor.log_alert_consumer import LogAlertConsumer
 from http_monitor.log_stats_consumer import LogStatsConsumer
 from http_monitor.log_reader import LogReader
-from http_monitor.display import Display
+from http_monitor.metrics_server import MetricsServer
+from http_monitor.multi_tailer import MultiFileTailer
+from http_monitor.ndjson_sink import NdjsonSink
+from http_monitor.ndjson_sink import open_output
+from http_monitor.history import HistoryStore
+from http_monitor.instrumentation import PipelineMonitor
+from http_monitor.instrumentation import SamplingProfiler
+from http_monitor.instrumentation import profile_thread
+from http_monitor.parallel import replay_log_file_parallel
+from http_monitor.replay import replay_log_file
+from http_monitor.vectorized import numpy_available
+from urllib.parse import quote
 import argparse
+import os
+import signal
+import socket
+import threading
+
+
+def offset_path(offsets_dir, input_file_path):
+    """
+    Returns:
+        str: File in the offsets directory the read offset of a log file is
+            persisted to, None if offsets are not persisted
+    """
+    if not offsets_dir:
+        return None
+    name = quote(os.path.abspath(input_file_path), safe='')
+    return os.path.join(offsets_dir, f'{name}.offset')
+
+
+def wait_for_signal(threads):
+    """Waits for SIGINT or SIGTERM, or for the reader to stop, then
+    terminates the threads. Used without the display, eg. under systemd
+
+    Args:
+        threads (list): Threads to terminate, the reader first
+    """
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    while not stop.wait(0.5):
+        if not threads[0].is_alive():
+            break
+
+    for t in threads:
+        t.thread_terminated = True
+    for t in threads:
+        t.join()
 
 
 # Threading implementation adapted from
 # "Python thread sample with handling Ctrl-C"
 # https://gist.github.com/ruedesign/5218221
-def start_monitoring(input_file_path, time_window, threshold, interval):
+def start_monitoring(input_file_paths, time_window, threshold, interval,
+                     offsets_dir=None, fps=4, top_k=None, history=None,
+                     headless_output=None, metrics_address=None,
+                     profile_dir=None, sample_profile_path=None,
+                     queue_capacity=None, alerts_policy=BLOCK,
+                     stats_policy=BLOCK, sample_rate=10, rules=None,
+                     checkpoint_dir=None, checkpoint_interval=10,
+                     ship_address=None, node=None, ship_interval=1.0):
     """Starts up all of the services via threads
 
     Args:
-        input_file_path (str): Path of file that will be monitored for logs
+        input_file_paths (list): Paths of files that will be monitored for
+            logs
         time_window (int): Window of time that will be used for alerting
         threshold (int): hits/second that on average should stay below
         interval (int): How often stats should be updated
+        offsets_dir (str): Directory to persist read offsets to so that a
+            restart resumes where it stopped
+        fps (int): Maximum number of frames per second for the display
+        top_k (int): Number of sections tracked per interval, None to count
+            every section exactly
+        history (HistoryStore): Store to write the rollups and alerts to
+        headless_output (str): Where to write the events as newline
+            delimited JSON instead of using the display, see open_output
+        metrics_address (tuple): Host and port to serve the stats and alert
+            state on over HTTP, None to not serve them
+        profile_dir (str): Directory to write the cProfile stats of each
+            thread to, None to not profile
+        sample_profile_path (str): File to write sampled stacks of every
+            thread to, None to not sample
+        queue_capacity (int): Maximum number of lines waiting for each
+            consumer, None for unbounded
+        alerts_policy (str): What a full alerts queue does with a batch,
+            see BatchQueue
+        stats_policy (str): What a full stats queue does with a batch
+        sample_rate (int): Keep 1 in every sample_rate lines when the stats
+            queue samples
+        rules (list): AlertRule to evaluate on top of the global threshold
+        checkpoint_dir (str): Directory to periodically save the alert and
+            stats state to, along with the read position of the lines the
+            consumers processed, so that a restart resumes from it. The
+            read offsets are saved there too unless offsets_dir is given,
+            for the files the checkpoint has no read position of
+        checkpoint_interval (float): Seconds between checkpoints
+        ship_address (str): tcp://host:port or unix:///path of an
+            Aggregator to ship the per second aggregates to, None to not
+            ship them
+        node (str): Name of this node at the aggregator, defaults to the
+            host name
+        ship_interval (float): Seconds between frames shipped
+
+    Returns:
+        PipelineMonitor: Reports the throughput, queue depths and lag
+    """
+    checkpoint = None
+    if checkpoint_dir:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        offsets_dir = offsets_dir or checkpoint_dir
+        checkpoint_path = os.path.join(checkpoint_dir, CHECKPOINT_FILE)
+        checkpoint = load_checkpoint(checkpoint_path)
+
+    alerts_queue = BatchQueue(queue_capacity, alerts_policy, sample_rate)
+    stats_queue = BatchQueue(queue_capacity, stats_policy, sample_rate)
+    # Shipping never holds up the local monitoring, a full ship queue drops
+    # batches instead of blocking the reader
+    ship_queue = None
+    if ship_address:
+        ship_queue = BatchQueue(queue_capacity or SHIP_QUEUE_CAPACITY, DROP)
+
+    # Many files are tailed from one thread, which also runs an alert
+    # consumer per file on top of the aggregated consumers
+    file_alerts = {}
+    if len(input_file_paths) == 1:
+        reader = LogReader(
+            input_file_paths[0], alerts_queue, stats_queue,
+            offset_path=offset_path(offsets_dir, input_file_paths[0]),
+            ship_queue=ship_queue,
+            start_positions=start_positions(checkpoint, input_file_paths[0])
+        )
+    else:
+        reader = MultiFileTailer(
+            alerts_queue, stats_queue, ship_queue=ship_queue
+        )
+        for input_file_path in input_file_paths:
+            file_alerts[input_file_path] = LogAlertConsumer(
+                time_window, threshold, None
+            )
+            reader.add_file(
+                input_file_path, [file_alerts[input_file_path]],
+                offset_path(offsets_dir, input_file_path),
+                start_positions(checkpoint, input_file_path)
+            )
+
+    alerts = LogAlertConsumer(
+        time_window, threshold, alerts_queue, rules=rules
+    )
+    stats = LogStatsConsumer(
+        interval, stats_queue, top_k=top_k, history=history
+    )
+    if checkpoint_dir:
+        restore_checkpoint(checkpoint_path, alerts, stats, file_alerts)
+    if history:
+        alerts.add_listener(history.add_alert)
+        if alerts.rule_engine:
+            alerts.rule_engine.add_listener(history.add_alert)
+
+    pipeline = PipelineMonitor(
+        {
+            'reader': reader.stage_stats,
+            'alerts': alerts.stage_stats,
+            'stats': stats.stage_stats
+        },
+        {'alerts': alerts_queue, 'stats': stats_queue}
+    )
+
+    if headless_output:
+        sink = NdjsonSink(open_output(headless_output))
+        alerts.add_listener(sink.on_alert)
+        if alerts.rule_engine:
+            alerts.rule_engine.add_listener(sink.on_alert)
+        stats.add_listener(sink.on_stats)
+        for path, consumer in file_alerts.items():
+            consumer.add_listener(
+                lambda alert_data, path=path: sink.on_alert(alert_data, path)
+            )
+        threads = [reader, stats, alerts, sink]
+    else:
+        # Only imported with the display, so curses is not needed headless
+        from http_monitor.display import Display
+        display = Display(reader, stats, alerts, file_alerts, fps, pipeline)
+        threads = [reader, display, stats, alerts]
+
+    if metrics_address:
+        threads.append(MetricsServer(
+            stats, alerts, file_alerts, *metrics_address, pipeline=pipeline
+        ))
+
+    if checkpoint_dir:
+        threads.append(Checkpointer(
+            checkpoint_path, alerts, stats, file_alerts, checkpoint_interval
+        ))
+
+    if ship_address:
+        threads.append(AggregateShipper(
+            ship_address, node or socket.gethostname(), ship_queue,
+            ship_interval
+        ))
+
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        for t in threads:
+            profile_thread(t, profile_dir)
+
+    for t in threads:
+        t.start()
+    if sample_profile_path:
+        SamplingProfiler(sample_profile_path).start()
+
+    if headless_output:
+        wait_for_signal(threads)
+    return pipeline
+
+
+def start_aggregator(address, time_window, threshold, interval, fps=4,
+                     top_k=None, history=None, headless_output=None,
+                     metrics_address=None, max_lag=5.0):
+    """Starts an Aggregator that alerts and keeps stats on the hits of
+    every node shipping to it, instead of on a log file
+
+    Args:
+        address (str): tcp://host:port or unix:///path to listen on
+        time_window (int): Window of time that will be used for alerting
+        threshold (int): hits/second that on average should stay below
+        interval (int): Seconds of log time per stats interval
+        fps (int): Maximum number of frames per second for the display
+        top_k (int): Number of sections tracked per interval, None to count
+            every section exactly
+        history (HistoryStore): Store to write the rollups and alerts to
+        headless_output (str): Where to write the events as newline
+            delimited JSON instead of using the display, see open_output
+        metrics_address (tuple): Host and port to serve the stats and alert
+            state on over HTTP, None to not serve them
+        max_lag (float): Seconds the aggregates of a second are held for
+            at most while waiting for the other nodes
+
+    Returns:
+        Aggregator: Merges the aggregates of the nodes
     """
-    alerts_queue = deque()
-    stats_queue = deque()
+    alerts = LogAlertConsumer(time_window, threshold, None, use_log_time=True)
+    stats = LogStatsConsumer(
+        interval, None, use_log_time=True, top_k=top_k, history=history
+    )
+    if history:
+        alerts.add_listener(history.add_alert)
+    aggregator = Aggregator(address, alerts, stats, max_lag)
+
+    if headless_output:
+        sink = NdjsonSink(open_output(headless_output))
+        alerts.add_listener(sink.on_alert)
+        stats.add_listener(sink.on_stats)
+        threads = [aggregator, sink]
+    else:
+        from http_monitor.display import Display
+        threads = [aggregator, Display(aggregator, stats, alerts, fps=fps)]
 
-    reader = LogReader(input_file_path, alerts_queue, stats_queue)
-    alerts = LogAlertConsumer(time_window, threshold, alerts_queue)
-    stats = LogStatsConsumer(interval, stats_queue)
-    display = Display(reader, stats, alerts)
+    if metrics_address:
+        threads.append(MetricsServer(stats, alerts, None, *metrics_address))
 
-    threads = [reader, display, stats, alerts]
     for t in threads:
         t.start()
 
+    if headless_output:
+        wait_for_signal(threads)
+    return aggregator
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="HTTP Log Monitor App")
     parser.version = '1.0'
 
-    parser.add_argument('INPUT_FILE_PATH', type=str, help="Path to log file")
+    parser.add_argument('INPUT_FILE_PATH', type=str, nargs='*',
+                        help="Path to log file, several files can be "
+                        "monitored at once when tailing")
     parser.add_argument('--threshold', action='store', type=int, default=10,
                         help='Set the threshold for number of requests per'
                         'second that after 2 minutes should trigger an alert.'
@@ -46,10 +304,190 @@ if __name__ == '__main__':
     parser.add_argument('--time_window', action='store', type=int, default=120,
                         help='Set the window of time for alert. Default is '
                         '120 seconds.')
+    parser.add_argument('--batch', '--from-start', action='store_true',
+                        dest='batch',
+                        help='Replay the whole log file from the start as '
+                        'fast as possible using log time, printing the '
+                        'alert timeline and stats instead of tailing. The '
+                        'file can be gzip, bzip2, xz or zstd compressed.')
+    parser.add_argument('--workers', action='store', type=int, default=1,
+                        help='Number of processes used to replay the file '
+                        'with --batch. Default is 1.')
+    parser.add_argument('--offsets_dir', action='store', type=str,
+                        help='Directory to persist read offsets to, so that '
+                        'a restart resumes where it stopped instead of at '
+                        'the end of the file.')
+    parser.add_argument('--fps', action='store', type=int, default=4,
+                        help='Maximum number of times per second the display '
+                        'is redrawn. Default is 4.')
+    parser.add_argument('--top_k', action='store', type=int,
+                        help='Track at most this many sections per interval '
+                        'with an approximate heavy hitters sketch, keeping '
+                        'memory fixed, and per --history bucket. Default is '
+                        'to count every section.')
+    parser.add_argument('--history', action='store', type=str,
+                        help='SQLite file to keep per second, minute and '
+                        'hour rollups and alerts in, which can be queried '
+                        'with query_history.py.')
+    parser.add_argument('--headless', action='store', type=str,
+                        nargs='?', const='-', metavar='OUTPUT',
+                        help='Run without the display, writing alerts and '
+                        'interval stats as newline delimited JSON to OUTPUT: '
+                        'a file, tcp://host:port, unix:///path or - for '
+                        'stdout (the default).')
+    parser.add_argument('--metrics_port', action='store', type=int,
+                        help='Serve the stats and alert state over HTTP on '
+                        'this port, at /metrics (Prometheus), /metrics.json '
+                        'and /alerts.')
+    parser.add_argument('--metrics_host', action='store', type=str,
+                        default='127.0.0.1',
+                        help='Address to serve the metrics on. Default is '
+                        '127.0.0.1.')
+    parser.add_argument('--profile', action='store', type=str,
+                        metavar='DIR',
+                        help='Run every thread under cProfile, writing the '
+                        'stats of each thread to DIR when it finishes.')
+    parser.add_argument('--sample_profile', action='store', type=str,
+                        metavar='FILE',
+                        help='Sample the stacks of every thread 100 times a '
+                        'second, writing them to FILE as collapsed stacks '
+                        'for flame graphs when the app stops.')
+    parser.add_argument('--queue_capacity', action='store', type=int,
+                        help='Maximum number of lines waiting for each '
+                        'consumer, keeping memory bounded when a consumer '
+                        'falls behind. Default is unbounded.')
+    parser.add_argument('--alerts_policy', action='store', type=str,
+                        choices=[BLOCK, DROP], default=BLOCK,
+                        help='What to do with lines when the alerts queue is '
+                        'full: block the reader or drop them. Default is '
+                        'block, which keeps the alert counts exact.')
+    parser.add_argument('--stats_policy', action='store', type=str,
+                        choices=POLICIES, default=BLOCK,
+                        help='What to do with lines when the stats queue is '
+                        'full: block the reader, drop them, or keep 1 in '
+                        'every --sample_rate lines and scale the counts up. '
+                        'Default is block.')
+    parser.add_argument('--sample_rate', action='store', type=int,
+                        default=10,
+                        help='Keep 1 in this many lines when sampling. '
+                        'Default is 10.')
+    parser.add_argument('--rule', action='append', type=str, default=[],
+                        metavar='RULE', dest='rules',
+                        help='Alert rule evaluated on top of --threshold, '
+                        'written as metric[@section]>threshold/window with '
+                        'metric hits, bytes (per second) or error_rate, '
+                        'eg. hits@api>5/10s or error_rate>0.05/15m. Can be '
+                        'given many times.')
+    parser.add_argument('--checkpoint_dir', action='store', type=str,
+                        help='Directory to periodically save the alert '
+                        'windows, alert state and totals to, along with the '
+                        'read offsets, so that a restart resumes alerting '
+                        'straight away.')
+    parser.add_argument('--checkpoint_interval', action='store', type=float,
+                        default=10,
+                        help='Seconds between checkpoints. Default is 10.')
+    parser.add_argument('--vectorized', action='store_true',
+                        help='Parse and count the lines with NumPy when '
+                        'replaying with --batch, for the same timeline at '
+                        'a fraction of the time. Needs numpy installed.')
+    parser.add_argument('--ship', action='store', type=str,
+                        metavar='ADDRESS',
+                        help='Ship the per second hits, bytes and section '
+                        'sketches to the aggregator at tcp://host:port or '
+                        'unix:///path, on top of monitoring locally.')
+    parser.add_argument('--node', action='store', type=str,
+                        help='Name of this node at the aggregator. Default '
+                        'is the host name.')
+    parser.add_argument('--ship_interval', action='store', type=float,
+                        default=1,
+                        help='Seconds between shipments. Default is 1.')
+    parser.add_argument('--aggregate', action='store', type=str,
+                        metavar='ADDRESS',
+                        help='Run as the aggregator instead of reading log '
+                        'files, listening on tcp://host:port or '
+                        'unix:///path and alerting on the merged hits of '
+                        'every node shipping to it.')
+    parser.add_argument('--max_lag', action='store', type=float, default=5,
+                        help='Seconds the aggregator waits for slow nodes '
+                        'before counting a second. Default is 5.')
     parser.add_argument('--version', action='version')
 
     args = parser.parse_args()
+    if args.aggregate and args.INPUT_FILE_PATH:
+        parser.error('--aggregate does not read log files')
+    if not args.aggregate and not args.INPUT_FILE_PATH:
+        parser.error('the following arguments are required: INPUT_FILE_PATH')
+    if args.aggregate and (args.batch or args.ship or args.rules or
+                           args.checkpoint_dir):
+        parser.error('--aggregate is not supported with --batch, --ship, '
+                     '--rule or --checkpoint_dir')
+    if args.ship and args.batch:
+        parser.error('--ship only applies when tailing')
+    for address in (args.ship, args.aggregate):
+        try:
+            if address:
+                parse_address(address)
+        except ValueError as error:
+            parser.error(str(error))
+    if args.batch and len(args.INPUT_FILE_PATH) > 1:
+        parser.error('--batch replays a single log file')
+    if args.batch and args.workers > 1 and args.rules:
+        parser.error('--rule is not supported with --workers')
+    if (args.batch and args.workers > 1 and
+            os.path.isfile(args.INPUT_FILE_PATH[0]) and
+            compression_format(args.INPUT_FILE_PATH[0])):
+        parser.error('--workers cannot split a compressed file')
+    if args.vectorized and not args.batch:
+        parser.error('--vectorized only applies to --batch')
+    if args.vectorized and (args.workers > 1 or args.rules):
+        parser.error('--vectorized is not supported with --workers or --rule')
+    if args.vectorized and not numpy_available():
+        parser.error('--vectorized needs numpy: pip install numpy')
+    try:
+        rules = [parse_rule(spec) for spec in args.rules]
+    except ValueError as error:
+        parser.error(str(error))
 
-    start_monitoring(
-        args.INPUT_FILE_PATH, args.time_window, args.threshold, args.interval
+    history = (
+        HistoryStore(args.history, top_k=args.top_k) if args.history
+        else None
     )
+
+    if args.aggregate:
+        start_aggregator(
+            args.aggregate, args.time_window, args.threshold, args.interval,
+            args.fps, args.top_k, history, args.headless,
+            (args.metrics_host, args.metrics_port) if args.metrics_port
+            else None,
+            args.max_lag
+        )
+    elif args.batch and args.workers > 1:
+        replay_log_file_parallel(
+            args.INPUT_FILE_PATH[0], args.time_window, args.threshold,
+            args.interval, args.workers, top_k=args.top_k, history=history
+        )
+    elif args.batch:
+        replay_log_file(
+            args.INPUT_FILE_PATH[0], args.time_window, args.threshold,
+            args.interval, top_k=args.top_k, history=history, rules=rules,
+            vectorized=args.vectorized
+        )
+    else:
+        start_monitoring(
+            args.INPUT_FILE_PATH, args.time_window, args.threshold,
+            args.interval, args.offsets_dir, args.fps, args.top_k, history,
+            args.headless,
+            (args.metrics_host, args.metrics_port) if args.metrics_port
+            else None,
+            args.profile, args.sample_profile,
+            queue_capacity=args.queue_capacity,
+            alerts_policy=args.alerts_policy,
+            stats_policy=args.stats_policy,
+            sample_rate=args.sample_rate,
+            rules=rules,
+            checkpoint_dir=args.checkpoint_dir,
+            checkpoint_interval=args.checkpoint_interval,
+            ship_address=args.ship,
+            node=args.node,
+            ship_interval=args.ship_interval
+        )
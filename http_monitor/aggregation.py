@@ -0,0 +1,749 @@
+from collections import Counter
+from collections import deque
+from collections import namedtuple
+from http_monitor.instrumentation import StageStats
+from http_monitor.parallel import PartialStats
+from http_monitor.sketches import QuantileSketch
+from time import monotonic
+from time import perf_counter
+import json
+import os
+import select
+import socket
+import socketserver
+import stat
+import struct
+import threading
+import zlib
+
+# Every frame is a header with the length of its payload, the per second
+# aggregates of a node as JSON with a table of the strings they use,
+# compressed with zlib
+FRAME_MAGIC = b'HMAG'
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('!4sBI')
+MAX_FRAME_SIZE = 64 << 20
+
+# Lines waiting to be shipped, beyond which batches are dropped rather than
+# holding up the reader
+SHIP_QUEUE_CAPACITY = 1 << 20
+# Seconds between attempts to reach an aggregator that is down, doubling
+# from the first up to the second
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+
+Frame = namedtuple('Frame', ['node', 'latest', 'lines', 'seconds'])
+Frame.__doc__ = """Aggregates a node shipped in one frame
+
+Attributes:
+    node (str): Name of the node
+    latest (int): Latest log time the node has seen, None before its first
+        line
+    lines (int): Number of log lines aggregated in the frame
+    seconds (dict): Second of log time to its SecondStats
+"""
+
+
+def parse_address(address):
+    """
+    Args:
+        address (str): tcp://host:port or unix:///path
+
+    Returns:
+        tuple: Socket family and address to bind or connect to
+
+    Raises:
+        ValueError: If the address is neither
+    """
+    if address.startswith('tcp://'):
+        host, _, port = address[len('tcp://'):].rpartition(':')
+        if host and port.isdigit():
+            return socket.AF_INET, (host, int(port))
+    if address.startswith('unix://') and len(address) > len('unix://'):
+        return socket.AF_UNIX, address[len('unix://'):]
+    raise ValueError(f'Invalid address, expected tcp://host:port or '
+                     f'unix:///path: {address}')
+
+
+def connect(address, timeout=5.0):
+    """
+    Returns:
+        socket: Connection to the aggregator listening on the address
+    """
+    family, target = parse_address(address)
+    if family == socket.AF_INET:
+        connection = socket.create_connection(target, timeout)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    try:
+        connection.connect(target)
+    except OSError:
+        connection.close()
+        raise
+    return connection
+
+
+class SecondStats:
+    """A class used to hold the aggregates of one second of log time, which
+    can be merged with those of the same second from other nodes
+
+    Attributes:
+        hits (int): Number of log lines
+        section_counts (Counter): Hits per section
+        section_size (Counter): Bytes per section
+        status_counts (Counter): Hits per status class, eg. 2XX
+        size_sketches (dict): Section to QuantileSketch of response sizes
+        client_counts (Counter): Hits per client, of the clients the nodes
+            tracked
+        client_size (Counter): Bytes per client
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.section_counts = Counter()
+        self.section_size = Counter()
+        self.status_counts = Counter()
+        self.size_sketches = {}
+        self.client_counts = Counter()
+        self.client_size = Counter()
+
+    def merge(self, other):
+        """
+        Args:
+            other (SecondStats): Aggregates of the same second elsewhere
+        """
+        self.hits += other.hits
+        self.section_counts.update(other.section_counts)
+        self.section_size.update(other.section_size)
+        self.status_counts.update(other.status_counts)
+        for section, sketch in other.size_sketches.items():
+            if section in self.size_sketches:
+                self.size_sketches[section].merge(sketch)
+            else:
+                self.size_sketches[section] = sketch
+        self.client_counts.update(other.client_counts)
+        self.client_size.update(other.client_size)
+
+
+def encode_frame(node, partial, latest):
+    """
+    Encodes the aggregates of a node into one frame. Each second is a list
+    of its hits, sections, statuses and clients, with every string written
+    once in a table and referred to by its index, and the number lists
+    flattened. Empty frames are still sent as a heartbeat
+
+    Args:
+        node (str): Name of the node
+        partial (PartialStats): Aggregates with an interval of one second,
+            so that the sketches are kept per second
+        latest (int): Latest log time the node has seen
+
+    Returns:
+        bytes: Header and compressed payload of the frame
+    """
+    names = {}
+
+    def name(value):
+        return names.setdefault(value, len(names))
+
+    # [second, hits, sections, statuses, clients]
+    seconds = {
+        timestamp: [timestamp, hits, [], [], []]
+        for timestamp, hits in sorted(partial.hits.items())
+    }
+    for (timestamp, section), count in partial.section_counts.items():
+        sketch = partial.size_sketches.get((timestamp, section))
+        buckets = []
+        if sketch is not None:
+            for bucket, bucket_count in sorted(sketch.buckets.items()):
+                buckets += (bucket, bucket_count)
+        seconds[timestamp][2].append([
+            name(section), count, partial.section_size[(timestamp, section)],
+            sketch.zero_count if sketch is not None else 0, buckets
+        ])
+    for (timestamp, status), count in partial.status_counts.items():
+        seconds[timestamp][3] += (name(status), count)
+    for timestamp, client_counts in partial.client_counts.items():
+        counts = client_counts.counts
+        sizes = partial.client_size[timestamp].counts
+        for client in counts.keys() | sizes.keys():
+            seconds[timestamp][4] += (
+                name(client), counts.get(client, 0), sizes.get(client, 0)
+            )
+
+    payload = zlib.compress(json.dumps({
+        'node': node,
+        'latest': latest,
+        'lines': sum(partial.hits.values()),
+        'names': list(names),
+        'seconds': list(seconds.values())
+    }, separators=(',', ':')).encode('utf-8'))
+    return FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, len(payload)) + \
+        payload
+
+
+def decode_frame(payload):
+    """
+    Args:
+        payload (bytes): Compressed payload of a frame
+
+    Returns:
+        Frame: Aggregates of the frame
+
+    Raises:
+        ValueError: If the payload is not a valid frame
+    """
+    try:
+        body = json.loads(zlib.decompress(payload))
+        names = body['names']
+        seconds = {}
+        for timestamp, hits, sections, statuses, clients in body['seconds']:
+            counts = SecondStats()
+            counts.hits = hits
+            for section, count, size, zero_count, buckets in sections:
+                section = names[section]
+                counts.section_counts[section] = count
+                counts.section_size[section] = size
+                sketch = QuantileSketch()
+                sketch.zero_count = zero_count
+                for i in range(0, len(buckets), 2):
+                    sketch.buckets[buckets[i]] = buckets[i + 1]
+                sketch.count = zero_count + sum(buckets[1::2])
+                counts.size_sketches[section] = sketch
+            for i in range(0, len(statuses), 2):
+                counts.status_counts[names[statuses[i]]] = statuses[i + 1]
+            for i in range(0, len(clients), 3):
+                client = names[clients[i]]
+                if clients[i + 1]:
+                    counts.client_counts[client] = clients[i + 1]
+                if clients[i + 2]:
+                    counts.client_size[client] = clients[i + 2]
+            seconds[timestamp] = counts
+        return Frame(body['node'], body['latest'], body['lines'], seconds)
+    except (zlib.error, KeyError, IndexError, TypeError, ValueError) as error:
+        raise ValueError(f'Invalid frame: {error}')
+
+
+def read_frame(stream):
+    """
+    Reads the next frame sent over a connection
+
+    Args:
+        stream (file): Binary stream of the connection
+
+    Returns:
+        Frame: Next frame, None once the connection is closed
+
+    Raises:
+        ValueError: If the bytes read are not a valid frame
+    """
+    header = stream.read(FRAME_HEADER.size)
+    if not header:
+        return None
+    if len(header) < FRAME_HEADER.size:
+        raise ValueError('Connection closed in the middle of a frame')
+
+    magic, version, length = FRAME_HEADER.unpack(header)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION:
+        raise ValueError('Not a frame of aggregates')
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f'Frame of {length} bytes is too large')
+    payload = stream.read(length)
+    if len(payload) < length:
+        raise ValueError('Connection closed in the middle of a frame')
+    return decode_frame(payload)
+
+
+class AggregateShipper(threading.Thread):
+    """A class used to ship the per second aggregates of this node to an
+    Aggregator, which merges those of every node to alert on the hits of
+    the whole fleet
+
+    Batches are aggregated as they arrive into per second hits, section
+    hits and bytes, status classes, response size sketches and client
+    sketches, and every ship_interval seconds whatever was aggregated is
+    sent as a single frame, so the traffic to the aggregator depends on
+    the number of distinct sections and clients and not on the lines.
+    Frames that cannot be sent, eg. while the aggregator restarts, are
+    kept up to max_unsent_bytes and sent once it is reachable again
+
+    Shipping never waits on the network: frames are written to a non
+    blocking socket, carrying on from where the last write stopped, and an
+    aggregator that cannot be reached is tried again with an exponential
+    backoff. Its queue should drop batches when full, so that a stalled
+    aggregator never holds up the reader and the local monitoring
+
+    Attributes:
+        address (str): tcp://host:port or unix:///path of the aggregator
+        node (str): Name of this node
+        logs_queue (BatchQueue): Batches of log lines as they are produced
+        ship_interval (float): Seconds between frames
+        client_k (int): Number of clients tracked per second
+        max_unsent_bytes (int): Size of the frames kept while the
+            aggregator cannot be reached, the oldest are dropped beyond it
+        partial (PartialStats): Aggregates since the last frame
+        latest (int): Latest log time seen
+        unsent (deque): (frame, lines) of the frames not sent yet
+        unsent_bytes (int): Size of the unsent frames
+        head_sent (int): Bytes of the first unsent frame already written
+        connection (socket): Non blocking connection to the aggregator,
+            None when not connected
+        connect_timeout (float): Seconds to wait for a connection
+        backoff (float): Seconds to wait before connecting again, 0 while
+            the aggregator is reachable
+        retry_at (float): Monotonic time of the next connection attempt
+        frames_sent (int): Number of frames sent
+        stage_stats (StageStats): Lines aggregated, and lines of the
+            frames that were dropped
+        thread_terminated (boolean): Flag to kill thread
+    """
+
+    def __init__(self, address, node, logs_queue, ship_interval=1.0,
+                 client_k=100, max_unsent_bytes=16 << 20,
+                 connect_timeout=0.5):
+        """
+        Args:
+            address (str): tcp://host:port or unix:///path of the
+                aggregator
+            node (str): Name of this node, eg. its host name
+            logs_queue (BatchQueue): Batches of log lines as they are
+                produced
+            ship_interval (float): Seconds between frames
+            client_k (int): Number of clients tracked per second
+            max_unsent_bytes (int): Size of the frames kept while the
+                aggregator cannot be reached
+            connect_timeout (float): Seconds to wait for a connection
+        """
+        threading.Thread.__init__(self)
+        parse_address(address)
+        self.address = address
+        self.node = node
+        self.logs_queue = logs_queue
+        self.ship_interval = ship_interval
+        self.client_k = client_k
+        self.max_unsent_bytes = max_unsent_bytes
+        self.partial = PartialStats(0, 1, client_k)
+        self.latest = None
+        self.unsent = deque()
+        self.unsent_bytes = 0
+        self.head_sent = 0
+        self.connection = None
+        self.connect_timeout = connect_timeout
+        self.backoff = 0.0
+        self.retry_at = 0.0
+        self.frames_sent = 0
+        self.stage_stats = StageStats()
+        self.thread_terminated = False
+
+    def run(self):
+        """
+        Starts the thread process. The aggregates left are shipped once the
+        queue is closed
+        """
+        shipped = monotonic()
+        try:
+            while not self.thread_terminated:
+                timeout = max(shipped + self.ship_interval - monotonic(), 0)
+                batches = self.logs_queue.get(timeout)
+                if not batches and self.logs_queue.closed:
+                    break
+
+                for records in batches:
+                    started = perf_counter()
+                    self.process_records(records)
+                    self.stage_stats.record_batch(
+                        records, perf_counter() - started
+                    )
+
+                if monotonic() - shipped >= self.ship_interval:
+                    shipped = monotonic()
+                    self.ship()
+        finally:
+            # Unblocks a reader waiting on a full queue
+            self.logs_queue.close()
+            self.ship()
+            self.flush()
+            self.close()
+
+    def process_records(self, records):
+        """
+        Adds a batch of records to the aggregates of the next frame
+
+        Args:
+            records (list): LogRecord for each parsed log line
+        """
+        if not records:
+            return
+        self.partial.add_records(records)
+        latest = max(record.time for record in records)
+        if self.latest is None or latest > self.latest:
+            self.latest = latest
+
+    def ship(self):
+        """
+        Queues the aggregates since the last frame as a frame, and writes
+        as much of the unsent frames as the connection takes without
+        waiting
+
+        Returns:
+            boolean: Whether every frame was sent
+        """
+        partial, self.partial = (
+            self.partial, PartialStats(0, 1, self.client_k)
+        )
+        frame = encode_frame(self.node, partial, self.latest)
+        self.unsent.append((frame, sum(partial.hits.values())))
+        self.unsent_bytes += len(frame)
+
+        # A frame that is partly written has to be finished first
+        first = 1 if self.head_sent else 0
+        while (self.unsent_bytes > self.max_unsent_bytes and
+               len(self.unsent) > first + 1):
+            dropped, lines = self.unsent[first]
+            del self.unsent[first]
+            self.unsent_bytes -= len(dropped)
+            self.stage_stats.dropped += lines
+        return self.send()
+
+    def send(self):
+        """
+        Writes the unsent frames until the connection would block,
+        connecting first when the backoff allows it
+
+        Returns:
+            boolean: Whether every frame was sent
+        """
+        if self.connection is None:
+            if monotonic() < self.retry_at:
+                return False
+            try:
+                self.connection = connect(
+                    self.address, self.connect_timeout
+                )
+                self.connection.setblocking(False)
+            except OSError:
+                self.__back_off()
+                return False
+
+        try:
+            while self.unsent:
+                frame, _ = self.unsent[0]
+                self.head_sent += self.connection.send(
+                    memoryview(frame)[self.head_sent:]
+                )
+                if self.head_sent < len(frame):
+                    return False
+                self.unsent.popleft()
+                self.unsent_bytes -= len(frame)
+                self.head_sent = 0
+                self.frames_sent += 1
+        except BlockingIOError:
+            return False
+        except OSError:
+            # Sent again from the start on the next connection
+            self.close()
+            self.__back_off()
+            return False
+        self.backoff = 0.0
+        return True
+
+    def flush(self, timeout=1.0):
+        """
+        Waits up to timeout for the unsent frames to be written, eg. before
+        stopping
+
+        Returns:
+            boolean: Whether every frame was sent
+        """
+        deadline = monotonic() + timeout
+        while not self.send():
+            remaining = deadline - monotonic()
+            if self.connection is None or remaining <= 0:
+                return False
+            select.select([], [self.connection], [], remaining)
+        return True
+
+    def close(self):
+        """
+        Closes the connection to the aggregator
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        self.head_sent = 0
+
+    def __back_off(self):
+        """
+        Doubles the wait before the next connection attempt
+        """
+        self.backoff = min(max(2 * self.backoff, MIN_BACKOFF), MAX_BACKOFF)
+        self.retry_at = monotonic() + self.backoff
+
+
+class FrameHandler(socketserver.StreamRequestHandler):
+    """Reads the frames a node sends over its connection and hands them to
+    the Aggregator. A connection that sends anything else is closed
+    """
+
+    def handle(self):
+        aggregator = self.server.aggregator
+        node = None
+        try:
+            while not aggregator.thread_terminated:
+                frame = read_frame(self.rfile)
+                if frame is None:
+                    break
+                if node is None:
+                    node = frame.node
+                    aggregator.add_node(node, self.connection)
+                aggregator.add_frame(frame)
+        except (OSError, ValueError):
+            pass
+        finally:
+            if node is not None:
+                aggregator.remove_node(node, self.connection)
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class ThreadingUnixStreamServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+class Aggregator(threading.Thread):
+    """A class used to merge the per second aggregates shipped by the
+    AggregateShipper of every node, and to drive an alert and a stats
+    consumer with them in log time, as if the lines of every node were in
+    one log
+
+    Each second is held until every connected node has shipped it or a
+    later second, so that it is complete, but never for more than max_lag
+    seconds of log time behind the latest second of any node, or max_lag
+    seconds of wall clock after it first arrived. A slow or idle node
+    therefore delays the alerts by at most max_lag. Aggregates that arrive
+    for a second that was already released are released on their own, the
+    way out of order lines are counted
+
+    Attributes:
+        address (str): tcp://host:port or unix:///path listened on
+        alerts (LogAlertConsumer): Alert consumer using log time, driven by
+            the merged hits
+        stats (LogStatsConsumer): Stats consumer using log time, driven by
+            the merged counts
+        max_lag (float): Seconds a second is held for at most
+        server (socketserver.BaseServer): Server accepting the nodes
+        nodes (dict): Name of each connected node to its latest log time
+        connections (dict): Name of each connected node to its sockets
+        pending (dict): Second of log time to its merged SecondStats, for
+            the seconds not released yet
+        pending_since (dict): Second of log time to the monotonic time it
+            first arrived
+        newest (int): Latest log time seen from any node
+        released (int): Latest second released to the consumers
+        frames_received (int): Number of frames received
+        lines_received (int): Number of log lines in the frames
+        lock (threading.Lock): Lock since frames arrive on the threads of
+            the connections
+        thread_terminated (boolean): Flag to kill thread
+    """
+
+    def __init__(self, address, alerts, stats, max_lag=5.0):
+        """
+        Args:
+            address (str): tcp://host:port or unix:///path to listen on,
+                a port of 0 picks any free port
+            alerts (LogAlertConsumer): Alert consumer with use_log_time
+            stats (LogStatsConsumer): Stats consumer with use_log_time
+            max_lag (float): Seconds a second is held for at most
+        """
+        threading.Thread.__init__(self)
+        if alerts.rule_engine:
+            raise ValueError('Alert rules need the records of the lines')
+
+        family, target = parse_address(address)
+        if family == socket.AF_INET:
+            self.server = ThreadingTCPServer(target, FrameHandler)
+            host, port = self.server.server_address[:2]
+            address = f'tcp://{host}:{port}'
+        else:
+            # A socket left behind by a previous run is replaced
+            if os.path.exists(target) and stat.S_ISSOCK(
+                os.stat(target).st_mode
+            ):
+                os.remove(target)
+            self.server = ThreadingUnixStreamServer(target, FrameHandler)
+        self.server.aggregator = self
+        self.server.timeout = 0.1
+        self.address = address
+        self.alerts = alerts
+        self.stats = stats
+        self.max_lag = max_lag
+        self.nodes = {}
+        self.connections = {}
+        self.pending = {}
+        self.pending_since = {}
+        self.newest = None
+        self.released = None
+        self.frames_received = 0
+        self.lines_received = 0
+        self.lock = threading.Lock()
+        self.thread_terminated = False
+
+    def run(self):
+        """
+        Starts the thread process. Whatever is pending is released once it
+        is terminated, and the stats of the last interval are saved
+        """
+        try:
+            while not self.thread_terminated:
+                self.server.handle_request()
+                self.release()
+        finally:
+            self.close()
+            self.release(flush=True)
+            if self.stats.interval_start is not None:
+                self.stats.save_stats()
+
+    def close(self):
+        """
+        Stops accepting nodes and closes the connections of every node
+        """
+        with self.lock:
+            sockets = [
+                connection for node_connections in self.connections.values()
+                for connection in node_connections
+            ]
+        for connection in sockets:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.server.server_close()
+        family, target = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(target):
+            os.remove(target)
+
+    def add_node(self, node, connection):
+        """
+        Registers the connection of a node
+        """
+        with self.lock:
+            self.nodes.setdefault(node, None)
+            self.connections.setdefault(node, set()).add(connection)
+
+    def remove_node(self, node, connection):
+        """
+        Forgets a node once its last connection is closed, so that its
+        seconds are no longer waited for
+        """
+        with self.lock:
+            node_connections = self.connections.get(node, set())
+            node_connections.discard(connection)
+            if not node_connections:
+                self.connections.pop(node, None)
+                self.nodes.pop(node, None)
+
+    def add_frame(self, frame):
+        """
+        Merges the aggregates of a frame into the pending seconds
+
+        Args:
+            frame (Frame): Frame shipped by a node
+        """
+        now = monotonic()
+        with self.lock:
+            self.frames_received += 1
+            self.lines_received += frame.lines
+            if frame.latest is not None:
+                latest = self.nodes.get(frame.node)
+                if latest is None or frame.latest > latest:
+                    self.nodes[frame.node] = frame.latest
+                if self.newest is None or frame.latest > self.newest:
+                    self.newest = frame.latest
+
+            for timestamp, counts in frame.seconds.items():
+                if timestamp in self.pending:
+                    self.pending[timestamp].merge(counts)
+                else:
+                    self.pending[timestamp] = counts
+                    self.pending_since[timestamp] = now
+
+    def release(self, flush=False):
+        """
+        Feeds the consumers the pending seconds that are complete or have
+        been held for max_lag, in log time order
+
+        Args:
+            flush (boolean): Release every pending second
+
+        Returns:
+            int: Number of seconds released
+        """
+        with self.lock:
+            if not self.pending:
+                return 0
+
+            # Nodes that have not shipped any lines yet hold back every
+            # second, up to max_lag
+            until = self.newest - self.max_lag
+            watermarks = list(self.nodes.values())
+            if None not in watermarks:
+                until = max(until, min(watermarks, default=self.newest))
+            expired = [
+                timestamp for timestamp, since in self.pending_since.items()
+                if monotonic() - since >= self.max_lag
+            ]
+            if expired:
+                until = max(until, max(expired))
+
+            seconds = sorted(
+                timestamp for timestamp in self.pending
+                if flush or timestamp <= until
+            )
+            released = []
+            for timestamp in seconds:
+                released.append((timestamp, self.pending.pop(timestamp)))
+                del self.pending_since[timestamp]
+
+        for timestamp, counts in released:
+            self.__process_second(timestamp, counts)
+        return len(released)
+
+    def __process_second(self, timestamp, counts):
+        """
+        Adds the merged aggregates of a second to the consumers, starting
+        the next stats interval when the second is past the current one
+        """
+        self.alerts.process_hits(timestamp, counts.hits)
+        if self.released is None or timestamp > self.released:
+            self.released = timestamp
+
+        stats = self.stats
+        if stats.interval_start is None:
+            stats.interval_start = timestamp
+        elif timestamp >= stats.interval_start + stats.interval:
+            stats.save_stats()
+            # Skip over any intervals without log lines
+            skipped = (timestamp - stats.interval_start) // stats.interval
+            stats.interval_start += skipped * stats.interval
+        stats.merge_counts(
+            counts.section_size, counts.section_counts, counts.status_counts,
+            counts.size_sketches, counts.client_counts, counts.client_size
+        )
+
+        if stats.history:
+            stats.history.add_counts(
+                Counter({(timestamp, section): count for section, count
+                         in counts.section_counts.items()}),
+                {(timestamp, section): size for section, size
+                 in counts.section_size.items()},
+                Counter({(timestamp, status): count for status, count
+                         in counts.status_counts.items()})
+            )
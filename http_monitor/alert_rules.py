@@ -0,0 +1,362 @@
+from collections import Counter
+from collections import defaultdict
+from collections import namedtuple
+from datetime import datetime
+from http_monitor.sliding_window import SlidingWindowCounter
+from operator import attrgetter
+import re
+
+GET_TIME = attrgetter('time')
+GET_SECTION = attrgetter('section')
+GET_STATUS = attrgetter('status')
+GET_SIZE = attrgetter('size')
+
+# Average hits / second, average bytes / second, and the fraction of hits
+# with a 5XX status, each over the window of the rule
+HITS = 'hits'
+BYTES = 'bytes'
+ERROR_RATE = 'error_rate'
+METRICS = (HITS, BYTES, ERROR_RATE)
+
+# Per second series the rules are worked out from
+ERRORS = 'errors'
+
+UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600}
+RULE_PATTERN = re.compile(
+    r'^(?P<metric>\w+)(?:@(?P<section>[^>]+))?>(?P<threshold>[\d.e+-]+)'
+    r'/(?P<window>\d+)(?P<unit>[smh]?)$'
+)
+
+AlertRule = namedtuple(
+    'AlertRule', ['name', 'metric', 'section', 'threshold', 'window']
+)
+AlertRule.__doc__ = """A rule that alerts while a metric over a window of
+log time is above a threshold
+
+Attributes:
+    name (str): Name shown in the alerts, the rule spec when parsed
+    metric (str): HITS, BYTES or ERROR_RATE
+    section (str): Only count this section, None for every section
+    threshold (float): Value the metric should stay at or below
+    window (int): Seconds the metric is averaged over
+"""
+
+
+def parse_rule(spec):
+    """
+    Parses a rule written as metric[@section]>threshold/window, where the
+    window is in seconds or has an s, m or h unit, eg. hits@api>5/10s,
+    error_rate>0.05/15m or bytes>1000000/120
+
+    Args:
+        spec (str): Rule spec
+
+    Returns:
+        AlertRule: Rule named after the spec
+
+    Raises:
+        ValueError: If the spec is not a valid rule
+    """
+    match = RULE_PATTERN.match(spec.replace(' ', ''))
+    if not match or match['metric'] not in METRICS:
+        raise ValueError(f'Invalid alert rule: {spec}')
+
+    window = int(match['window']) * UNITS[match['unit']]
+    if window <= 0:
+        raise ValueError(f'Invalid alert rule window: {spec}')
+    return AlertRule(
+        spec, match['metric'], match['section'], float(match['threshold']),
+        window
+    )
+
+
+class RuleEngine:
+    """A class used to evaluate many alert rules in a single pass over each
+    batch of records
+
+    Each batch is first aggregated into per second series, hits, bytes and
+    5XX hits overall and for each section a rule is about, and only the
+    series some rule needs are built. Every distinct series and window pair
+    has one SlidingWindowCounter shared by all of the rules on it, eg. a
+    hits and an error rate rule over the same window. The rules are then
+    checked once per second of log time in the batch rather than once per
+    line, so the cost per line does not grow with the number of rules
+
+    Attributes:
+        rules (list): AlertRule to evaluate
+        windows (dict): (series, section, window) to SlidingWindowCounter
+        series (set): (series, section) of every per second series a rule
+            needs, eg. (HITS, None) or (BYTES, 'api')
+        sections (set): Sections a rule is about
+        start_time (int): First second of log time seen, the first window
+            of each rule is waited out from it
+        latest (int): Most recent second of log time seen
+        alerted (dict): Rule name to whether the rule is alerting
+        alert_data (dict): Rule name to its latest alert data
+        alert_count (int): Number of alerts of every rule
+        alert_version (int): Incremented every time a rule alerts / recovers
+        listeners (list): Callables given the alert data on alert / recover
+        pending_alerts (list): Copies of the alert data not given to the
+            listeners yet
+    """
+
+    def __init__(self, rules):
+        """
+        Args:
+            rules (list): AlertRule to evaluate
+        """
+        self.rules = list(rules)
+        self.windows = {}
+        for rule in self.rules:
+            for series in self.__series(rule):
+                key = (series, rule.section, rule.window)
+                if key not in self.windows:
+                    self.windows[key] = SlidingWindowCounter(rule.window)
+        self.series = {(series, section) for series, section, _
+                       in self.windows}
+        self.sections = {
+            rule.section for rule in self.rules if rule.section is not None
+        }
+        self.start_time = None
+        self.latest = None
+        self.alerted = {rule.name: False for rule in self.rules}
+        self.alert_data = {}
+        self.alert_count = 0
+        self.alert_version = 0
+        self.listeners = []
+        self.pending_alerts = []
+
+    def add_listener(self, listener):
+        """
+        Registers a callable that is given the alert data every time a rule
+        alerts or recovers
+
+        Args:
+            listener (callable): Takes a copy of the alert data dict
+        """
+        self.listeners.append(listener)
+
+    def process_records(self, records, weight=1):
+        """
+        Adds a batch of records to the windows, then gives listeners the
+        alert data of the rules that alerted or recovered
+
+        Args:
+            records (list): LogRecord for each parsed log line
+            weight (int): Number of log lines each record stands for, more
+                than 1 when the batch was sampled
+        """
+        self.add_records(records, weight)
+        self.notify_listeners()
+
+    def add_records(self, records, weight=1):
+        """
+        Adds a batch of records to the windows and checks every rule once
+        per second of log time in the batch, without calling the listeners,
+        eg. while the LogAlertConsumer holds its lock
+
+        Args:
+            records (list): LogRecord for each parsed log line
+            weight (int): Number of log lines each record stands for, more
+                than 1 when the batch was sampled
+        """
+        if not records:
+            return
+
+        per_second = self.__aggregate(records, weight)
+        hits = per_second[(HITS, None)]
+        if self.start_time is None:
+            self.start_time = min(hits)
+
+        for second in sorted(hits):
+            for (series, section, _), window in self.windows.items():
+                counts = per_second.get((series, section))
+                window.add(second, counts.get(second, 0) if counts else 0)
+            if self.latest is None or second > self.latest:
+                self.latest = second
+            self.__check_rules(self.latest)
+
+    def notify_listeners(self):
+        """
+        Gives listeners the alert data of every rule that alerted or
+        recovered since the last call
+        """
+        pending, self.pending_alerts = self.pending_alerts, []
+        for alert_data in pending:
+            for listener in self.listeners:
+                listener(dict(alert_data))
+
+    def checkpoint(self):
+        """
+        Returns:
+            dict: Copy of the windows and the state of every rule that can
+                be serialized, and restored with restore
+        """
+        return {
+            'start_time': self.start_time,
+            'latest': self.latest,
+            'alert_count': self.alert_count,
+            'alerted': dict(self.alerted),
+            'alert_data': {
+                name: dict(alert_data)
+                for name, alert_data in self.alert_data.items()
+            },
+            'windows': [
+                [series, section, size, window.state()]
+                for (series, section, size), window in self.windows.items()
+            ]
+        }
+
+    def restore(self, state):
+        """
+        Restores the state saved by checkpoint. Rules are matched by name,
+        which includes their window, so rules that were added since start
+        from scratch and rules that were removed are ignored
+
+        Args:
+            state (dict): State returned by checkpoint
+        """
+        for series, section, size, window_state in state['windows']:
+            window = self.windows.get((series, section, size))
+            if window:
+                window.restore(window_state)
+        self.start_time = state['start_time']
+        self.latest = state['latest']
+        self.alert_count = state['alert_count']
+        for name, alerted in state['alerted'].items():
+            if name in self.alerted:
+                self.alerted[name] = alerted
+                if name in state['alert_data']:
+                    self.alert_data[name] = state['alert_data'][name]
+        self.alert_version += 1
+
+    def value(self, rule):
+        """
+        Returns:
+            float: Current value of the metric of a rule over its window
+        """
+        if rule.metric == ERROR_RATE:
+            hits = self.windows[(HITS, rule.section, rule.window)].total
+            errors = self.windows[(ERRORS, rule.section, rule.window)].total
+            return errors / hits if hits else 0.0
+        return self.windows[(rule.metric, rule.section, rule.window)].average()
+
+    def __series(self, rule):
+        if rule.metric == ERROR_RATE:
+            return (HITS, ERRORS)
+        return (rule.metric,)
+
+    def __aggregate(self, records, weight):
+        """
+        Returns:
+            dict: (series, section) to a Counter of counts per second
+        """
+        times = list(map(GET_TIME, records))
+        per_second = {(HITS, None): Counter(times)}
+
+        if (ERRORS, None) in self.series:
+            errors = Counter()
+            for (second, status), count in Counter(
+                zip(times, map(GET_STATUS, records))
+            ).items():
+                if status[0] == '5':
+                    errors[second] += count
+            per_second[(ERRORS, None)] = errors
+
+        if (BYTES, None) in self.series:
+            size = defaultdict(int)
+            for second, record_size in zip(times, map(GET_SIZE, records)):
+                size[second] += record_size
+            per_second[(BYTES, None)] = size
+
+        if self.sections:
+            self.__aggregate_sections(records, times, per_second)
+
+        if weight != 1:
+            for counts in per_second.values():
+                for second in counts:
+                    counts[second] *= weight
+        return per_second
+
+    def __aggregate_sections(self, records, times, per_second):
+        """
+        Adds the series of the sections a rule is about
+        """
+        sections = self.sections
+        for section in sections:
+            per_second[(HITS, section)] = Counter()
+            per_second[(ERRORS, section)] = Counter()
+            per_second[(BYTES, section)] = defaultdict(int)
+
+        # Statuses are only counted in when a section error rate is needed
+        section_names = list(map(GET_SECTION, records))
+        if any(series == ERRORS and section for series, section
+               in self.series):
+            for (second, section, status), count in Counter(
+                zip(times, section_names, map(GET_STATUS, records))
+            ).items():
+                if section in sections:
+                    per_second[(HITS, section)][second] += count
+                    if status[0] == '5':
+                        per_second[(ERRORS, section)][second] += count
+        else:
+            for (second, section), count in Counter(
+                zip(times, section_names)
+            ).items():
+                if section in sections:
+                    per_second[(HITS, section)][second] += count
+
+        if any(series == BYTES and section for series, section
+               in self.series):
+            for second, section, size in zip(
+                times, section_names, map(GET_SIZE, records)
+            ):
+                if section in sections:
+                    per_second[(BYTES, section)][second] += size
+
+    def __check_rules(self, timestamp):
+        """
+        Alerts or recovers every rule whose state changed, once its first
+        window of log time has passed
+        """
+        for rule in self.rules:
+            if timestamp - self.start_time < rule.window:
+                continue
+
+            value = self.value(rule)
+            breached = value > rule.threshold
+            if breached != self.alerted[rule.name]:
+                self.alerted[rule.name] = breached
+                self.__notify(rule, value, timestamp, breached)
+
+    def __notify(self, rule, value, timestamp, breached):
+        """
+        Updates the alert data of a rule and keeps a copy of it for the
+        listeners
+        """
+        date = datetime.fromtimestamp(timestamp).strftime('%b-%d-%Y %H:%M:%S')
+        alert_data = self.alert_data.setdefault(
+            rule.name, {'rule': rule.name, 'alert_count': 0}
+        )
+        if breached:
+            self.alert_count += 1
+            alert_data['type'] = 'alert'
+            alert_data['alert_count'] += 1
+            alert_data['last_alert_time'] = date
+            alert_data['msg_line1'] = f'Rule {rule.name} generated an alert:'
+            alert_data['msg_line2'] = (
+                f'{rule.metric} = {value:.4g}, triggered at {date}'
+            )
+        else:
+            alert_data['type'] = 'recovered'
+            alert_data['msg_line1'] = (
+                f'Rule {rule.name} normalized - {rule.metric} = {value:.4g}'
+            )
+            alert_data['msg_line2'] = f'recovered at {date}'
+        alert_data['time'] = timestamp
+        alert_data['value'] = value
+        hits = self.windows.get((HITS, rule.section, rule.window))
+        alert_data['hits'] = hits.total if hits else None
+
+        self.alert_version += 1
+        self.pending_alerts.append(dict(alert_data))
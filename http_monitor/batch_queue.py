@@ -0,0 +1,156 @@
+import threading
+
+# What put does with a batch that does not fit in a full queue
+BLOCK = 'block'
+DROP = 'drop'
+SAMPLE = 'sample'
+POLICIES = (BLOCK, DROP, SAMPLE)
+
+
+class ReadBatch(list):
+    """A batch of records along with how far its log file had been read,
+    so that a consumer knows which lines it has processed and a restart
+    can resume from there
+
+    Attributes:
+        read_position (dict): Path, device, inode and offset just after
+            the last line of the batch, see FileFollower.position
+    """
+
+    def __init__(self, records, read_position=None):
+        list.__init__(self, records)
+        self.read_position = read_position
+
+
+class SampledBatch(ReadBatch):
+    """A batch of which only 1 in every weight records were kept, so that
+    each record stands for weight records when counted
+
+    Attributes:
+        weight (int): Number of records each kept record stands for
+    """
+
+    def __init__(self, records, weight, read_position=None):
+        ReadBatch.__init__(self, records, read_position)
+        self.weight = weight
+
+
+class BatchQueue:
+    """A class used to hand off batches of parsed log data from the reader
+    to a consumer. Consumers block until a batch is published or a deadline
+    passes instead of spinning on an empty queue
+
+    The queue can be bounded to a number of lines, so that memory stays
+    fixed when a consumer falls behind. A batch that does not fit either
+    blocks the reader until the consumer catches up, is dropped, or is
+    sampled down to 1 in every sample_rate records. A batch always fits in
+    an empty queue, so a batch larger than the capacity never blocks forever
+
+    Attributes:
+        batches (list): Batches that have been published but not consumed
+        condition (Condition): Used to wake up a waiting consumer
+        not_full (Condition): Used to wake up a reader blocked on a full
+            queue, shares the lock of condition
+        closed (boolean): Flag set once the producer will publish no more,
+            or the consumer will take no more
+        pending_lines (int): Number of lines in the batches not consumed
+        capacity (int): Maximum number of pending lines, None for unbounded
+        policy (str): BLOCK, DROP or SAMPLE when a batch does not fit
+        sample_rate (int): Keep 1 in every sample_rate records with SAMPLE
+        dropped_lines (int): Number of lines dropped or sampled out
+    """
+
+    def __init__(self, capacity=None, policy=BLOCK, sample_rate=10):
+        """
+        Args:
+            capacity (int): Maximum number of pending lines, None for
+                unbounded
+            policy (str): BLOCK, DROP or SAMPLE when a batch does not fit
+            sample_rate (int): Keep 1 in every sample_rate records with
+                SAMPLE
+        """
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown queue policy: {policy}')
+        self.batches = []
+        self.pending_lines = 0
+        lock = threading.Lock()
+        self.condition = threading.Condition(lock)
+        self.not_full = threading.Condition(lock)
+        self.closed = False
+        self.capacity = capacity
+        self.policy = policy
+        self.sample_rate = sample_rate
+        self.dropped_lines = 0
+
+    def __len__(self):
+        return len(self.batches)
+
+    def put(self, batch):
+        """
+        Publishes a batch and wakes up the consumer. With a full queue this
+        blocks, drops or samples the batch depending on the policy
+
+        Args:
+            batch (list): Parsed log data to hand off
+
+        Returns:
+            int: Number of lines of the batch that were not handed off
+        """
+        if not batch:
+            return 0
+
+        lines = len(batch)
+        with self.condition:
+            if self.policy == BLOCK:
+                while not self.closed and not self.__fits(lines):
+                    self.not_full.wait()
+            elif self.policy == SAMPLE and not self.__fits(lines):
+                batch = SampledBatch(
+                    batch[::self.sample_rate], self.sample_rate,
+                    getattr(batch, 'read_position', None)
+                )
+
+            # A sampled batch that still does not fit is dropped as well
+            if self.closed or not self.__fits(len(batch)):
+                dropped = lines
+            else:
+                dropped = lines - len(batch)
+                self.batches.append(batch)
+                self.pending_lines += len(batch)
+                self.condition.notify()
+            self.dropped_lines += dropped
+        return dropped
+
+    def get(self, timeout=None):
+        """
+        Waits for published batches and takes all of them at once
+
+        Args:
+            timeout (float): Seconds to wait for a batch, None waits forever
+
+        Returns:
+            list: Batches published since the last call, empty on timeout
+        """
+        with self.condition:
+            if not self.batches and not self.closed:
+                self.condition.wait(timeout)
+            batches, self.batches = self.batches, []
+            self.pending_lines = 0
+            self.not_full.notify_all()
+        return batches
+
+    def close(self):
+        """
+        Marks the queue as finished and wakes up any waiting consumer, or
+        reader blocked on a full queue
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+            self.not_full.notify_all()
+
+    def __fits(self, lines):
+        return (
+            self.capacity is None or not self.pending_lines or
+            self.pending_lines + lines <= self.capacity
+        )
@@ -0,0 +1,235 @@
+import json
+import os
+import threading
+import time
+
+# Bumped whenever the layout of the checkpoint changes
+CHECKPOINT_VERSION = 1
+CHECKPOINT_FILE = 'state.json'
+
+
+def load_checkpoint(checkpoint_path):
+    """
+    Returns:
+        dict: State saved by a Checkpointer, None if there is none or it
+            cannot be read
+    """
+    try:
+        with open(checkpoint_path) as checkpoint_file:
+            state = json.load(checkpoint_file)
+    except (OSError, ValueError):
+        return None
+    if state.get('version') != CHECKPOINT_VERSION:
+        return None
+    return state
+
+
+def restore_checkpoint(checkpoint_path, alerts, stats, file_alerts=None):
+    """
+    Restores the consumers from the last checkpoint, if there is one.
+    Called before the threads are started
+
+    Args:
+        checkpoint_path (str): File the Checkpointer saves to
+        alerts (LogAlertConsumer): Aggregated alert consumer
+        stats (LogStatsConsumer): Stats consumer
+        file_alerts (dict): Log file path to its LogAlertConsumer
+
+    Returns:
+        boolean: Whether a checkpoint was restored
+    """
+    state = load_checkpoint(checkpoint_path)
+    if state is None:
+        return False
+
+    alerts.restore(state['alerts'])
+    stats.restore(state['stats'])
+    for path, consumer in (file_alerts or {}).items():
+        if path in state['files']:
+            consumer.restore(state['files'][path])
+    return True
+
+
+def start_positions(state, log_file_path):
+    """
+    Args:
+        state (dict): State saved by a Checkpointer, None if there is none
+        log_file_path (str): Path of a log file being read
+
+    Returns:
+        list: Read positions in the log file of the last batch each of the
+            consumers processed, None if none of them processed one
+    """
+    if state is None:
+        return None
+    consumer_states = [state['alerts'], state['stats']]
+    consumer_states += state['files'].values()
+    positions = [
+        consumer_state['read_positions'][log_file_path]
+        for consumer_state in consumer_states
+        if log_file_path in consumer_state['read_positions']
+    ]
+    return positions or None
+
+
+class ReadPositions:
+    """A class used by a consumer to keep how far it has processed each log
+    file, from the read positions of its batches. After a restart the
+    reader resumes from the earliest position of all of the consumers, so
+    the batches read again that a consumer had already processed are
+    skipped. The reader ends the blocks it reads again on the position of
+    every consumer, so no batch holds both lines a consumer processed and
+    lines it did not
+
+    Attributes:
+        processed (dict): Log file path to the read position of the last
+            batch processed
+        restored (dict): Log file path to the read position restored from
+            a checkpoint, until the batches read again have caught up
+    """
+
+    def __init__(self):
+        self.processed = {}
+        self.restored = {}
+
+    def track(self, batch):
+        """
+        Records the read position of a batch about to be processed
+
+        Args:
+            batch (list): Batch of records, with a read position when it
+                was read from a log file
+
+        Returns:
+            boolean: False for a batch that was processed before the
+                restart, which must be skipped
+        """
+        position = getattr(batch, 'read_position', None)
+        if position is None:
+            return True
+
+        path = position['path']
+        restored = self.restored.get(path)
+        if restored is not None:
+            same_file = (
+                (restored['device'], restored['inode']) ==
+                (position['device'], position['inode'])
+            )
+            if same_file and position['offset'] <= restored['offset']:
+                return False
+            del self.restored[path]
+        self.processed[path] = position
+        return True
+
+    def checkpoint(self):
+        """
+        Returns:
+            dict: Copy of the read positions that can be serialized
+        """
+        return dict(self.processed)
+
+    def restore(self, positions):
+        """
+        Args:
+            positions (dict): Read positions returned by checkpoint
+        """
+        self.processed = dict(positions)
+        self.restored = dict(positions)
+
+
+class Checkpointer(threading.Thread):
+    """A class used to periodically save the alert windows, alert state and
+    counts and the stats totals, so that a restart resumes alerting straight
+    away instead of waiting out a whole time window. Each consumer saves
+    the read position of the last batch it processed along with its state,
+    so a restart reads again the batches that were still queued and
+    resumes every consumer exactly where it stopped
+
+    The consumers only copy their state under their lock, which is bounded
+    by the size of the windows and not the traffic. Serializing and writing
+    happen on this thread, and the file is only rewritten when the state
+    has changed, atomically so that a crash never leaves half a checkpoint
+
+    Attributes:
+        checkpoint_path (str): File the state is saved to
+        alerts (LogAlertConsumer): Aggregated alert consumer
+        stats (LogStatsConsumer): Stats consumer
+        file_alerts (dict): Log file path to its LogAlertConsumer
+        interval (float): Seconds between checkpoints
+        saved_state (str): Serialized state of the last checkpoint written
+        checkpoints_written (int): Number of checkpoints written
+        thread_terminated (boolean): Flag to kill thread
+    """
+
+    def __init__(self, checkpoint_path, alerts, stats, file_alerts=None,
+                 interval=10.0):
+        """
+        Args:
+            checkpoint_path (str): File to save the state to
+            alerts (LogAlertConsumer): Aggregated alert consumer
+            stats (LogStatsConsumer): Stats consumer
+            file_alerts (dict): Log file path to its LogAlertConsumer
+            interval (float): Seconds between checkpoints
+        """
+        threading.Thread.__init__(self)
+        self.checkpoint_path = checkpoint_path
+        self.alerts = alerts
+        self.stats = stats
+        self.file_alerts = file_alerts or {}
+        self.interval = interval
+        self.saved_state = None
+        self.checkpoints_written = 0
+        self.thread_terminated = False
+
+    def run(self):
+        """
+        Starts the thread process. Stops once the alert consumer has, so the
+        last checkpoint has everything it processed
+        """
+        try:
+            saved = time.monotonic()
+            while not self.thread_terminated and self.alerts.is_alive():
+                time.sleep(min(self.interval, 0.25))
+                if time.monotonic() - saved >= self.interval:
+                    saved = time.monotonic()
+                    self.save()
+        finally:
+            if self.alerts.is_alive():
+                self.alerts.join()
+            self.save()
+
+    def checkpoint(self):
+        """
+        Returns:
+            dict: Current state of the consumers
+        """
+        return {
+            'version': CHECKPOINT_VERSION,
+            'alerts': self.alerts.checkpoint(),
+            'stats': self.stats.checkpoint(),
+            'files': {
+                path: consumer.checkpoint()
+                for path, consumer in self.file_alerts.items()
+            }
+        }
+
+    def save(self):
+        """
+        Writes the current state if it changed since the last checkpoint
+
+        Returns:
+            boolean: Whether a checkpoint was written
+        """
+        state = json.dumps(self.checkpoint(), separators=(',', ':'))
+        if state == self.saved_state:
+            return False
+
+        temp_path = f'{self.checkpoint_path}.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            checkpoint_file.write(state)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+        self.saved_state = state
+        self.checkpoints_written += 1
+        return True
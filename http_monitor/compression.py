@@ -0,0 +1,78 @@
+import bz2
+import gzip
+import lzma
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Leading bytes of each supported compression format
+GZIP_MAGIC = b'\x1f\x8b'
+BZIP2_MAGIC = b'BZh'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def compression_format(input_file_path):
+    """
+    Detects the compression of a file from its leading bytes, so that
+    rotated archives such as access.log.2.gz or files without an extension
+    are detected too
+
+    Args:
+        input_file_path (str): Path of the log file
+
+    Returns:
+        str: gzip, bzip2, xz or zstd, None for a plain file
+    """
+    with open(input_file_path, "rb") as log_file:
+        magic = log_file.read(6)
+
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic.startswith(BZIP2_MAGIC):
+        return 'bzip2'
+    if magic.startswith(XZ_MAGIC):
+        return 'xz'
+    if magic.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return None
+
+
+def open_log_file(input_file_path):
+    """
+    Opens a log file for reading bytes, decompressing it on the fly when it
+    is compressed. Decompression is streamed, so memory does not depend on
+    the size of the file. Every frame of a zstd file is read, as written by
+    zstd --rsyncable, pzstd or loggers appending a frame per flush
+
+    Args:
+        input_file_path (str): Path of a plain, gzip, bzip2, xz or zstd
+            compressed log file
+
+    Returns:
+        file: Binary stream of the decompressed log lines
+
+    Raises:
+        RuntimeError: If the file is zstd compressed and the zstandard
+            package is not installed
+    """
+    compression = compression_format(input_file_path)
+    if compression == 'gzip':
+        return gzip.open(input_file_path, "rb")
+    if compression == 'bzip2':
+        return bz2.open(input_file_path, "rb")
+    if compression == 'xz':
+        return lzma.open(input_file_path, "rb")
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError(
+                'zstandard must be installed to read zstd compressed logs: '
+                'pip install zstandard'
+            )
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(input_file_path, "rb"), read_across_frames=True,
+            closefd=True
+        )
+    return open(input_file_path, "rb")
@@ -9,51 +9,58 @@ class Display(threading.Thread):
         reader (LogReader): Used to terminate thread if display is closed
         stats (LogStatsConsumer): Provides stats data to display
         alerts (LogAlertConsumer): Provides alert/recovered messaging
+        file_alerts (dict): Log file path to alert consumer of only that file
+        pipeline (PipelineMonitor): Provides the pipeline throughput and lag
+        pipeline_snapshot (dict): Latest snapshot of the pipeline
         stdscr (curses): Used for writing to CLI
+        window_border (curses): Border window, reused between frames
+        frame_timeout (int): Milliseconds to wait for a key between frames
         thread_terminated (boolean): Flag to kill thread
     """
 
-    def __init__(self, reader, stats, alerts):
+    def __init__(self, reader, stats, alerts, file_alerts=None, fps=4,
+                 pipeline=None):
         """
         Args:
-            reader (LogReader): LogReader class
+            reader (LogReader): LogReader or MultiFileTailer class
             stats (LogStatsConsumer): LogStatsConsumer class
             alerts (LogAlertConsumer): LogalertConsumer
+            file_alerts (dict): Log file path to LogAlertConsumer when more
+                than one file is monitored
+            fps (int): Maximum number of frames to draw per second
+            pipeline (PipelineMonitor): Shown when given
         """
         threading.Thread.__init__(self)
         self.reader = reader
         self.stats = stats
         self.alerts = alerts
+        self.file_alerts = file_alerts or {}
+        self.pipeline = pipeline
+        self.pipeline_snapshot = None
         self.stdscr = curses.initscr()
+        self.window_border = None
+        self.frame_timeout = max(int(1000 / fps), 1)
         self.thread_terminated = False
 
     def run(self):
         """
         Starts the thread process and writes to screen the data from the
-        consumers
+        consumers. The screen is only redrawn when the consumers have
+        published new data, and waiting for a key paces the frames
         """
         curses.curs_set(0)
-        self.stdscr.nodelay(1)
+        self.stdscr.timeout(self.frame_timeout)
 
-        max_height, max_width = self.stdscr.getmaxyx()
         curses.start_color()
         curses.init_pair(1, curses.COLOR_RED, curses.COLOR_BLACK)
         curses.init_pair(2, curses.COLOR_GREEN, curses.COLOR_BLACK)
 
+        drawn_version = None
         while not self.thread_terminated:
-            self.stdscr.erase()
-
-            self.stdscr.addstr(
-                1, 2, "HTTP Log Monitoring App (Press q to Quit)"
-            )
-
-            window_border = self.stdscr.subwin(max_height-1, max_width, 0, 0)
-            window_border.border()
-
-            self.__display_stats_data()
-            self.__display_alerts_data()
-
-            self.stdscr.refresh()
+            version = self.__data_version()
+            if version != drawn_version:
+                self.__draw()
+                drawn_version = version
 
             ch = self.stdscr.getch()
             if ch == ord('q'):
@@ -61,6 +68,54 @@ class Display(threading.Thread):
                 self.stats.thread_terminated = True
                 self.alerts.thread_terminated = True
                 self.thread_terminated = True
+            elif ch == curses.KEY_RESIZE:
+                self.window_border = None
+                drawn_version = None
+
+    def __data_version(self):
+        """
+        Versions of the data published by the consumers, which change every
+        time there is something new to draw. The pipeline is snapshotted on
+        every frame, but only counts as new when its counters, rates or
+        queues changed
+        """
+        if self.pipeline:
+            self.pipeline_snapshot = self.pipeline.snapshot()
+        return (
+            self.stats.stats_version,
+            self.alerts.alert_version,
+            sum(alerts.alert_version for alerts in self.file_alerts.values()),
+            self.alerts.rule_engine.alert_version
+            if self.alerts.rule_engine else None,
+            self.pipeline.version if self.pipeline else None
+        )
+
+    def __draw(self):
+        """
+        Draws a whole frame, reusing the border window between frames
+        """
+        self.stdscr.erase()
+
+        self.stdscr.addstr(
+            1, 2, "HTTP Log Monitoring App (Press q to Quit)"
+        )
+
+        if self.window_border is None:
+            max_height, max_width = self.stdscr.getmaxyx()
+            self.window_border = self.stdscr.subwin(
+                max_height-1, max_width, 0, 0
+            )
+        self.window_border.border()
+
+        self.__display_stats_data()
+        self.__display_alerts_data()
+        y = 20 if self.file_alerts else 13
+        if self.alerts.rule_engine:
+            y = self.__display_rule_alerts(y)
+        if self.pipeline:
+            self.__display_pipeline(y)
+
+        self.stdscr.refresh()
 
     def __display_stats_data(self):
         """
@@ -73,8 +128,9 @@ class Display(threading.Thread):
 
         self.stdscr.addstr(8, 2, "Stats from the Last 10 Seconds:")
 
-        section_size = stats_data.get("section_size")
-        section_counts = stats_data.get("section_counts")
+        top_sections = stats_data.get("top_sections")
+        section_percentiles = stats_data.get("section_percentiles", {})
+        top_clients = stats_data.get("top_clients", [])
         status_counts = stats_data.get("status_counts")
 
         y = 9
@@ -88,11 +144,19 @@ class Display(threading.Thread):
             y += 3
             self.stdscr.addstr(y, 2, "Top Two Sections:")
             for line in self.__build_top_n_sections(
-                        section_size, section_counts
+                        top_sections, section_percentiles
                     ):
                 y += 1
                 self.stdscr.addstr(y, 2, line)
 
+            y += 1
+            self.stdscr.addstr(y, 2, "Top Two Clients:")
+            for client, count, size in top_clients[:2]:
+                y += 1
+                self.stdscr.addstr(
+                    y, 2, f'{client}: {count} hits, {size:,} bytes'
+                )
+
     def __display_alerts_data(self):
         """
         Displays the alerts data from the alerts consumer
@@ -124,6 +188,80 @@ class Display(threading.Thread):
             y += 1
             self.stdscr.addstr(y, 50, alert_data['msg_line2'])
 
+        if self.file_alerts:
+            self.__display_file_alerts(y + 2)
+
+    def __display_file_alerts(self, y):
+        """
+        Displays which of the monitored files are currently alerting
+        """
+        alerting = [
+            path for path, alerts in self.file_alerts.items()
+            if alerts.alerted
+        ]
+
+        heading = f'Files Alerting: {len(alerting)} of {len(self.file_alerts)}'
+        self.stdscr.addstr(y, 50, heading)
+        for path in alerting[:5]:
+            y += 1
+            self.stdscr.addstr(y, 50, path[-40:], curses.color_pair(1))
+
+    def __display_rule_alerts(self, y):
+        """
+        Displays which of the alert rules are currently alerting, when there
+        is room for it inside the border
+
+        Returns:
+            int: Row below the rules
+        """
+        max_height, _ = self.stdscr.getmaxyx()
+        engine = self.alerts.rule_engine
+        alerting = [name for name, alerted in engine.alerted.items()
+                    if alerted]
+        if y + min(len(alerting), 3) >= max_height - 2:
+            return y
+
+        heading = f'Rules Alerting: {len(alerting)} of {len(engine.rules)}'
+        self.stdscr.addstr(y, 50, heading)
+        for name in alerting[:3]:
+            y += 1
+            self.stdscr.addstr(y, 50, name[-40:], curses.color_pair(1))
+        return y + 2
+
+    def __display_pipeline(self, y):
+        """
+        Displays how the reader and consumers are keeping up, when there is
+        room for it inside the border
+        """
+        max_height, _ = self.stdscr.getmaxyx()
+        if y + 3 >= max_height - 2:
+            return
+
+        snapshot = self.pipeline_snapshot
+        stages = snapshot['stages']
+        queues = snapshot['queues']
+
+        self.stdscr.addstr(y, 50, "Pipeline:")
+        reader = stages['reader']
+        y += 1
+        self.stdscr.addstr(
+            y, 50,
+            f'Read: {reader["lines_per_second"]:,} lines/s, '
+            f'{reader["malformed_per_second"]:,} malformed/s, '
+            f'{reader["dropped_per_second"]:,} dropped/s'
+        )
+        for name in ('alerts', 'stats'):
+            stage = stages[name]
+            lag = stage['lag_seconds']
+            y += 1
+            self.stdscr.addstr(
+                y, 50,
+                f'{name.title()}: {queues[name]["lines"]:,} queued, '
+                f'{stage["ms_per_batch"]} ms/batch, '
+                f'{stage["busy"]:.0%} busy, '
+                f'lag {"-" if lag is None else f"{lag}s"}'
+            )
+
     def __build_status_lines(self, counts):
         """
         Takes Status counters to get top n for printing to screen
@@ -134,14 +272,20 @@ class Display(threading.Thread):
             lines.append(line)
         return lines
 
-    def __build_top_n_sections(self, section_size, section_counts, n=2):
+    def __build_top_n_sections(self, top_sections, section_percentiles,
+                               n=2):
         """
-        Takes Section counters to get top n for printing to screen
+        Takes the top sections published by the stats consumer to get top n
+        for printing to screen
         """
         lines = []
-        for section, count in section_counts.most_common(n):
+        for section, count, size in top_sections[:n]:
             lines.append(f'Section: {section}')
             lines.append(f'Count: {count}')
-            lines.append(f'Total in Bytes: {section_size[section]:,}')
+            lines.append(f'Total in Bytes: {size:,}')
+            percentiles = section_percentiles.get(section)
+            if percentiles:
+                p50, p95, p99 = (f'{value:,.0f}' for value in percentiles)
+                lines.append(f'Bytes p50 / p95 / p99: {p50} / {p95} / {p99}')
             lines.append(f'\n')
         return lines
@@ -0,0 +1,210 @@
+import json
+import os
+import time
+
+
+class FileFollower:
+    """A class used to follow a single log file, returning the complete
+    lines appended to it since the last read. A line that is still being
+    written is held back until its newline arrives
+
+    The follower survives log rotation. When the path is renamed or
+    replaced, the old file is drained before switching to the new one, and
+    when the file is truncated in place (copytruncate) it is read again
+    from the start. The byte offset can be persisted so that a restart
+    resumes where the last run stopped instead of at the end of the file,
+    or a restart can resume from the read positions of the batches the
+    consumers had processed, as saved by a Checkpointer
+
+    Attributes:
+        log_file_path (str): Path to the log file being followed
+        log_file (file): Open binary handle of the log file
+        file_id (tuple): Device and inode of the open log file
+        offset (int): Byte offset just after the last complete line read
+        read_size (int): Number of bytes to read at a time
+        partial_line (bytes): Start of a line that has no newline yet
+        offset_path (str): File the offset is persisted to, None to disable
+        offset_save_interval (float): Minimum seconds between offset saves
+        last_offset_save (float): Time the offset was last saved
+        stop_offsets (list): Offsets ahead of the start that consumers had
+            processed up to, which the blocks read again end on so that a
+            consumer can skip exactly the lines it already counted
+    """
+
+    def __init__(self, log_file_path, read_size=65536, offset_path=None,
+                 start_positions=None):
+        """
+        Args:
+            log_file_path (str): Path to the log file to follow
+            read_size (int): Number of bytes to read at a time
+            offset_path (str): File to persist the offset to so a restart
+                resumes from it
+            start_positions (list): Read positions of the consumers to
+                resume from instead of the persisted offset, the earliest
+                one so that no consumer misses a line
+        """
+        self.log_file_path = log_file_path
+        self.read_size = read_size
+        self.partial_line = b''
+        self.offset_path = offset_path
+        self.offset_save_interval = 1.0
+        self.last_offset_save = 0
+
+        self.log_file = open(log_file_path, "rb")
+        self.file_id = self.__file_id(os.fstat(self.log_file.fileno()))
+        self.offset = self.__start_offset(start_positions)
+        self.stop_offsets = self.__stop_offsets(start_positions)
+        self.log_file.seek(self.offset)
+
+    def read_block(self):
+        """
+        Reads the complete lines that are available, up to about read_size
+        bytes of them
+
+        Returns:
+            bytes: Block of complete lines, empty if there is nothing new.
+                Left undecoded, as LogParser only decodes the fields it
+                captures
+        """
+        chunk = self.log_file.read(self.__next_read_size())
+        if not chunk:
+            return self.__check_rotation()
+
+        chunk = self.partial_line + chunk
+        end = chunk.rfind(b'\n') + 1
+        self.partial_line = chunk[end:]
+        self.offset += end
+
+        if self.offset_path and self.__offset_save_due():
+            self.save_offset()
+
+        return chunk[:end]
+
+    def position(self):
+        """
+        Returns:
+            dict: Path, identity of the open file and the offset just after
+                the last complete line read
+        """
+        return {
+            'path': self.log_file_path,
+            'device': self.file_id[0],
+            'inode': self.file_id[1],
+            'offset': self.offset
+        }
+
+    def save_offset(self):
+        """
+        Atomically writes the file identity and offset to the offset path
+        """
+        temp_path = f'{self.offset_path}.tmp'
+        with open(temp_path, 'w') as offset_file:
+            json.dump(self.position(), offset_file)
+        os.replace(temp_path, self.offset_path)
+        self.last_offset_save = time.time()
+
+    def close(self):
+        if self.offset_path:
+            self.save_offset()
+        self.log_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __offset_save_due(self):
+        return time.time() - self.last_offset_save >= self.offset_save_interval
+
+    def __file_id(self, stat):
+        return stat.st_dev, stat.st_ino
+
+    def __start_offset(self, start_positions):
+        """
+        Resumes from the earliest of the start positions or else the
+        persisted offset, if they are for the same file. Starts from the
+        beginning of a file that replaced it, and otherwise from the end
+        """
+        file_size = os.fstat(self.log_file.fileno()).st_size
+        if start_positions is None:
+            if not self.offset_path or not os.path.exists(self.offset_path):
+                return file_size
+
+            try:
+                with open(self.offset_path) as offset_file:
+                    start_positions = [json.load(offset_file)]
+            except (OSError, ValueError):
+                return file_size
+
+        offsets = []
+        for state in start_positions:
+            if (state.get('device'), state.get('inode')) != self.file_id:
+                return 0
+            if state.get('offset', 0) > file_size:
+                # Truncated since the offset was saved
+                return 0
+            offsets.append(state['offset'])
+        return min(offsets, default=file_size)
+
+    def __stop_offsets(self, start_positions):
+        """
+        Offsets of the start positions in the open file that are past the
+        start offset, in order
+        """
+        file_size = os.fstat(self.log_file.fileno()).st_size
+        return sorted({
+            state['offset'] for state in start_positions or []
+            if (state.get('device'), state.get('inode')) == self.file_id and
+            self.offset < state.get('offset', 0) <= file_size
+        })
+
+    def __next_read_size(self):
+        """
+        Number of bytes to read next, stopping at the next stop offset
+        """
+        position = self.offset + len(self.partial_line)
+        stop_offsets = self.stop_offsets
+        while stop_offsets and stop_offsets[0] <= position:
+            del stop_offsets[0]
+        if stop_offsets:
+            return min(self.read_size, stop_offsets[0] - position)
+        return self.read_size
+
+    def __check_rotation(self):
+        """
+        Called once the open file has been drained. Switches to a new file
+        at the path or rewinds a truncated file
+
+        Returns:
+            bytes: First block read after rewinding or switching files, with
+                the held back partial line of a rotated file in front
+        """
+        if os.fstat(self.log_file.fileno()).st_size < self.offset:
+            self.log_file.seek(0)
+            self.offset = 0
+            self.partial_line = b''
+            self.stop_offsets = []
+            return self.read_block()
+
+        try:
+            file_id = self.__file_id(os.stat(self.log_file_path))
+        except FileNotFoundError:
+            # Renamed but the new file has not been created yet
+            return b''
+        if file_id == self.file_id:
+            return b''
+
+        # The old file will not be written to again, so a last line
+        # without a newline is complete
+        last_line = self.partial_line
+        self.partial_line = b''
+        self.log_file.close()
+
+        self.log_file = open(self.log_file_path, "rb")
+        self.file_id = self.__file_id(os.fstat(self.log_file.fileno()))
+        self.offset = 0
+        self.stop_offsets = []
+        if last_line:
+            last_line += b'\n'
+        return last_line + self.read_block()
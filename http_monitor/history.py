@@ -0,0 +1,375 @@
+from collections import Counter
+from collections import defaultdict
+from http_monitor.sketches import SpaceSaving
+from operator import attrgetter
+import sqlite3
+import threading
+
+GET_TIME_AND_SECTION = attrgetter('time', 'section')
+GET_TIME_AND_STATUS = attrgetter('time', 'status')
+
+SECOND = 1
+MINUTE = 60
+HOUR = 3600
+DAY = 24 * HOUR
+RESOLUTIONS = {'second': SECOND, 'minute': MINUTE, 'hour': HOUR}
+
+# Seconds of history kept at each resolution, relative to the latest log
+# time. Coarser rollups are built as lines arrive, so dropping the finer
+# ones once they expire is all the downsampling there is to do
+DEFAULT_RETENTION = {SECOND: 6 * HOUR, MINUTE: 7 * DAY, HOUR: 365 * DAY}
+
+# Section of the rows that total every section of a bucket
+ALL_SECTIONS = ''
+
+# Section of the rows that total the sections of a bucket that were not
+# kept with top_k. Sections never contain a slash
+OTHER_SECTIONS = '/other'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS section_rollups (
+    resolution INTEGER NOT NULL,
+    section TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    PRIMARY KEY (resolution, section, start)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS section_rollups_start
+    ON section_rollups (resolution, start);
+CREATE TABLE IF NOT EXISTS status_rollups (
+    resolution INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    PRIMARY KEY (resolution, status, start)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS status_rollups_start
+    ON status_rollups (resolution, start);
+CREATE TABLE IF NOT EXISTS alert_events (
+    time INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+'''
+
+UPSERT_SECTION = '''
+INSERT INTO section_rollups VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (resolution, section, start) DO UPDATE SET
+    hits = hits + excluded.hits, bytes = bytes + excluded.bytes
+'''
+
+UPSERT_STATUS = '''
+INSERT INTO status_rollups VALUES (?, ?, ?, ?)
+ON CONFLICT (resolution, status, start) DO UPDATE SET
+    hits = hits + excluded.hits
+'''
+
+
+class HistoryStore:
+    """A class used to keep per second, per minute and per hour rollups of
+    hits, bytes and status classes per section in SQLite, so the history
+    can be queried without reading the raw logs again
+
+    Counts are rolled up in memory as batches arrive and written with one
+    batched upsert per flush, so a bucket flushed more than once simply adds
+    up. Rows older than the retention of their resolution are deleted
+
+    With top_k set, the sections of each bucket are tracked with a
+    Space-Saving sketch, and a flush only writes the sections it kept plus
+    one row for all of the other sections, so many distinct sections
+    neither grow the memory nor the tables. The kept sections get the hits
+    the sketch guarantees, which are never too high, and the other row the
+    rest, so the totals of every bucket stay exact
+
+    Attributes:
+        connection (sqlite3.Connection): Connection to the database
+        retention (dict): Resolution to seconds of history kept
+        top_k (int): Number of sections kept per bucket, None for every one
+        pending_sections (defaultdict): (resolution, section, start) to
+            [hits, bytes] not written yet, only the totals with top_k
+        pending_top (dict): (resolution, start) to the SpaceSaving of the
+            section hits and the bytes per tracked section not written yet
+        pending_statuses (Counter): Hits per (resolution, status class,
+            start) not written yet
+        latest (int): Latest log time added
+        last_prune (int): Log time the expired rows were last deleted at
+        prune_interval (int): Seconds of log time between deletes
+        lock (threading.Lock): Lock since queries can come from any thread
+    """
+
+    def __init__(self, path, retention=None, prune_interval=MINUTE,
+                 top_k=None):
+        """
+        Args:
+            path (str): Path of the SQLite database, created if missing
+            retention (dict): Resolution to seconds of history kept,
+                defaults to DEFAULT_RETENTION
+            prune_interval (int): Seconds of log time between deletes of
+                expired rows
+            top_k (int): Number of sections kept per bucket, None to keep
+                every section
+        """
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.retention = dict(DEFAULT_RETENTION)
+        self.retention.update(retention or {})
+        self.top_k = top_k
+        self.pending_sections = defaultdict(lambda: [0, 0])
+        self.pending_top = {}
+        self.pending_statuses = Counter()
+        self.latest = None
+        self.last_prune = None
+        self.prune_interval = prune_interval
+        self.lock = threading.Lock()
+
+    def add_records(self, records, weight=1):
+        """
+        Args:
+            records (list): LogRecord for each parsed log line
+            weight (int): Number of log lines each record stands for, more
+                than 1 when the batch was sampled
+        """
+        if not records:
+            return
+
+        section_size = defaultdict(int)
+        for record in records:
+            section_size[(record.time, record.section)] += record.size
+
+        status_counts = Counter()
+        for (timestamp, status), count in Counter(
+            map(GET_TIME_AND_STATUS, records)
+        ).items():
+            status_counts[(timestamp, status[0] + 'XX')] += count
+
+        section_counts = Counter(map(GET_TIME_AND_SECTION, records))
+        if weight != 1:
+            for counts in (section_size, status_counts, section_counts):
+                for key in counts:
+                    counts[key] *= weight
+
+        self.add_counts(section_counts, section_size, status_counts)
+
+    def add_counts(self, section_counts, section_size, status_counts):
+        """
+        Adds per second counts that were aggregated elsewhere, eg. the
+        partials of a parallel replay
+
+        Args:
+            section_counts (Counter): Hits per (second, section)
+            section_size (dict): Bytes per (second, section)
+            status_counts (Counter): Hits per (second, status class)
+        """
+        with self.lock:
+            pending = self.pending_sections
+            latest = self.latest
+            for (timestamp, section), hits in section_counts.items():
+                size = section_size.get((timestamp, section), 0)
+                for resolution in self.retention:
+                    start = timestamp - timestamp % resolution
+                    keys = (
+                        ((resolution, ALL_SECTIONS, start),) if self.top_k
+                        else ((resolution, section, start),
+                              (resolution, ALL_SECTIONS, start))
+                    )
+                    for key in keys:
+                        row = pending[key]
+                        row[0] += hits
+                        row[1] += size
+                if latest is None or timestamp > latest:
+                    latest = timestamp
+            self.latest = latest
+            if self.top_k:
+                self.__add_top_sections(section_counts, section_size)
+
+            for (timestamp, status), hits in status_counts.items():
+                for resolution in self.retention:
+                    start = timestamp - timestamp % resolution
+                    self.pending_statuses[(resolution, status, start)] += hits
+
+    def add_alert(self, alert_data):
+        """
+        Listener for alert / recover events from LogAlertConsumer
+        """
+        message = f'{alert_data["msg_line1"]} {alert_data["msg_line2"]}'
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT INTO alert_events VALUES (?, ?, ?)',
+                (alert_data['time'], alert_data['type'], message)
+            )
+
+    def flush(self):
+        """
+        Writes the pending rollups in a single transaction and deletes the
+        expired rows when they are due
+        """
+        with self.lock, self.connection:
+            if self.pending_top:
+                self.__add_top_rows()
+            if self.pending_sections:
+                self.connection.executemany(UPSERT_SECTION, (
+                    (resolution, section, start, hits, size)
+                    for (resolution, section, start), (hits, size)
+                    in self.pending_sections.items()
+                ))
+                self.pending_sections.clear()
+            if self.pending_statuses:
+                self.connection.executemany(UPSERT_STATUS, (
+                    key + (hits,) for key, hits
+                    in self.pending_statuses.items()
+                ))
+                self.pending_statuses.clear()
+
+            if self.latest is not None and (
+                self.last_prune is None or
+                self.latest - self.last_prune >= self.prune_interval
+            ):
+                self.__prune()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def latest_time(self):
+        """
+        Returns:
+            int: Latest second stored, None if the store is empty
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT MAX(start) FROM section_rollups WHERE resolution = ?',
+                (min(self.retention),)
+            ).fetchone()
+        return row[0] if row[0] is not None else self.latest
+
+    def hits(self, section=None, resolution=MINUTE, since=None, until=None):
+        """
+        Args:
+            section (str): Section to return, None for every section
+            resolution (int): Seconds per bucket, eg. MINUTE
+            since (int): Log time of the first bucket returned
+            until (int): Log time the buckets returned end before
+
+        Returns:
+            list: (start, hits, bytes) of each bucket with hits, in order
+        """
+        return self.__query(
+            'SELECT start, hits, bytes FROM section_rollups '
+            'WHERE resolution = ? AND section = ? AND start >= ? '
+            'AND start < ? ORDER BY start',
+            (resolution, section or ALL_SECTIONS) + self.__range(since, until)
+        )
+
+    def top_sections(self, n=10, resolution=MINUTE, since=None, until=None):
+        """
+        Returns:
+            list: (section, hits, bytes) of the n sections with the most
+                hits between since and until
+        """
+        return self.__query(
+            'SELECT section, SUM(hits), SUM(bytes) FROM section_rollups '
+            'WHERE resolution = ? AND start >= ? AND start < ? '
+            'AND section NOT IN (?, ?) GROUP BY section '
+            'ORDER BY 2 DESC, 1 LIMIT ?',
+            (resolution,) + self.__range(since, until) +
+            (ALL_SECTIONS, OTHER_SECTIONS, n)
+        )
+
+    def status_counts(self, resolution=MINUTE, since=None, until=None):
+        """
+        Returns:
+            dict: Hits per status class between since and until
+        """
+        return dict(self.__query(
+            'SELECT status, SUM(hits) FROM status_rollups '
+            'WHERE resolution = ? AND start >= ? AND start < ? '
+            'GROUP BY status ORDER BY status',
+            (resolution,) + self.__range(since, until)
+        ))
+
+    def alerts(self, since=None, until=None):
+        """
+        Returns:
+            list: (time, type, message) of each alert and recovery
+        """
+        return self.__query(
+            'SELECT time, type, message FROM alert_events '
+            'WHERE time >= ? AND time < ? ORDER BY time',
+            self.__range(since, until)
+        )
+
+    def __range(self, since, until):
+        return (
+            since if since is not None else 0,
+            until if until is not None else 2 ** 62
+        )
+
+    def __query(self, sql, parameters):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def __add_top_sections(self, section_counts, section_size):
+        """
+        Adds per second section counts to the sketch of each bucket, only
+        keeping the bytes of the sections that are tracked. Called with the
+        lock held
+        """
+        bucket_hits = defaultdict(Counter)
+        bucket_size = defaultdict(Counter)
+        for (timestamp, section), hits in section_counts.items():
+            size = section_size.get((timestamp, section), 0)
+            for resolution in self.retention:
+                key = (resolution, timestamp - timestamp % resolution)
+                bucket_hits[key][section] += hits
+                bucket_size[key][section] += size
+
+        for key, hits in bucket_hits.items():
+            if key not in self.pending_top:
+                self.pending_top[key] = (SpaceSaving(self.top_k), Counter())
+            sketch, sizes = self.pending_top[key]
+            sketch.update(hits)
+            sizes.update(bucket_size[key])
+            if len(sizes) > 2 * self.top_k:
+                for section in [s for s in sizes if s not in sketch]:
+                    del sizes[section]
+
+    def __add_top_rows(self):
+        """
+        Turns the sketch of each bucket into pending rows for the sections
+        it kept, and one for the rest of the hits and bytes of the bucket.
+        Called with the lock held
+        """
+        pending = self.pending_sections
+        for (resolution, start), (sketch, sizes) in self.pending_top.items():
+            kept_hits = kept_size = 0
+            for section, hits in sketch.most_common():
+                # Only the hits the sketch guarantees, so that the rows of
+                # the bucket add up to its total
+                hits -= sketch.errors[section]
+                size = sizes.get(section, 0)
+                pending[(resolution, section, start)] = [hits, size]
+                kept_hits += hits
+                kept_size += size
+
+            total_hits, total_size = pending[(resolution, ALL_SECTIONS, start)]
+            other = [total_hits - kept_hits, max(total_size - kept_size, 0)]
+            if any(other):
+                pending[(resolution, OTHER_SECTIONS, start)] = other
+        self.pending_top.clear()
+
+    def __prune(self):
+        """
+        Deletes the rows older than the retention of their resolution.
+        Called with the lock held inside a transaction
+        """
+        for resolution, retention in self.retention.items():
+            cutoff = self.latest - retention
+            for table in ('section_rollups', 'status_rollups'):
+                self.connection.execute(
+                    f'DELETE FROM {table} WHERE resolution = ? AND start < ?',
+                    (resolution, cutoff)
+                )
+        self.last_prune = self.latest
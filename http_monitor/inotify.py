@@ -0,0 +1,97 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def inotify_available():
+    """
+    Returns:
+        boolean: True if inotify can be used on this platform
+    """
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        Inotify().close()
+    except OSError:
+        return False
+    return True
+
+
+class Inotify:
+    """A minimal ctypes wrapper around Linux inotify, used to wake up the
+    tailer as soon as a watched file changes instead of polling it
+
+    Attributes:
+        libc (CDLL): C library with the inotify functions
+        fd (int): Non blocking inotify file descriptor
+    """
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True
+        )
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """
+        Args:
+            path (str): File or directory to watch
+            mask (int): IN_* events to watch for
+
+        Returns:
+            int: Watch descriptor the events will refer to
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """
+        Reads all of the pending events without blocking
+
+        Returns:
+            list: (watch descriptor, mask, name) of each event
+        """
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
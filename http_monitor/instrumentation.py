@@ -0,0 +1,254 @@
+from collections import Counter
+from time import perf_counter
+from time import sleep
+from time import time
+import cProfile
+import os
+import sys
+import threading
+
+
+class StageStats:
+    """A class used to count the batches a stage of the pipeline (the
+    reader or a consumer) has processed. It is only updated by the thread
+    running the stage, once per batch, so it is cheap enough to always be on
+
+    Attributes:
+        batches (int): Number of batches processed
+        lines (int): Number of lines processed
+        malformed (int): Number of lines that could not be parsed
+        dropped (int): Number of lines a full queue did not take, counted
+            once per queue
+        busy_time (float): Seconds spent processing batches
+        max_batch_time (float): Longest time spent on a single batch
+        latest_log_time (int): Timestamp of the last line processed
+    """
+
+    def __init__(self):
+        self.batches = 0
+        self.lines = 0
+        self.malformed = 0
+        self.dropped = 0
+        self.busy_time = 0.0
+        self.max_batch_time = 0.0
+        self.latest_log_time = None
+
+    def record_batch(self, records, elapsed, malformed=0):
+        """
+        Args:
+            records (list): LogRecord for each line of the batch
+            elapsed (float): Seconds spent processing the batch
+            malformed (int): Lines of the batch that could not be parsed
+        """
+        self.batches += 1
+        self.lines += len(records) + malformed
+        self.malformed += malformed
+        self.busy_time += elapsed
+        if elapsed > self.max_batch_time:
+            self.max_batch_time = elapsed
+        if records:
+            self.latest_log_time = records[-1].time
+
+
+class PipelineMonitor:
+    """A class used to report how the pipeline is keeping up. Rates are
+    worked out from the counters of each stage between snapshots at least a
+    second apart, and lag is how far the log time of the last line a stage
+    processed is behind the wall clock
+
+    Attributes:
+        stages (dict): Stage name to its StageStats
+        queues (dict): Queue name to its BatchQueue
+        previous (tuple): Time and counters of the snapshot rates are
+            worked out from
+        latest (tuple): Time and counters of the most recent snapshot
+        published (tuple): Counters, counters the rates start from and
+            queues of the last snapshot
+        version (int): Incremented every time a snapshot has new counters,
+            rates or queue depths. The lags follow the wall clock and do not
+            count
+        lock (threading.Lock): Lock since snapshots can be taken from any
+            thread, never taken by the stages
+    """
+
+    def __init__(self, stages, queues):
+        """
+        Args:
+            stages (dict): Stage name to its StageStats, eg. reader, alerts
+            queues (dict): Queue name to its BatchQueue
+        """
+        self.stages = stages
+        self.queues = queues
+        self.previous = (perf_counter(), self.__counters())
+        self.latest = self.previous
+        self.published = None
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Totals, rates per second and lag of each stage, and depth
+                of each queue
+        """
+        with self.lock:
+            now = perf_counter()
+            counters = self.__counters()
+            # Keep rates steady when snapshots are taken often
+            if now - self.latest[0] >= 1.0:
+                self.previous = self.latest
+                self.latest = (now, counters)
+            since, previous = self.previous
+            elapsed = max(now - since, 1e-9)
+
+        wall_time = time()
+        stages = {}
+        for name, stage in self.stages.items():
+            old = previous[name]
+            batches = stage.batches - old['batches']
+            stages[name] = {
+                'lines': stage.lines,
+                'malformed': stage.malformed,
+                'dropped': stage.dropped,
+                'lines_per_second': round((stage.lines - old['lines']) /
+                                          elapsed),
+                'malformed_per_second': round(
+                    (stage.malformed - old['malformed']) / elapsed
+                ),
+                'dropped_per_second': round((stage.dropped - old['dropped']) /
+                                            elapsed),
+                'ms_per_batch': round(
+                    (stage.busy_time - old['busy_time']) / batches * 1e3, 3
+                ) if batches else 0.0,
+                'max_ms_per_batch': round(stage.max_batch_time * 1e3, 3),
+                'busy': round((stage.busy_time - old['busy_time']) / elapsed,
+                              3),
+                'lag_seconds': (
+                    round(wall_time - stage.latest_log_time, 1)
+                    if stage.latest_log_time is not None else None
+                )
+            }
+
+        queues = {
+            name: {
+                'batches': len(queue),
+                'lines': queue.pending_lines,
+                'capacity': queue.capacity,
+                'dropped': queue.dropped_lines
+            }
+            for name, queue in self.queues.items()
+        }
+
+        # The rates only settle once the counters they start from roll over
+        published = (counters, previous, queues)
+        with self.lock:
+            if published != self.published:
+                self.published = published
+                self.version += 1
+        return {'stages': stages, 'queues': queues}
+
+    def __counters(self):
+        return {
+            name: {
+                'batches': stage.batches,
+                'lines': stage.lines,
+                'malformed': stage.malformed,
+                'dropped': stage.dropped,
+                'busy_time': stage.busy_time
+            }
+            for name, stage in self.stages.items()
+        }
+
+
+def profile_thread(thread, profile_dir):
+    """
+    Runs a thread under cProfile, writing its stats to profile_dir when the
+    thread finishes, eg. profile_dir/LogReader-1234.prof with the native
+    thread id. The stats can be read with pstats or snakeviz
+
+    Args:
+        thread (threading.Thread): Thread to profile, not started yet
+        profile_dir (str): Directory to write the stats to
+    """
+    run = thread.run
+    name = type(thread).__name__
+
+    def profiled_run():
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(run)
+        finally:
+            profiler.dump_stats(os.path.join(
+                profile_dir, f'{name}-{threading.get_native_id()}.prof'
+            ))
+
+    thread.run = profiled_run
+
+
+class SamplingProfiler(threading.Thread):
+    """A class used to sample the stacks of every other thread at a fixed
+    interval, which costs the sampled threads next to nothing compared to
+    cProfile. The samples are written in the collapsed stack format used by
+    flame graph tools, one line per distinct stack with its thread name.
+    Sampling stops once every other thread of the app has finished
+
+    Attributes:
+        output_path (str): File the collapsed stacks are written to
+        interval (float): Seconds between samples
+        samples (Counter): Number of samples of each collapsed stack
+        thread_terminated (boolean): Flag to kill thread
+    """
+
+    def __init__(self, output_path, interval=0.01):
+        """
+        Args:
+            output_path (str): File to write the collapsed stacks to
+            interval (float): Seconds between samples
+        """
+        threading.Thread.__init__(self)
+        self.output_path = output_path
+        self.interval = interval
+        self.samples = Counter()
+        self.thread_terminated = False
+
+    def run(self):
+        """
+        Starts the thread process
+        """
+        try:
+            while not self.thread_terminated and self.__app_running():
+                self.sample()
+                sleep(self.interval)
+        finally:
+            self.write()
+
+    def sample(self):
+        """
+        Records the current stack of every thread but this one
+        """
+        names = {t.ident: type(t).__name__ for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            # Walk the frames directly, which does not read any source
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f'{code.co_name} ({os.path.basename(code.co_filename)})'
+                )
+                frame = frame.f_back
+            stack.append(str(names.get(ident, ident)))
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def __app_running(self):
+        main_thread = threading.main_thread()
+        return any(
+            not t.daemon for t in threading.enumerate()
+            if t is not self and t is not main_thread
+        )
+
+    def write(self):
+        with open(self.output_path, 'w') as output_file:
+            for stack, count in self.samples.most_common():
+                output_file.write(f'{stack} {count}\n')
@@ -1,5 +1,12 @@
-from collections import deque
+from bisect import bisect_left
+from bisect import bisect_right
 from datetime import datetime
+from http_monitor.alert_rules import RuleEngine
+from http_monitor.checkpoint import ReadPositions
+from http_monitor.instrumentation import StageStats
+from http_monitor.sliding_window import SlidingWindowCounter
+from http_monitor.vectorized import window_totals
+from time import perf_counter
 from time import time
 import threading
 
@@ -9,48 +16,340 @@ class LogAlertConsumer(threading.Thread):
     there should be an alert or system has recovered
 
     Attributes:
-        timestamps_queue (deque): timestamps to process as they are produced
-        alert_queue (deque): Local queue to move from producer queue
+        logs_queue (BatchQueue): Batches of log records from the reader
+        alert_window (SlidingWindowCounter): Hits per second within the
+            time window
         time_window (int): Used to check if should alert / recover within time
         threshold (int): Threshold for hits/sec to check
-        timesstamps_queue (deque): Deque with timestamps coming from the reader
+        use_log_time (boolean): Use log timestamps to wait out the first time
+            window instead of real time, used when replaying a log file
+        start_time (float): Time the first time window started at
+        warmed_up (boolean): Flag set once the first time window has passed
+        poll_timeout (float): Seconds to wait for a batch before checking
+            whether the thread has been terminated
         alerted (boolean): Flag to handle flipping between alert and recover
         thread_terminated (boolean): Flag to kill thread
         alert_data (dict): Hashmap of data that will be used for displaying
+        alert_version (int): Incremented every time the alert data changes
+        listeners (list): Callables given the alert data on alert / recover
+        pending_alerts (list): Copies of the alert data not given to the
+            listeners yet, which are only called once the lock is released
+        stage_stats (StageStats): Batches processed and time spent on them
+        rule_engine (RuleEngine): Evaluates any other alert rules on the
+            same batches, None without rules
+        read_positions (ReadPositions): How far each log file has been
+            processed, saved with the checkpoints
     """
 
-    def __init__(self, time_window, threshold, timestamps_queue):
+    def __init__(self, time_window, threshold, logs_queue, use_log_time=False,
+                 rules=None):
         """
         Args:
             time_window (int): Window of time in seconds to check hits/sec for
                 any alert messaging
             threshold (int): Threshold for hits/sec to check
-            timesstamps_queue (deque): Deque with timestamps from the reader
+            logs_queue (BatchQueue): Batches of log records from the reader
+            use_log_time (boolean): Use log timestamps to wait out the first
+                time window instead of real time
+            rules (list): AlertRule to evaluate on top of the global
+                threshold, eg. per section or error rate rules
         """
         threading.Thread.__init__(self)
-        self.timestamps_queue = timestamps_queue
-        self.alert_queue = deque()
+        self.logs_queue = logs_queue
+        self.alert_window = SlidingWindowCounter(time_window)
         self.time_window = time_window
         self.threshold = threshold
+        self.use_log_time = use_log_time
+        self.start_time = None
+        self.warmed_up = False
         self.alerted = False
         self.thread_terminated = False
         self.alert_data = {'alert_count': 0}
+        self.alert_version = 0
+        self.listeners = []
+        self.pending_alerts = []
+        self.stage_stats = StageStats()
+        self.rule_engine = RuleEngine(rules) if rules else None
+        self.read_positions = ReadPositions()
         self.lock = threading.Lock()
+        self.poll_timeout = 0.5
 
     def run(self):
         """
         Starts the thread process
         """
-        start_real_time = time()
+        # A start time restored from a checkpoint carries on the first window
+        if not self.use_log_time and self.start_time is None:
+            self.start_time = time()
 
         while not self.thread_terminated:
-            while self.timestamps_queue:
-                timestamp = self.timestamps_queue.popleft()
-                self.alert_queue.append(timestamp)
+            batches = self.logs_queue.get(self.poll_timeout)
+            if not batches and self.logs_queue.closed:
+                break
 
-                if (time() - start_real_time) >= self.time_window:
-                    with self.lock:
-                        self.__should_alert_or_recover(timestamp)
+            for records in batches:
+                started = perf_counter()
+                # Batches sampled down by a full queue carry a weight
+                self.process_records(records, getattr(records, 'weight', 1))
+                self.stage_stats.record_batch(
+                    records, perf_counter() - started
+                )
+
+        # Unblocks a reader waiting on a full queue
+        self.logs_queue.close()
+
+    def add_listener(self, listener):
+        """
+        Registers a callable that is given the alert data every time the
+        service alerts or recovers
+
+        Args:
+            listener (callable): Takes a copy of the alert data dict
+        """
+        self.listeners.append(listener)
+
+    def process_records(self, records, weight=1):
+        """
+        Counts a batch of record timestamps in the window, checking the
+        alert state after each one once the first time window has passed
+
+        Args:
+            records (list): LogRecord for each parsed log line
+            weight (int): Number of log lines each record stands for, more
+                than 1 when the batch was sampled
+        """
+        add = self.alert_window.add
+        with self.lock:
+            # Already counted before a restart
+            if not self.read_positions.track(records):
+                return
+            for record in records:
+                add(record.time, weight)
+                if self.warmed_up or self.__has_warmed_up(record.time):
+                    self.__should_alert_or_recover(record.time)
+            if self.rule_engine:
+                self.rule_engine.add_records(records, weight)
+        self.__notify_listeners()
+
+    def process_arrays(self, arrays):
+        """
+        Counts a block of lines parsed by ArrayParser, with the same alerts
+        as process_records on the same lines. The totals of the window after
+        each line are worked out at once, and the alert state is only
+        visited on the lines where it flips
+
+        Args:
+            arrays (LogArrays): Columns of the parsed log lines
+        """
+        times = arrays.times
+        if not len(times):
+            return
+        if self.rule_engine:
+            raise ValueError('Alert rules need the records of the lines')
+
+        with self.lock:
+            if self.warmed_up:
+                checked = 0
+            elif not self.use_log_time:
+                checked = 0 if self.__has_warmed_up(None) else len(times)
+            else:
+                if self.start_time is None:
+                    self.start_time = int(times[0])
+                warm = times - self.start_time >= self.time_window
+                checked = int(warm.argmax()) if warm.any() else len(times)
+                self.warmed_up = checked < len(times)
+
+            totals = window_totals(self.alert_window, times)[checked:]
+            breached = totals / self.time_window > self.threshold
+            flips = (breached[1:] != breached[:-1]).nonzero()[0] + 1
+            if len(breached) and breached[0] != self.alerted:
+                flips = [0] + flips.tolist()
+
+            for flip in flips:
+                timestamp = int(times[checked + flip])
+                self.alerted = bool(breached[flip])
+                if self.alerted:
+                    self.__alert_message(timestamp, int(totals[flip]))
+                else:
+                    self.__recovered_message(timestamp, int(totals[flip]))
+        self.__notify_listeners()
+
+    def process_hits(self, timestamp, count):
+        """
+        Counts hits that were already aggregated, eg. the hits of a second
+        from a worker process or a run of lines with the same timestamp,
+        with the same alerts as process_records on as many lines. Only the
+        first hit can slide the window, so the state is checked after it.
+        The rest only add to the window, so the only change left is an
+        alert on the hit that takes the average over the threshold
+
+        Args:
+            timestamp (int): Second the hits happened at
+            count (int): Number of hits in that second
+        """
+        window = self.alert_window
+        with self.lock:
+            counted = window.add(timestamp)
+            if self.warmed_up or self.__has_warmed_up(timestamp):
+                self.__should_alert_or_recover(timestamp)
+
+            rest = count - 1
+            if counted and rest and self.warmed_up and not self.alerted:
+                over = self.__breach_total() - window.total
+                if over <= rest:
+                    window.add(timestamp, over)
+                    rest -= over
+                    self.__should_alert_or_recover(timestamp)
+            if counted and rest:
+                window.add(timestamp, rest)
+        self.__notify_listeners()
+
+    def process_block_hits(self, block):
+        """
+        Counts a block of lines that a worker process reduced to BlockHits,
+        with the same alerts as process_records on the lines, without
+        visiting every line. Until the block passes the latest second of
+        the window the window only grows, so the runs of that prefix are
+        only checked for an alert. After that the block is split at each
+        run later than every one before it: the window slides on the first
+        line of such a segment, which may recover, and then only grows, so
+        the line that alerts is found with a bisect of the hits counted in
+        the segment. The window itself is updated once, at the end
+
+        Args:
+            block (BlockHits): Hits of a block of lines in file order
+        """
+        times, counts, counted = block.times, block.counts, block.counted
+        if not len(times):
+            return
+
+        with self.lock:
+            # Runs before the first time window has passed are not checked
+            if self.warmed_up:
+                checked = 0
+            elif not self.use_log_time:
+                checked = 0 if self.__has_warmed_up(None) else len(times)
+            else:
+                if self.start_time is None:
+                    self.start_time = times[0]
+                warm_up = self.start_time + self.time_window
+                checked = next(
+                    (run for run, timestamp in enumerate(times)
+                     if timestamp >= warm_up), len(times)
+                )
+                self.warmed_up = checked < len(times)
+
+            window = self.alert_window
+            size = window.size
+            breach = self.__breach_total()
+            latest = window.latest
+            if latest is None:
+                first = end = 0
+            else:
+                first = bisect_right(block.peaks, latest)
+                end = block.maxima[first] if first < len(block.maxima) \
+                    else len(times)
+
+            total = window.total
+            for run in range(end):
+                count = counts[run] if times[run] > latest - size else 0
+                if run >= checked and not self.alerted and \
+                        total + count >= breach:
+                    self.alerted = True
+                    self.__alert_message(
+                        times[run], max(breach, total + min(count, 1))
+                    )
+                total += count
+
+            # Hits of the window before the block still in the window that
+            # ends at each segment
+            remaining = window.total
+            dropped = latest - size if latest is not None else None
+            for segment in range(first, len(block.maxima)):
+                peak = block.peaks[segment]
+                if latest is not None:
+                    while dropped < min(peak - size, latest):
+                        dropped += 1
+                        remaining -= window.counts[dropped % size]
+
+                start = block.maxima[segment]
+                end = block.maxima[segment + 1] \
+                    if segment + 1 < len(block.maxima) else len(times)
+                base = remaining + block.bases[segment]
+                if self.alerted and base + 1 < breach:
+                    self.alerted = False
+                    self.__recovered_message(peak, base + 1)
+                if self.alerted:
+                    continue
+
+                run = max(
+                    bisect_left(counted, breach - base, start, end), checked
+                )
+                if run < end:
+                    before = counted[run - 1] if run > start else 0
+                    hits = base + before + min(counted[run] - before, 1)
+                    self.alerted = True
+                    self.__alert_message(times[run], max(breach, hits))
+
+            window.advance(block.peaks[-1])
+            for timestamp, count in block.recent.items():
+                window.add(timestamp, count)
+        self.__notify_listeners()
+
+    def checkpoint(self):
+        """
+        Returns:
+            dict: Copy of the window counts and alert state that can be
+                serialized, and restored with restore
+        """
+        with self.lock:
+            state = {
+                'window': self.alert_window.state(),
+                'start_time': self.start_time,
+                'warmed_up': self.warmed_up,
+                'alerted': self.alerted,
+                'alert_data': dict(self.alert_data),
+                'read_positions': self.read_positions.checkpoint()
+            }
+            if self.rule_engine:
+                state['rules'] = self.rule_engine.checkpoint()
+        return state
+
+    def restore(self, state):
+        """
+        Restores the state saved by checkpoint, so that alerting resumes
+        straight away instead of waiting out a new time window. Only the
+        alert count is kept when the time window has changed since
+
+        Args:
+            state (dict): State returned by checkpoint
+        """
+        with self.lock:
+            if self.alert_window.restore(state['window']):
+                self.start_time = state['start_time']
+                self.warmed_up = state['warmed_up']
+                self.alerted = state['alerted']
+                self.alert_data = dict(state['alert_data'])
+            else:
+                self.alert_data['alert_count'] = (
+                    state['alert_data']['alert_count']
+                )
+            if self.rule_engine and 'rules' in state:
+                self.rule_engine.restore(state['rules'])
+            self.read_positions.restore(state['read_positions'])
+            self.alert_version += 1
+
+    def __has_warmed_up(self, timestamp):
+        """
+        Checks if the first time window has passed, in real time or in log
+        time when replaying
+        """
+        now = timestamp if self.use_log_time else time()
+        if self.start_time is None:
+            self.start_time = now
+
+        self.warmed_up = (now - self.start_time) >= self.time_window
+        return self.warmed_up
 
     def updated_alert_data(self):
         """
@@ -62,22 +361,25 @@ class LogAlertConsumer(threading.Thread):
         """
         return self.alert_data
 
-    def __remove_out_of_window_timestamps(self, timestamp):
+    def __breach_total(self):
         """
-        Removes any time stamps in the alert queue that are
-        no longer in the window
+        Smallest number of hits in the window whose average is over the
+        threshold
         """
-        while self.alert_queue and \
-                (timestamp - self.time_window) > self.alert_queue[0]:
-            self.alert_queue.popleft()
+        breach = int(self.threshold * self.time_window) + 1
+        while (breach - 1) / self.time_window > self.threshold:
+            breach -= 1
+        while breach / self.time_window <= self.threshold:
+            breach += 1
+        return breach
 
     def __has_breached_threshold(self, timestamp):
         """
-        Approximate average of number of hits / second by taking the
-        size of the local queue and divided it by the time window size
+        Average number of hits / second over the time window ending at
+        the timestamp, seconds that fall out of the window are dropped
         """
-        self.__remove_out_of_window_timestamps(timestamp)
-        return (len(self.alert_queue) / self.time_window) > self.threshold
+        self.alert_window.advance(timestamp)
+        return self.alert_window.average() > self.threshold
 
     def __should_alert_or_recover(self, timestamp):
         """
@@ -88,12 +390,12 @@ class LogAlertConsumer(threading.Thread):
         current_state = self.__has_breached_threshold(timestamp)
         if not self.alerted and current_state:
             self.alerted = True
-            self.__alert_message(timestamp)
+            self.__alert_message(timestamp, self.alert_window.total)
         elif self.alerted and not current_state:
             self.alerted = False
-            self.__recovered_message(timestamp)
+            self.__recovered_message(timestamp, self.alert_window.total)
 
-    def __alert_message(self, timestamp):
+    def __alert_message(self, timestamp, hits):
         """
         Create alert message using timestamp from log
         """
@@ -103,17 +405,39 @@ class LogAlertConsumer(threading.Thread):
         date = datetime.fromtimestamp(timestamp).strftime('%b-%d-%Y %H:%M:%S')
         self.alert_data['last_alert_time'] = date
         self.alert_data['msg_line1'] = f'High traffic generated an alert:'
-        self.alert_data['msg_line2'] = (
-            f'hits = {len(self.alert_queue)}, triggered at {date}'
-        )
+        self.alert_data['msg_line2'] = f'hits = {hits}, triggered at {date}'
+        self.alert_data['time'] = timestamp
+        self.alert_data['hits'] = hits
+        self.__alert_data_changed()
 
-    def __recovered_message(self, timestamp):
+    def __recovered_message(self, timestamp, hits):
         """
         Create recovered message using timestamp from log
         """
         date = datetime.fromtimestamp(timestamp).strftime('%b-%d-%Y %H:%M:%S')
         self.alert_data['type'] = 'recovered'
-        self.alert_data['msg_line1'] = (
-            f'Traffic normalized - hits = {len(self.alert_queue)}'
-        )
+        self.alert_data['msg_line1'] = f'Traffic normalized - hits = {hits}'
         self.alert_data['msg_line2'] = f'recovered at {date}'
+        self.alert_data['time'] = timestamp
+        self.alert_data['hits'] = hits
+        self.__alert_data_changed()
+
+    def __alert_data_changed(self):
+        """
+        Bumps the alert version and keeps a copy of the alert data after
+        alert / recover for the listeners
+        """
+        self.alert_version += 1
+        self.pending_alerts.append(dict(self.alert_data))
+
+    def __notify_listeners(self):
+        """
+        Gives listeners the alert data kept while processing, outside of the
+        lock so that the listeners never hold up a checkpoint or the display
+        """
+        pending, self.pending_alerts = self.pending_alerts, []
+        for alert_data in pending:
+            for listener in self.listeners:
+                listener(dict(alert_data))
+        if self.rule_engine:
+            self.rule_engine.notify_listeners()
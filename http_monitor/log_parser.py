@@ -0,0 +1,135 @@
+from http_monitor.log_record import LogRecord
+from sys import intern
+import re
+
+# Either a well formed log line with the fields that are needed captured,
+# or any other non empty line which is counted as malformed. Quoted fields
+# may contain commas.
+LOG_LINE_PATTERN = (
+    r'^(?:"([^"]*)","[^"]*","([^"]*)",(\d+),'
+    r'"(\S+) /([^/ "]*)[^"\n]*",(\d+),(\d+)[ \t\r]*$|.+)'
+)
+
+# Maximum number of distinct byte strings whose decoded str is cached
+STRING_CACHE_SIZE = 65536
+
+
+class LogParser:
+    """A class used to parse blocks of log lines at once with a precompiled
+    pattern. Malformed lines are counted instead of raising
+
+    Blocks can also be bytes, as read from a binary or decompressed file,
+    in which case the pattern runs over the bytes and only the captured
+    fields are turned into str. Client, user, method, section and status
+    repeat a lot, so their str is looked up in a cache instead of decoding
+    them on every line
+
+    Attributes:
+        pattern (Pattern): Compiled pattern matching one line of the log
+        bytes_pattern (Pattern): Same pattern for blocks of bytes
+        strings (dict): Byte string to its decoded and interned str
+        parsed_lines (int): Number of lines parsed into records
+        malformed_lines (int): Number of non empty lines that were skipped
+    """
+
+    def __init__(self):
+        self.pattern = re.compile(LOG_LINE_PATTERN, re.MULTILINE)
+        self.bytes_pattern = re.compile(
+            LOG_LINE_PATTERN.encode(), re.MULTILINE
+        )
+        self.strings = {}
+        self.parsed_lines = 0
+        self.malformed_lines = 0
+
+    def parse_block(self, block):
+        """
+        Parses a block of log lines
+
+        Args:
+            block (str): One or more complete log lines, or bytes of them in
+                UTF-8
+
+        Returns:
+            list: LogRecord for each well formed line, in order
+        """
+        if isinstance(block, bytes):
+            return self.__parse_bytes(block)
+
+        records = []
+        append = records.append
+        new_record = tuple.__new__
+        malformed = 0
+
+        for client, user_id, time, method, section, status, size in \
+                self.pattern.findall(block):
+            if not time:
+                malformed += 1
+                continue
+
+            append(new_record(LogRecord, (
+                intern(client),
+                user_id,
+                int(time),
+                intern(method),
+                intern(section),
+                intern(status),
+                int(size)
+            )))
+
+        self.parsed_lines += len(records)
+        self.malformed_lines += malformed
+        return records
+
+    def __parse_bytes(self, block):
+        """
+        Parses a block of log lines in bytes without decoding all of it
+        """
+        records = []
+        append = records.append
+        new_record = tuple.__new__
+        get = self.strings.get
+        decode = self.__decode
+        malformed = 0
+
+        for client, user_id, time, method, section, status, size in \
+                self.bytes_pattern.findall(block):
+            if not time:
+                malformed += 1
+                continue
+
+            append(new_record(LogRecord, (
+                get(client) or decode(client),
+                get(user_id) or decode(user_id),
+                int(time),
+                get(method) or decode(method),
+                get(section) or decode(section),
+                get(status) or decode(status),
+                int(size)
+            )))
+
+        self.parsed_lines += len(records)
+        self.malformed_lines += malformed
+        return records
+
+    def __decode(self, value):
+        """
+        Returns:
+            str: Decoded and interned value, cached for the next lines
+        """
+        if len(self.strings) >= STRING_CACHE_SIZE:
+            self.strings.clear()
+        string = intern(value.decode('utf-8', errors='replace'))
+        self.strings[value] = string
+        return string
+
+    def parse_lines(self, log_lines):
+        """
+        Parses a list of log lines
+
+        Args:
+            log_lines (list): Log lines, each ending with a newline
+
+        Returns:
+            list: LogRecord for each well formed line, in order
+        """
+        return self.parse_block(''.join(log_lines))
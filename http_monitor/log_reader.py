@@ -1,4 +1,7 @@
-import os
+from http_monitor.batch_queue import ReadBatch
+from http_monitor.file_follower import FileFollower
+from http_monitor.instrumentation import StageStats
+from http_monitor.log_parser import LogParser
 import threading
 import time
 
@@ -10,22 +13,45 @@ class LogReader(threading.Thread):
     Attributes
     ----------
     log_file_path (str): Path to log file that should be tailed
-    alert_queue (deque): Deque to be used by the Alert Consumer
-    stats_queue (deque): Deque to be used by the Stats Consumer
+    alert_queue (BatchQueue): Batch queue to be used by the Alert Consumer
+    stats_queue (BatchQueue): Batch queue to be used by the Stats Consumer
+    ship_queue (BatchQueue): Batch queue to be used by the AggregateShipper,
+        None when not shipping to an aggregator
+    read_size (int): Approximate number of bytes to read per batch
+    offset_path (str): File the read offset is persisted to, if any
+    start_positions (list): Read positions of the consumers saved by a
+        Checkpointer to resume from, if any
+    parser (LogParser): Parses batches and counts malformed lines
+    stage_stats (StageStats): Lines read and time spent parsing them
     thread_terminated (boolean): Flag to kill thread
     """
 
-    def __init__(self, log_file_path, alert_queue, stats_queue):
+    def __init__(self, log_file_path, alert_queue, stats_queue,
+                 read_size=65536, offset_path=None, ship_queue=None,
+                 start_positions=None):
         """
         Args:
             log_file_path (str): Path to log file that should be tailed
-            alert_queue (deque): Deque to be used by the Alert Consumer
-            stats_queue (deque): Deque to be used by the Stats Consumer
+            alert_queue (BatchQueue): Batch queue used by the Alert Consumer
+            stats_queue (BatchQueue): Batch queue used by the Stats Consumer
+            read_size (int): Approximate number of bytes to read per batch
+            offset_path (str): File to persist the read offset to so a
+                restart resumes from it instead of the end of the file
+            ship_queue (BatchQueue): Batch queue used by the
+                AggregateShipper
+            start_positions (list): Read positions of the consumers to
+                resume from instead of the persisted offset
         """
         threading.Thread.__init__(self)
         self.log_file_path = log_file_path
         self.alert_queue = alert_queue
         self.stats_queue = stats_queue
+        self.ship_queue = ship_queue
+        self.read_size = read_size
+        self.offset_path = offset_path
+        self.start_positions = start_positions
+        self.parser = LogParser()
+        self.stage_stats = StageStats()
         self.thread_terminated = False
 
     def run(self):
@@ -33,50 +59,55 @@ class LogReader(threading.Thread):
         Starts the thread process
         """
         try:
-            with open(self.log_file_path, "r") as log_file:
-                log_lines = self.__tail_file(log_file)
-                for log_line in log_lines:
-                    parsed_log_line = self.__parse_log_line(log_line)
-                    # Only add if the parsed line has been parsed correctly
-                    if parsed_log_line:
-                        self.alert_queue.append(parsed_log_line['time'])
-                        self.stats_queue.append(parsed_log_line)
+            follower = FileFollower(
+                self.log_file_path, self.read_size, self.offset_path,
+                self.start_positions
+            )
+            with follower:
+                for log_block in self.__tail_file(follower):
+                    # Malformed lines are counted by the parser and skipped
+                    started = time.perf_counter()
+                    malformed = self.parser.malformed_lines
+                    # Tagged with how far the file has been read, which
+                    # the consumers checkpoint once they have processed it
+                    records = ReadBatch(
+                        self.parser.parse_block(log_block),
+                        follower.position()
+                    )
+                    self.stage_stats.record_batch(
+                        records, time.perf_counter() - started,
+                        self.parser.malformed_lines - malformed
+                    )
+
+                    # Both consumers share the same batch of records
+                    # Lines a full queue dropped, counted once per queue
+                    self.stage_stats.dropped += (
+                        self.alert_queue.put(records) +
+                        self.stats_queue.put(records)
+                    )
+                    if self.ship_queue is not None:
+                        self.stage_stats.dropped += self.ship_queue.put(
+                            records
+                        )
         except IOError:
             raise "Unable to open log file"
+        finally:
+            self.alert_queue.close()
+            self.stats_queue.close()
+            if self.ship_queue is not None:
+                self.ship_queue.close()
 
     # Tailing file implementation is from a presentation
     # discussing different tools leveraging Python generators
     # https://github.com/dabeaz/generators/
-    def __tail_file(self, log_file):
+    def __tail_file(self, follower):
         """
-        Tails the provided file for new log entries
+        Tails the provided file for new log entries, yielding every line
+        that is available at once so that consumers get whole batches
         """
-        log_file.seek(0, os.SEEK_END)
         while not self.thread_terminated:
-            line = log_file.readline()
-            if not line:
+            log_block = follower.read_block()
+            if not log_block:
                 time.sleep(0.1)
                 continue
-            yield line
-
-    def __parse_log_line(self, log_line):
-        """
-        Parses a log line to get required data points.
-        """
-        client, _, user_id, time, section, status, size = log_line.split(',')
-
-        data = {}
-        try:
-            data['client'] = client.strip('"')
-            data['user_id'] = user_id.strip('"')
-            data['time'] = int(time)
-            data['status'] = status
-            data['size'] = int(size.rstrip())
-
-            section_parts = section.strip('"').split(' ')
-            data['method'] = section_parts[0]
-            data['section'] = section_parts[1].split('/')[1]
-        except (ValueError, IndexError):
-            return None
-
-        return data
+            yield log_block
@@ -0,0 +1,22 @@
+from collections import namedtuple
+
+
+class LogRecord(namedtuple(
+    'LogRecord',
+    ['client', 'user_id', 'time', 'method', 'section', 'status', 'size']
+)):
+    """A compact, immutable record of a parsed log line. Records have no
+    instance dict, so a batch of them costs a fraction of the memory of
+    a dict per line
+
+    Attributes:
+        client (str): Remote host that made the request, interned
+        user_id (str): Authenticated user
+        time (int): Timestamp of the request in seconds
+        method (str): HTTP method of the request, interned
+        section (str): First part of the requested path, interned
+        status (str): HTTP status code, interned
+        size (int): Size of the response in bytes
+    """
+
+    __slots__ = ()
@@ -1,60 +1,287 @@
 from collections import Counter
 from collections import defaultdict
-from collections import deque
+from heapq import nlargest
+from http_monitor.checkpoint import ReadPositions
+from http_monitor.instrumentation import StageStats
+from http_monitor.sketches import QuantileSketch
+from http_monitor.sketches import SpaceSaving
+from http_monitor.vectorized import interval_counts
+from http_monitor.vectorized import latest_times
+from http_monitor.vectorized import second_counts
+from operator import attrgetter
+from operator import itemgetter
+from time import perf_counter
 from time import time
 import threading
 
+GET_CLIENT = attrgetter('client')
+GET_SECTION = attrgetter('section')
+GET_SIZE = attrgetter('size')
+GET_STATUS = attrgetter('status')
+GET_TIME = attrgetter('time')
+
+# Response size quantiles published per interval
+SIZE_QUANTILES = (0.5, 0.95, 0.99)
+
 
 class LogStatsConsumer(threading.Thread):
     """A class used to process log lines to produce stats for the display
 
+    Counts are updated as each batch of lines arrives, so nothing is
+    buffered per line. At the end of every interval the counts are published
+    as a new stats data dict, which replaces the previous one in a single
+    assignment so readers never see a half updated snapshot
+
+    With top_k set, sections are tracked with Space-Saving sketches instead
+    of exact counters, so memory stays fixed when there are millions of
+    distinct sections (eg. bots scanning random paths). The top sections by
+    hits and by bytes are then estimates, with the bound on the error
+    published as well
+
+    The distribution of response sizes is kept per section in quantile
+    sketches, and clients are always tracked with Space-Saving sketches since
+    there can be any number of them. Both are bounded in memory and can be
+    merged, so they keep up with the ingest rate
+
+    With a history store, every batch is also rolled up per second, minute
+    and hour by log time and written to disk at the end of each interval
+
     Attributes:
         interval (int): Update stats at every interval
-        logs_queue (deque): Queue to get log lines as they are produced
-        stats_queue (deque): Local queue to move logs from logs queue
-        window_section_counts (Counter): Counter of section counts per interval
-        window_status_counts (Counter): Counter of status counts per interval
+        logs_queue (BatchQueue): Batches of log lines as they are produced
+        use_log_time (boolean): Use log timestamps for the interval instead
+            of real time, used when replaying a log file
+        top_k (int): Number of sections tracked per interval, None for exact
+        top_n (int): Number of top sections published with the stats
+        client_k (int): Number of clients tracked per interval
+        history (HistoryStore): Store the rollups are written to, None to
+            keep no history
+        window_section_size (defaultdict): Bytes per section per interval,
+            a SpaceSaving sketch when top_k is set
+        window_section_counts (Counter): Counter of section counts per
+            interval, a SpaceSaving sketch when top_k is set
+        window_status_counts (Counter): Counter of status codes per interval
+        window_size_sketches (dict): Section to QuantileSketch of response
+            sizes per interval
+        window_client_counts (SpaceSaving): Hits per client per interval
+        window_client_size (SpaceSaving): Bytes per client per interval
+        interval_start (int): Log time the current interval started at
+        total_hits (int): Hits since monitoring started
+        total_size (int): Bytes since monitoring started
         thread_terminated (boolean): Flag to kill thread
         stats_data (dict): Hashmap of data that will be used for displaying
+        stats_version (int): Incremented every time the stats data is saved
+        listeners (list): Callables given the stats data at every interval
+        pending_stats (list): Stats data not given to the listeners yet,
+            which are only called once the lock is released
+        stage_stats (StageStats): Batches processed and time spent on them
+        read_positions (ReadPositions): How far each log file has been
+            processed, saved with the checkpoints
+        lock (threading.Lock): Held while counting a batch of records or
+            saving the stats, so a checkpoint has whole batches
     """
 
-    def __init__(self, interval, logs_queue):
+    def __init__(self, interval, logs_queue, use_log_time=False, top_k=None,
+                 top_n=10, client_k=1000, history=None):
         """
         Args:
             interval (int): Interval to refresh stats
-            logs_queue (deque): Queue to get log lines as they are produced
+            logs_queue (BatchQueue): Batches of log lines as they are
+                produced
+            use_log_time (boolean): Use log timestamps for the interval
+                instead of real time
+            top_k (int): Number of sections to track with bounded memory,
+                None to count every section exactly
+            top_n (int): Number of top sections published with the stats
+            client_k (int): Number of clients to track with bounded memory
+            history (HistoryStore): Store to write the rollups to
         """
         threading.Thread.__init__(self)
         self.interval = interval
         self.logs_queue = logs_queue
-        self.stats_queue = deque()
-        self.window_section_counts = None
-        self.window_status_counts = None
+        self.use_log_time = use_log_time
+        self.top_k = top_k
+        self.top_n = top_n
+        self.client_k = client_k
+        self.history = history
+        self.__reset_window()
+        self.interval_start = None
+        self.total_hits = 0
+        self.total_size = 0
         self.thread_terminated = False
         self.stats_data = {'hits': 0, 'size': 0}
+        self.stats_version = 0
+        self.listeners = []
+        self.pending_stats = []
+        self.stage_stats = StageStats()
+        self.read_positions = ReadPositions()
         self.lock = threading.Lock()
 
     def run(self):
         """
         Starts the thread process
         """
-        section_counts, status_counts = Counter(), Counter()
-        section_size = defaultdict(int)
         start_real_time = time()
 
         while not self.thread_terminated:
-            while self.logs_queue:
-                self.stats_queue.append(self.logs_queue.popleft())
-                if (time() - start_real_time) >= self.interval:
-                    start_real_time = time()
+            # Wake up at the end of the interval even if no lines arrive
+            timeout = max(start_real_time + self.interval - time(), 0)
+            batches = self.logs_queue.get(timeout)
+            if not batches and self.logs_queue.closed:
+                break
+
+            for records in batches:
+                started = perf_counter()
+                # Batches sampled down by a full queue carry a weight
+                self.process_records(records, getattr(records, 'weight', 1))
+                self.stage_stats.record_batch(
+                    records, perf_counter() - started
+                )
+
+            if (time() - start_real_time) >= self.interval:
+                start_real_time = time()
+                self.save_stats()
+
+        # Unblocks a reader waiting on a full queue
+        self.logs_queue.close()
+        if self.history:
+            self.history.flush()
+
+    def add_listener(self, listener):
+        """
+        Registers a callable that is given the stats data every time the
+        stats for an interval are saved
+
+        Args:
+            listener (callable): Takes the stats data dict
+        """
+        self.listeners.append(listener)
+
+    def process_records(self, records, weight=1):
+        """
+        Counts a batch of records in the current interval. When using log
+        time, stats are saved whenever a record crosses into the next
+        interval
+
+        Args:
+            records (list): LogRecord for each parsed log line
+            weight (int): Number of log lines each record stands for, more
+                than 1 when the batch was sampled
+        """
+        if not records:
+            return
+        with self.lock:
+            # Already counted before a restart
+            if self.read_positions.track(records):
+                self.__count_records(records, weight)
+        self.__notify_listeners()
+
+    def process_arrays(self, arrays):
+        """
+        Counts a block of lines parsed by ArrayParser, with the same stats
+        as process_records on the same lines. Each run of lines within an
+        interval is counted at once and merged into the current interval
+
+        Args:
+            arrays (LogArrays): Columns of the parsed log lines
+        """
+        times = arrays.times
+        if not len(times):
+            return
+        if not self.use_log_time:
+            self.__merge_arrays(arrays, 0, len(times))
+            return
+
+        if self.interval_start is None:
+            self.interval_start = int(times[0])
+
+        # A line starts the next interval where the latest time so far
+        # first reaches it, as that line is the first one beyond it
+        latest = latest_times(times)
+        start = 0
+        while True:
+            end = int(latest.searchsorted(
+                self.interval_start + self.interval
+            ))
+            if end == len(times):
+                break
+            self.__merge_arrays(arrays, start, end)
+            start = end
+            self.save_stats()
+
+            # Skip over any intervals without log lines
+            skipped = (int(times[end]) - self.interval_start) // self.interval
+            self.interval_start += skipped * self.interval
+
+        self.__merge_arrays(arrays, start, len(times))
+
+    def merge_counts(self, section_size, section_counts, status_counts,
+                     size_sketches=None, client_counts=None, client_size=None):
+        """
+        Adds counts that were aggregated elsewhere, eg. by a worker process,
+        to the current interval. They are not added to the history store,
+        which takes per second counts with HistoryStore.add_counts
+
+        Args:
+            section_size (dict): Bytes per section
+            section_counts (Counter): Hits per section
+            status_counts (Counter): Hits per status code or class, eg. 2XX
+            size_sketches (dict): Section to QuantileSketch of response sizes
+            client_counts (dict): Hits per client
+            client_size (dict): Bytes per client
+        """
+        if self.top_k:
+            self.window_section_size.update(section_size)
+        else:
+            for section, size in section_size.items():
+                self.window_section_size[section] += size
+        self.window_section_counts.update(section_counts)
+        self.window_status_counts.update(status_counts)
+        for section, sketch in (size_sketches or {}).items():
+            self.window_size_sketches[section].merge(sketch)
+        self.window_client_counts.update(client_counts or {})
+        self.window_client_size.update(client_size or {})
+        self.__prune_size_sketches()
+
+        self.total_hits += sum(section_counts.values())
+        self.total_size += sum(section_size.values())
+
+    def save_stats(self):
+        """
+        Publishes the stats for the current interval and starts the next one
+        """
+        with self.lock:
+            self.__save_window()
+        self.__notify_listeners()
+
+    def checkpoint(self):
+        """
+        Returns:
+            dict: Totals since monitoring started and how far each log file
+                has been processed, restored with restore
+        """
+        with self.lock:
+            return {
+                'total_hits': self.total_hits,
+                'total_size': self.total_size,
+                'read_positions': self.read_positions.checkpoint()
+            }
 
-                    with self.lock:
-                        self.__save_stats(
-                            section_size, section_counts, status_counts
-                        )
+    def restore(self, state):
+        """
+        Carries on the totals saved by checkpoint
 
-                    section_counts, status_counts = Counter(), Counter()
-                    section_size = defaultdict(int)
+        Args:
+            state (dict): State returned by checkpoint
+        """
+        with self.lock:
+            self.total_hits = state['total_hits']
+            self.total_size = state['total_size']
+            self.read_positions.restore(state['read_positions'])
+            self.stats_data = dict(
+                self.stats_data, hits=self.total_hits, size=self.total_size
+            )
+            self.stats_version += 1
 
     def updated_stats_data(self):
         """
@@ -66,30 +293,215 @@ class LogStatsConsumer(threading.Thread):
         """
         return self.stats_data
 
-    def __update_counts(self, section_size, section_counts, status_counts):
+    def __count_records(self, records, weight):
+        """
+        Counts a batch of records, saving the stats of each interval it
+        crosses into the next one in log time
+        """
+        if not self.use_log_time:
+            self.__update_counts(records, weight)
+            return
+
+        if self.interval_start is None:
+            self.interval_start = records[0].time
+        if max(map(GET_TIME, records)) < self.interval_start + self.interval:
+            self.__update_counts(records, weight)
+            return
+
+        start = 0
+        for i, record in enumerate(records):
+            if record.time >= self.interval_start + self.interval:
+                self.__update_counts(records[start:i], weight)
+                start = i
+                self.__save_window()
+
+                # Skip over any intervals without log lines
+                skipped = (record.time - self.interval_start) // self.interval
+                self.interval_start += skipped * self.interval
+
+        self.__update_counts(records[start:], weight)
+
+    def __save_window(self):
+        """
+        Replaces the stats data with the counts of the current interval and
+        starts the next one, keeping it for the listeners
+        """
+        status_counts = Counter()
+        for status, count in self.window_status_counts.items():
+            status_counts[status[0] + "XX"] += count
+
+        section_size = self.window_section_size
+        section_counts = self.window_section_counts
+        size_sketches = self.window_size_sketches
+        client_size = self.window_client_size
+        top_sections = section_counts.most_common(self.top_n)
+
+        all_sizes = QuantileSketch()
+        for sketch in size_sketches.values():
+            all_sizes.merge(sketch)
+
+        stats_data = {
+            'hits': self.total_hits,
+            'size': self.total_size,
+            'status_counts': status_counts,
+            'top_sections': [
+                (section, count, section_size.get(section, 0))
+                for section, count in top_sections
+            ],
+            'size_percentiles': all_sizes.quantiles(SIZE_QUANTILES),
+            'section_percentiles': {
+                section: size_sketches[section].quantiles(SIZE_QUANTILES)
+                for section, _ in top_sections
+                if section in size_sketches
+            },
+            'top_clients': [
+                (client, count, client_size.get(client, 0))
+                for client, count in self.window_client_counts.most_common(
+                    self.top_n
+                )
+            ],
+            'top_clients_by_size': client_size.most_common(self.top_n)
+        }
+        if self.top_k:
+            stats_data['top_sections_by_size'] = section_size.most_common(
+                self.top_n
+            )
+            stats_data['section_size'] = dict(section_size.counts)
+            stats_data['section_counts'] = Counter(section_counts.counts)
+            stats_data['section_error'] = section_counts.max_error()
+        else:
+            stats_data['top_sections_by_size'] = nlargest(
+                self.top_n, section_size.items(), key=itemgetter(1)
+            )
+            stats_data['section_size'] = dict(section_size)
+            stats_data['section_counts'] = section_counts
+        if self.use_log_time:
+            stats_data['interval_start'] = self.interval_start
+
+        self.__reset_window()
+
+        self.stats_data = stats_data
+        self.stats_version += 1
+
+        if self.history:
+            self.history.flush()
+        self.pending_stats.append(stats_data)
+
+    def __notify_listeners(self):
+        """
+        Gives listeners the stats data of every interval saved, outside of
+        the lock
+        """
+        pending, self.pending_stats = self.pending_stats, []
+        for stats_data in pending:
+            for listener in self.listeners:
+                listener(stats_data)
+
+    def __reset_window(self):
+        """
+        Starts empty counters for the next interval
+        """
+        if self.top_k:
+            self.window_section_size = SpaceSaving(self.top_k)
+            self.window_section_counts = SpaceSaving(self.top_k)
+        else:
+            self.window_section_size = defaultdict(int)
+            self.window_section_counts = Counter()
+        self.window_status_counts = Counter()
+        self.window_size_sketches = defaultdict(QuantileSketch)
+        self.window_client_counts = SpaceSaving(self.client_k)
+        self.window_client_size = SpaceSaving(self.client_k)
+
+    def __prune_size_sketches(self):
+        """
+        Drops the size sketches of sections the section sketch no longer
+        tracks, so there are never many more sketches than top_k
+        """
+        if not self.top_k or len(self.window_size_sketches) <= 2 * self.top_k:
+            return
+        tracked = self.window_section_counts
+        for section in list(self.window_size_sketches):
+            if section not in tracked:
+                del self.window_size_sketches[section]
+
+    def __update_counts(self, records, weight=1):
         """
-        Gets log data from the local queue to update counts and size
-        totals
+        Adds a batch of records to the counts and size totals
         """
-        while self.stats_queue:
-            log_data = self.stats_queue.popleft()
-            self.stats_data['hits'] += 1
-            self.stats_data['size'] += log_data['size']
+        if weight != 1:
+            self.__update_sampled_counts(records, weight)
+            return
 
-            section = log_data['section']
-            status = log_data['status']
-            size = log_data['size']
+        self.window_status_counts.update(map(GET_STATUS, records))
 
-            section_size[section] += size
-            section_counts[section] += 1
-            status_counts[status[0]+"XX"] += 1
+        if self.top_k:
+            # Aggregate the batch first so each sketch sees every distinct
+            # section of the batch once
+            section_size = defaultdict(int)
+            self.window_section_counts.update(
+                Counter(map(GET_SECTION, records))
+            )
+        else:
+            section_size = self.window_section_size
+            self.window_section_counts.update(map(GET_SECTION, records))
 
-    def __save_stats(self, section_size, section_counts, status_counts):
+        client_size = defaultdict(int)
+        for record in records:
+            section_size[record.section] += record.size
+            client_size[record.client] += record.size
+        if self.top_k:
+            self.window_section_size.update(section_size)
+        self.window_client_counts.update(Counter(map(GET_CLIENT, records)))
+        self.window_client_size.update(client_size)
+
+        # Counting the distinct sizes first means each one is bucketed once
+        size_sketches = self.window_size_sketches
+        for (section, size), count in Counter(
+            zip(map(GET_SECTION, records), map(GET_SIZE, records))
+        ).items():
+            size_sketches[section].add(size, count)
+        self.__prune_size_sketches()
+
+        self.total_hits += len(records)
+        self.total_size += sum(map(GET_SIZE, records))
+
+        if self.history:
+            self.history.add_records(records)
+
+    def __merge_arrays(self, arrays, start, end):
+        """
+        Adds a range of parsed lines to the counts and size totals
         """
-        Copies the counters into new counters to be used by display
-        so that counters locally can be reset for next interval
+        if start == end:
+            return
+        self.merge_counts(*interval_counts(arrays, start, end))
+        if self.history:
+            self.history.add_counts(*second_counts(arrays, start, end))
+
+    def __update_sampled_counts(self, records, weight):
+        """
+        Adds a batch that was sampled down by a full queue, counting each
+        record as weight log lines
         """
-        self.__update_counts(section_size, section_counts, status_counts)
-        self.stats_data["section_size"] = dict(section_size)
-        self.stats_data["section_counts"] = Counter(section_counts)
-        self.stats_data["status_counts"] = Counter(status_counts)
+        section_counts = Counter()
+        section_size = defaultdict(int)
+        client_counts = Counter()
+        client_size = defaultdict(int)
+        size_sketches = defaultdict(QuantileSketch)
+        for record in records:
+            section_counts[record.section] += weight
+            section_size[record.section] += record.size * weight
+            client_counts[record.client] += weight
+            client_size[record.client] += record.size * weight
+            size_sketches[record.section].add(record.size, weight)
+
+        status_counts = Counter(map(GET_STATUS, records))
+        for status in status_counts:
+            status_counts[status] *= weight
+
+        self.merge_counts(
+            section_size, section_counts, status_counts, size_sketches,
+            client_counts, client_size
+        )
+        if self.history:
+            self.history.add_records(records, weight)
@@ -0,0 +1,306 @@
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from http_monitor.log_stats_consumer import SIZE_QUANTILES
+import json
+import threading
+import time
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+JSON_CONTENT_TYPE = 'application/json'
+
+
+def escape_label(value):
+    """
+    Returns:
+        str: Value escaped for use as a Prometheus label value
+    """
+    return (
+        str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves the responses prepared by the MetricsServer. Requests never
+    serialize anything or take a lock, they only look up the bytes of the
+    latest response
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    # Buffer the headers and body so each response goes out in one packet,
+    # which keep-alive clients would otherwise wait on delayed ACKs for
+    wbufsize = 65536
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        response = self.server.responses.get(self.path.split('?', 1)[0])
+        if response is None:
+            self.send_error(404)
+            return
+
+        content_type, body = response
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Requests are not logged, which would draw over the display
+        pass
+
+
+class MetricsServer(threading.Thread):
+    """A class used to serve the latest stats and alert state over HTTP for
+    scraping, eg. by Prometheus
+
+        /metrics       Prometheus text format
+        /metrics.json  Latest stats data as JSON
+        /alerts        Latest alert state as JSON
+        /pipeline      Throughput, queue depths and lag as JSON
+
+    The responses are serialized once each time the consumers publish new
+    data, from the listeners, and swapped in with a single assignment. The
+    request threads only read the prepared bytes, so scrapes cost the
+    consumers nothing however often they come. The pipeline metrics change
+    all the time, so they are serialized once a second by this thread
+
+    Attributes:
+        server (ThreadingHTTPServer): Server handling the requests
+        stats_data (dict): Latest stats data published
+        alert_data (dict): Latest alert data published
+        file_alert_data (dict): Log file path to its latest alert data
+        rule_alert_data (dict): Rule name to its latest alert data, for the
+            alert rules of the alerts consumer
+        pipeline (PipelineMonitor): Provides the pipeline metrics, if any
+        pipeline_data (dict): Latest snapshot of the pipeline metrics
+        update_lock (threading.Lock): Serializes the updates made by the
+            consumer threads, never taken by requests
+        thread_terminated (boolean): Flag to kill thread
+    """
+
+    def __init__(self, stats, alerts, file_alerts=None, host='127.0.0.1',
+                 port=9100, pipeline=None):
+        """
+        Args:
+            stats (LogStatsConsumer): Provides the stats data
+            alerts (LogAlertConsumer): Provides the alert data
+            file_alerts (dict): Log file path to LogAlertConsumer when more
+                than one file is monitored
+            host (str): Address to listen on
+            port (int): Port to listen on, 0 for any free port
+            pipeline (PipelineMonitor): Provides the pipeline metrics
+        """
+        # A daemon so that the server never keeps the app running
+        threading.Thread.__init__(self, daemon=True)
+        self.server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.server.timeout = 0.5
+        self.stats_data = stats.updated_stats_data()
+        self.alert_data = dict(alerts.updated_alert_data())
+        self.file_alert_data = {
+            path: dict(consumer.updated_alert_data())
+            for path, consumer in (file_alerts or {}).items()
+        }
+        self.rule_alert_data = {}
+        if alerts.rule_engine:
+            self.rule_alert_data = {
+                rule.name: {'rule': rule.name, 'alert_count': 0}
+                for rule in alerts.rule_engine.rules
+            }
+        self.pipeline = pipeline
+        self.pipeline_data = pipeline.snapshot() if pipeline else {}
+        self.update_lock = threading.Lock()
+        self.thread_terminated = False
+        self.publish()
+
+        stats.add_listener(self.on_stats)
+        alerts.add_listener(self.on_alert)
+        if alerts.rule_engine:
+            alerts.rule_engine.add_listener(self.on_alert)
+        for path, consumer in (file_alerts or {}).items():
+            consumer.add_listener(
+                lambda alert_data, path=path: self.on_alert(alert_data, path)
+            )
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def run(self):
+        """
+        Starts the thread process
+        """
+        published = time.monotonic()
+        try:
+            while not self.thread_terminated:
+                self.server.handle_request()
+                if self.pipeline and time.monotonic() - published >= 1:
+                    published = time.monotonic()
+                    with self.update_lock:
+                        self.pipeline_data = self.pipeline.snapshot()
+                        self.publish()
+        finally:
+            self.server.server_close()
+
+    def on_stats(self, stats_data):
+        """
+        Listener for interval stats from LogStatsConsumer
+        """
+        with self.update_lock:
+            self.stats_data = stats_data
+            self.publish()
+
+    def on_alert(self, alert_data, log_file_path=None):
+        """
+        Listener for alert / recover events from LogAlertConsumer, or from
+        its RuleEngine. Called once the consumer has released its lock, so
+        serializing the responses never holds up its checkpoints
+        """
+        with self.update_lock:
+            if 'rule' in alert_data:
+                self.rule_alert_data[alert_data['rule']] = alert_data
+            elif log_file_path:
+                self.file_alert_data[log_file_path] = alert_data
+            else:
+                self.alert_data = alert_data
+            self.publish()
+
+    def publish(self):
+        """
+        Serializes every response and swaps them in at once
+        """
+        alerts = {
+            'alerting': self.alert_data.get('type') == 'alert',
+            'alert': self.alert_data,
+            'files': self.file_alert_data,
+            'rules': self.rule_alert_data
+        }
+        self.server.responses = {
+            '/metrics': (
+                PROMETHEUS_CONTENT_TYPE,
+                self.__prometheus_text().encode('utf-8')
+            ),
+            '/metrics.json': (
+                JSON_CONTENT_TYPE,
+                json.dumps(self.stats_data, default=str).encode('utf-8')
+            ),
+            '/alerts': (
+                JSON_CONTENT_TYPE,
+                json.dumps(alerts, default=str).encode('utf-8')
+            ),
+            '/pipeline': (
+                JSON_CONTENT_TYPE,
+                json.dumps(self.pipeline_data).encode('utf-8')
+            )
+        }
+
+    def __prometheus_text(self):
+        """
+        Returns:
+            str: Stats and alert state in the Prometheus text format
+        """
+        stats_data = self.stats_data
+        alert_data = self.alert_data
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in samples:
+                if value is None:
+                    continue
+                label_text = ','.join(
+                    f'{key}="{escape_label(label)}"'
+                    for key, label in labels
+                )
+                if label_text:
+                    lines.append(f'{name}{{{label_text}}} {value}')
+                else:
+                    lines.append(f'{name} {value}')
+
+        metric('http_monitor_hits_total', 'counter',
+               'Hits since monitoring started',
+               [((), stats_data.get('hits', 0))])
+        metric('http_monitor_bytes_total', 'counter',
+               'Bytes since monitoring started',
+               [((), stats_data.get('size', 0))])
+        metric('http_monitor_interval_status_hits', 'gauge',
+               'Hits per status class in the last interval',
+               [((('class', status),), count) for status, count
+                in sorted(stats_data.get('status_counts', {}).items())])
+        metric('http_monitor_interval_section_hits', 'gauge',
+               'Hits of the top sections in the last interval',
+               [((('section', section),), count) for section, count, _
+                in stats_data.get('top_sections', [])])
+        metric('http_monitor_interval_section_bytes', 'gauge',
+               'Bytes of the top sections in the last interval',
+               [((('section', section),), size) for section, _, size
+                in stats_data.get('top_sections', [])])
+        metric('http_monitor_interval_response_bytes', 'gauge',
+               'Response size quantiles of the top sections in the last '
+               'interval',
+               [((('section', section), ('quantile', q)), value)
+                for section, values
+                in stats_data.get('section_percentiles', {}).items()
+                for q, value in zip(SIZE_QUANTILES, values)])
+        metric('http_monitor_alerting', 'gauge',
+               '1 while the average hits per second is over the threshold',
+               [((), int(alert_data.get('type') == 'alert'))])
+        metric('http_monitor_alerts_total', 'counter',
+               'Alerts since monitoring started',
+               [((), alert_data.get('alert_count', 0))])
+        if self.file_alert_data:
+            metric('http_monitor_file_alerting', 'gauge',
+                   '1 while a single log file is over the threshold',
+                   [((('file', path),), int(data.get('type') == 'alert'))
+                    for path, data in sorted(self.file_alert_data.items())])
+        if self.rule_alert_data:
+            metric('http_monitor_rule_alerting', 'gauge',
+                   '1 while an alert rule is over its threshold',
+                   [((('rule', name),), int(data.get('type') == 'alert'))
+                    for name, data in sorted(self.rule_alert_data.items())])
+            metric('http_monitor_rule_alerts_total', 'counter',
+                   'Alerts of each alert rule since monitoring started',
+                   [((('rule', name),), data['alert_count'])
+                    for name, data in sorted(self.rule_alert_data.items())])
+
+        if self.pipeline_data:
+            self.__pipeline_metrics(metric)
+
+        return '\n'.join(lines) + '\n'
+
+    def __pipeline_metrics(self, metric):
+        """
+        Adds the pipeline metrics to the Prometheus text
+        """
+        stages = self.pipeline_data['stages']
+        queues = self.pipeline_data['queues']
+        metric('http_monitor_stage_lines_total', 'counter',
+               'Lines processed by each stage of the pipeline',
+               [((('stage', name),), stage['lines'])
+                for name, stage in stages.items()])
+        metric('http_monitor_stage_malformed_lines_total', 'counter',
+               'Lines that could not be parsed',
+               [((('stage', name),), stage['malformed'])
+                for name, stage in stages.items()])
+        metric('http_monitor_stage_dropped_lines_total', 'counter',
+               'Lines a full queue did not take, once per queue',
+               [((('stage', name),), stage['dropped'])
+                for name, stage in stages.items()])
+        metric('http_monitor_stage_batch_seconds', 'gauge',
+               'Average seconds spent per batch over the last second',
+               [((('stage', name),), stage['ms_per_batch'] / 1e3)
+                for name, stage in stages.items()])
+        metric('http_monitor_stage_lag_seconds', 'gauge',
+               'Wall clock minus the log time of the last line processed',
+               [((('stage', name),), stage['lag_seconds'])
+                for name, stage in stages.items()])
+        metric('http_monitor_queue_lines', 'gauge',
+               'Lines waiting in each queue',
+               [((('queue', name),), queue['lines'])
+                for name, queue in queues.items()])
+        metric('http_monitor_queue_dropped_lines_total', 'counter',
+               'Lines dropped or sampled out by each full queue',
+               [((('queue', name),), queue['dropped'])
+                for name, queue in queues.items()])
@@ -0,0 +1,192 @@
+from http_monitor.batch_queue import ReadBatch
+from http_monitor.file_follower import FileFollower
+from http_monitor.inotify import IN_CREATE
+from http_monitor.inotify import IN_MODIFY
+from http_monitor.inotify import IN_MOVED_TO
+from http_monitor.inotify import Inotify
+from http_monitor.inotify import inotify_available
+from http_monitor.instrumentation import StageStats
+from http_monitor.log_parser import LogParser
+import os
+import select
+import threading
+import time
+
+
+class MultiFileTailer(threading.Thread):
+    """A class used to tail many log files from a single thread. It waits
+    on inotify where it is available and otherwise polls all of the files
+    in one loop. Every file feeds the aggregated queues and any consumers
+    registered for just that file
+
+    Attributes:
+        alert_queue (BatchQueue): Aggregated batches for the Alert Consumer
+        stats_queue (BatchQueue): Aggregated batches for the Stats Consumer
+        ship_queue (BatchQueue): Aggregated batches for the
+            AggregateShipper, None when not shipping to an aggregator
+        followers (dict): Log file path to its FileFollower
+        file_consumers (dict): Log file path to consumers of only that file
+        parser (LogParser): Parses batches and counts malformed lines
+        stage_stats (StageStats): Lines read and time spent parsing them
+        poll_interval (float): Seconds between polls without inotify
+        rescan_interval (float): Seconds between checks of all files when
+            waiting on inotify, in case an event was missed
+        use_inotify (boolean): Flag to wait on inotify instead of polling
+        thread_terminated (boolean): Flag to kill thread
+    """
+
+    def __init__(self, alert_queue, stats_queue, poll_interval=0.1,
+                 rescan_interval=1.0, use_inotify=None, ship_queue=None):
+        """
+        Args:
+            alert_queue (BatchQueue): Aggregated batches for the Alert
+                Consumer
+            stats_queue (BatchQueue): Aggregated batches for the Stats
+                Consumer
+            poll_interval (float): Seconds between polls without inotify
+            rescan_interval (float): Seconds between checks of all files
+                when waiting on inotify
+            use_inotify (boolean): Wait on inotify, defaults to whether it
+                is available
+            ship_queue (BatchQueue): Aggregated batches for the
+                AggregateShipper
+        """
+        threading.Thread.__init__(self)
+        self.alert_queue = alert_queue
+        self.stats_queue = stats_queue
+        self.ship_queue = ship_queue
+        self.followers = {}
+        self.file_consumers = {}
+        self.parser = LogParser()
+        self.stage_stats = StageStats()
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        if use_inotify is None:
+            use_inotify = inotify_available()
+        self.use_inotify = use_inotify
+        self.thread_terminated = False
+
+    def add_file(self, log_file_path, consumers=(), offset_path=None,
+                 start_positions=None):
+        """
+        Starts following a log file from its end, or from its persisted
+        offset or checkpointed read positions. Must be called before the
+        thread is started
+
+        Args:
+            log_file_path (str): Path to log file that should be tailed
+            consumers (list): Consumers with a process_records method that
+                get the records of only this file, run on this thread
+            offset_path (str): File to persist the read offset to
+            start_positions (list): Read positions of the consumers to
+                resume from instead of the persisted offset
+        """
+        self.followers[log_file_path] = FileFollower(
+            log_file_path, offset_path=offset_path,
+            start_positions=start_positions
+        )
+        self.file_consumers[log_file_path] = list(consumers)
+
+    def run(self):
+        """
+        Starts the thread process
+        """
+        try:
+            if self.use_inotify:
+                self.__wait_on_inotify()
+            else:
+                self.__poll()
+        finally:
+            for follower in self.followers.values():
+                follower.close()
+            self.alert_queue.close()
+            self.stats_queue.close()
+            if self.ship_queue is not None:
+                self.ship_queue.close()
+
+    def __poll(self):
+        """
+        Reads every file in turn, sleeping when none of them had new lines
+        """
+        followers = list(self.followers.values())
+        while not self.thread_terminated:
+            if not self.__read(followers):
+                time.sleep(self.poll_interval)
+
+    def __wait_on_inotify(self):
+        """
+        Reads only the files inotify reports as modified. The directories of
+        the files are watched rather than the files themselves, so a file
+        that replaces a rotated one at the same path is picked up straight
+        away. Files that returned lines are read again straight away until
+        they are drained, and every file is checked at each rescan interval
+        in case an event was missed
+        """
+        inotify = Inotify()
+        directories = {}
+        by_name = {}
+        for log_file_path, follower in self.followers.items():
+            directory, name = os.path.split(os.path.abspath(log_file_path))
+            if directory not in directories:
+                directories[directory] = inotify.add_watch(
+                    directory, IN_MODIFY | IN_CREATE | IN_MOVED_TO
+                )
+            by_name[(directories[directory], name)] = follower
+
+        try:
+            busy = []
+            while not self.thread_terminated:
+                timeout = 0 if busy else self.rescan_interval
+                ready, _, _ = select.select([inotify], [], [], timeout)
+                if ready:
+                    changed = {
+                        by_name[(wd, name)]
+                        for wd, _, name in inotify.read_events()
+                        if (wd, name) in by_name
+                    }
+                    changed.update(busy)
+                elif busy:
+                    changed = busy
+                else:
+                    changed = self.followers.values()
+                busy = self.__read(changed)
+        finally:
+            inotify.close()
+
+    def __read(self, followers):
+        """
+        Reads, parses and hands off the new lines of each follower
+
+        Returns:
+            list: Followers that had new lines
+        """
+        busy = []
+        for follower in followers:
+            log_block = follower.read_block()
+            if not log_block:
+                continue
+            busy.append(follower)
+
+            # Malformed lines are counted by the parser and skipped
+            started = time.perf_counter()
+            malformed = self.parser.malformed_lines
+            records = ReadBatch(
+                self.parser.parse_block(log_block), follower.position()
+            )
+            self.stage_stats.record_batch(
+                records, time.perf_counter() - started,
+                self.parser.malformed_lines - malformed
+            )
+            if not records:
+                continue
+
+            # Lines a full queue dropped, counted once per queue
+            self.stage_stats.dropped += (
+                self.alert_queue.put(records) +
+                self.stats_queue.put(records)
+            )
+            if self.ship_queue is not None:
+                self.stage_stats.dropped += self.ship_queue.put(records)
+            for consumer in self.file_consumers[follower.log_file_path]:
+                consumer.process_records(records)
+        return busy
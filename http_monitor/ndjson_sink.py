@@ -0,0 +1,155 @@
+import json
+import socket
+import sys
+import threading
+import time
+
+
+def open_output(target):
+    """
+    Opens where the events are written to
+
+    Args:
+        target (str): - for stdout, tcp://host:port or unix:///path for a
+            socket, otherwise the path of a file that is appended to
+
+    Returns:
+        file: Binary stream the events are written to
+    """
+    if target == '-':
+        return sys.stdout.buffer
+    if target.startswith('tcp://'):
+        host, _, port = target[len('tcp://'):].rpartition(':')
+        return socket.create_connection((host, int(port))).makefile('wb')
+    if target.startswith('unix://'):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(target[len('unix://'):])
+        return connection.makefile('wb')
+    return open(target, 'ab')
+
+
+class NdjsonSink(threading.Thread):
+    """A class used to write alert / recover events and interval stats as
+    newline delimited JSON instead of drawing them with curses, so the
+    monitor can run headless and feed other tools
+
+    Events are serialized by the consumer threads into a buffer, and this
+    thread writes the buffer in a single write whenever it holds
+    buffer_size bytes or flush_interval seconds have passed, so a slow
+    reader of the output never holds up the consumers
+
+    Attributes:
+        output (file): Binary stream the events are written to
+        flush_interval (float): Maximum seconds an event is buffered for
+        buffer_size (int): Number of buffered bytes that triggers a write
+        buffer (list): Serialized events not written yet
+        buffered_bytes (int): Size of the serialized events in the buffer
+        condition (threading.Condition): Wakes the thread to write
+        events_written (int): Number of events written
+        thread_terminated (boolean): Flag to kill thread
+    """
+
+    def __init__(self, output, flush_interval=1.0, buffer_size=65536):
+        """
+        Args:
+            output (file): Binary stream to write the events to
+            flush_interval (float): Maximum seconds an event is buffered for
+            buffer_size (int): Number of buffered bytes that triggers a write
+        """
+        threading.Thread.__init__(self)
+        self.output = output
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.condition = threading.Condition()
+        self.events_written = 0
+        self.thread_terminated = False
+
+    def run(self):
+        """
+        Starts the thread process
+        """
+        try:
+            while not self.thread_terminated:
+                deadline = time.time() + self.flush_interval
+                with self.condition:
+                    while (not self.thread_terminated and
+                           self.buffered_bytes < self.buffer_size):
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                self.flush()
+        finally:
+            self.flush()
+            if self.output is not sys.stdout.buffer:
+                self.output.close()
+
+    def stop(self):
+        """
+        Terminates the thread once the buffered events are written
+        """
+        with self.condition:
+            self.thread_terminated = True
+            self.condition.notify()
+
+    def on_alert(self, alert_data, log_file_path=None):
+        """
+        Listener for alert / recover events from LogAlertConsumer, or from
+        its RuleEngine
+
+        Args:
+            alert_data (dict): Copy of the alert data
+            log_file_path (str): Log file the alert is for, None when it is
+                for all of the monitored files
+        """
+        event = {
+            'event': alert_data['type'],
+            'time': alert_data['time'],
+            'hits': alert_data.get('hits'),
+            'alert_count': alert_data['alert_count'],
+            'message': f'{alert_data["msg_line1"]} {alert_data["msg_line2"]}'
+        }
+        if 'rule' in alert_data:
+            event['rule'] = alert_data['rule']
+            event['value'] = alert_data['value']
+        if log_file_path:
+            event['file'] = log_file_path
+        self.write_event(event)
+
+    def on_stats(self, stats_data):
+        """
+        Listener for interval stats from LogStatsConsumer
+        """
+        event = {'event': 'stats', 'time': int(time.time())}
+        event.update(stats_data)
+        self.write_event(event)
+
+    def write_event(self, event):
+        """
+        Serializes an event and adds it to the buffer
+
+        Args:
+            event (dict): JSON serializable event
+        """
+        line = json.dumps(event, separators=(',', ':'), default=str) + '\n'
+        with self.condition:
+            self.buffer.append(line)
+            self.buffered_bytes += len(line)
+            if self.buffered_bytes >= self.buffer_size:
+                self.condition.notify()
+
+    def flush(self):
+        """
+        Writes the buffered events in a single write
+        """
+        with self.condition:
+            lines, self.buffer = self.buffer, []
+            self.buffered_bytes = 0
+        if not lines:
+            return
+
+        self.output.write(''.join(lines).encode('utf-8'))
+        self.output.flush()
+        self.events_written += len(lines)
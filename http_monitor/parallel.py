@@ -0,0 +1,561 @@
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections import defaultdict
+from http_monitor.log_alert_consumer import LogAlertConsumer
+from http_monitor.log_parser import LogParser
+from http_monitor.log_stats_consumer import LogStatsConsumer
+from http_monitor.replay import ReplayTimeline
+from http_monitor.sketches import QuantileSketch
+from http_monitor.sketches import SpaceSaving
+from itertools import groupby
+from multiprocessing import Pool
+from operator import attrgetter
+import os
+import sys
+
+GET_CLIENT = attrgetter('client')
+GET_SECTION = attrgetter('section')
+GET_SECTION_AND_SIZE = attrgetter('section', 'size')
+GET_STATUS = attrgetter('status')
+GET_TIME = attrgetter('time')
+GET_TIME_AND_CLIENT = attrgetter('time', 'client')
+GET_TIME_AND_SECTION = attrgetter('time', 'section')
+GET_TIME_SECTION_AND_SIZE = attrgetter('time', 'section', 'size')
+
+
+class PartialStats:
+    """A class used to aggregate log records into partials that can be
+    merged with partials built from other parts of the same log file
+
+    Counts are kept per second so the alerting can be replayed exactly.
+    Response size and client sketches are kept per stats interval instead,
+    which needs the origin and length of the intervals up front
+
+    Attributes:
+        hits (Counter): Hits per second of log time
+        section_counts (Counter): Hits per (second, section)
+        section_size (defaultdict): Bytes per (second, section)
+        status_counts (Counter): Hits per (second, status class)
+        origin (int): Log time the first interval starts at, None to skip
+            the sketches
+        interval (int): Seconds of log time per interval
+        client_k (int): Number of clients tracked per interval
+        size_sketches (defaultdict): QuantileSketch of response sizes per
+            (interval start, section)
+        client_counts (dict): Interval start to SpaceSaving of client hits
+        client_size (dict): Interval start to SpaceSaving of client bytes
+        parsed_lines (int): Number of lines aggregated
+        malformed_lines (int): Number of lines that could not be parsed
+    """
+
+    def __init__(self, origin=None, interval=None, client_k=1000):
+        """
+        Args:
+            origin (int): Log time the first interval starts at
+            interval (int): Seconds of log time per interval
+            client_k (int): Number of clients tracked per interval
+        """
+        self.hits = Counter()
+        self.section_counts = Counter()
+        self.section_size = defaultdict(int)
+        self.status_counts = Counter()
+        self.origin = origin
+        self.interval = interval
+        self.client_k = client_k
+        self.size_sketches = defaultdict(QuantileSketch)
+        self.client_counts = {}
+        self.client_size = {}
+        self.parsed_lines = 0
+        self.malformed_lines = 0
+
+    def interval_start(self, timestamp):
+        """
+        Returns:
+            int: Start of the interval a timestamp falls in. Lines from
+                before the first line go into the first interval
+        """
+        elapsed = max(timestamp - self.origin, 0)
+        return self.origin + elapsed // self.interval * self.interval
+
+    def add_records(self, records):
+        """
+        Args:
+            records (list): LogRecord for each parsed log line
+        """
+        self.hits.update(map(GET_TIME, records))
+        self.section_counts.update(map(GET_TIME_AND_SECTION, records))
+
+        section_size = self.section_size
+        status_counts = Counter()
+        for record in records:
+            section_size[(record.time, record.section)] += record.size
+            status_counts[(record.time, record.status[0])] += 1
+
+        for (timestamp, status), count in status_counts.items():
+            self.status_counts[(timestamp, status + 'XX')] += count
+
+        if self.origin is not None:
+            self.__add_sketches(records)
+
+    def __add_sketches(self, records):
+        """
+        Adds response sizes and clients to the sketches of their interval
+        """
+        interval_start = self.interval_start
+        for (timestamp, section, size), count in Counter(
+            map(GET_TIME_SECTION_AND_SIZE, records)
+        ).items():
+            key = (interval_start(timestamp), section)
+            self.size_sketches[key].add(size, count)
+
+        client_counts = defaultdict(Counter)
+        client_size = defaultdict(Counter)
+        for record in records:
+            client_size[interval_start(record.time)][record.client] += \
+                record.size
+        for (timestamp, client), count in Counter(
+            map(GET_TIME_AND_CLIENT, records)
+        ).items():
+            client_counts[interval_start(timestamp)][client] += count
+
+        self.__update_clients(self.client_counts, client_counts)
+        self.__update_clients(self.client_size, client_size)
+
+    def __update_clients(self, sketches, counts):
+        """
+        Adds per interval client counts to the per interval sketches
+        """
+        for start, weights in counts.items():
+            if start not in sketches:
+                sketches[start] = SpaceSaving(self.client_k)
+            sketches[start].update(weights)
+
+    def merge(self, other):
+        """
+        Args:
+            other (PartialStats): Partial built from another part of the file
+        """
+        self.hits.update(other.hits)
+        self.section_counts.update(other.section_counts)
+        for key, size in other.section_size.items():
+            self.section_size[key] += size
+        self.status_counts.update(other.status_counts)
+        for key, sketch in other.size_sketches.items():
+            self.size_sketches[key].merge(sketch)
+        self.__update_clients(
+            self.client_counts,
+            {start: c.counts for start, c in other.client_counts.items()}
+        )
+        self.__update_clients(
+            self.client_size,
+            {start: c.counts for start, c in other.client_size.items()}
+        )
+        self.parsed_lines += other.parsed_lines
+        self.malformed_lines += other.malformed_lines
+
+
+class BlockHits:
+    """A class used to reduce the timestamps of a block of lines to what
+    LogAlertConsumer.process_block_hits needs to check the alert window
+    after every line, so that the parent does not go through the lines
+
+    The block is split into segments at each run of lines later than every
+    one before it in the block. Whatever came before, the window ends at
+    that run for the whole segment, so the lines of the block in it are
+    known up front
+
+    Attributes:
+        size (int): Seconds covered by the alert window
+        times (array): Timestamp of each run of lines with the same
+            timestamp, in file order
+        counts (array): Number of lines of each run
+        maxima (array): Index of the run each segment starts with
+        peaks (array): Timestamp of the run each segment starts with
+        bases (array): Lines of the block before each segment that are in
+            the window ending at its peak
+        counted (array): Lines of each segment in the window ending at its
+            peak, from the start of the segment through each run
+        recent (dict): Lines per second of the block in the window ending
+            at the last peak
+    """
+
+    def __init__(self, records, size):
+        """
+        Args:
+            records (list): LogRecord for each parsed line of a block
+            size (int): Seconds covered by the alert window
+        """
+        self.size = size
+        self.times = array('q')
+        self.counts = array('q')
+        self.maxima = array('q')
+        self.peaks = array('q')
+        self.bases = array('q')
+        self.counted = array('q')
+
+        seconds = defaultdict(int)
+        in_window = base = 0
+        peak = None
+        for timestamp, run in groupby(map(GET_TIME, records)):
+            count = sum(1 for _ in run)
+            if peak is None or timestamp > peak:
+                if peak is not None and timestamp - peak >= size:
+                    seconds.clear()
+                    in_window = 0
+                elif peak is not None:
+                    for second in range(peak - size + 1,
+                                        timestamp - size + 1):
+                        in_window -= seconds.pop(second, 0)
+                peak = timestamp
+                base = in_window
+                self.maxima.append(len(self.times))
+                self.peaks.append(peak)
+                self.bases.append(base)
+            if timestamp > peak - size:
+                seconds[timestamp] += count
+                in_window += count
+            self.times.append(timestamp)
+            self.counts.append(count)
+            self.counted.append(in_window - base)
+        self.recent = dict(seconds)
+
+
+class RangeAggregate:
+    """A class used to aggregate a byte range of a log file into what the
+    sequential replay needs from its lines, so that the parent can replay
+    the range exactly the same way without them
+
+    The alert window is checked after every line, so the timestamps of
+    each block are reduced to BlockHits, in file order. A line is
+    counted in the stats interval of the latest timestamp read before it,
+    so the counts are kept per interval of the latest timestamp of the
+    range so far. Once the parent knows the latest timestamp of the ranges
+    before, it merges the counts of any earlier interval into that one
+
+    Attributes:
+        origin (int): Log time the first interval starts at
+        interval (int): Seconds of log time per interval
+        time_window (int): Seconds covered by the alert window
+        blocks (list): BlockHits of each block, the range being read in the
+            same blocks as the sequential replay
+        current (int): Interval of the latest timestamp of the range so far
+        intervals (dict): Interval start to (section_size, section_counts,
+            status_counts, size_sketches, client_counts, client_size) of
+            the lines counted in it, ordered by start
+        history (PartialStats): Per second counts for the history store,
+            None without one
+        parsed_lines (int): Number of lines aggregated
+        malformed_lines (int): Number of lines that could not be parsed
+    """
+
+    def __init__(self, origin, interval, time_window, history=False):
+        """
+        Args:
+            origin (int): Log time the first interval starts at
+            interval (int): Seconds of log time per interval
+            time_window (int): Seconds covered by the alert window
+            history (boolean): Also count hits per second for the history
+                store
+        """
+        self.origin = origin
+        self.interval = interval
+        self.time_window = time_window
+        self.blocks = []
+        self.current = None
+        self.intervals = {}
+        self.history = PartialStats() if history else None
+        self.parsed_lines = 0
+        self.malformed_lines = 0
+
+    def add_block(self, records):
+        """
+        Args:
+            records (list): LogRecord for each parsed line of a block
+        """
+        self.blocks.append(BlockHits(records, self.time_window))
+        if self.history is not None:
+            self.history.add_records(records)
+        if not records:
+            return
+
+        if self.current is not None and \
+                max(map(GET_TIME, records)) < self.current + self.interval:
+            self.__count(records)
+            return
+
+        start = 0
+        for i, record in enumerate(records):
+            if self.current is None or \
+                    record.time >= self.current + self.interval:
+                self.__count(records[start:i])
+                start = i
+                self.current = interval_of(
+                    record.time, self.origin, self.interval
+                )
+        self.__count(records[start:])
+
+    def __count(self, records):
+        """
+        Adds records to the counts of the current interval
+        """
+        if not records:
+            return
+        counts = self.intervals.get(self.current)
+        if counts is None:
+            counts = self.intervals[self.current] = (
+                defaultdict(int), Counter(), Counter(),
+                defaultdict(QuantileSketch), Counter(), Counter()
+            )
+        section_size, section_counts, status_counts, size_sketches, \
+            client_counts, client_size = counts
+
+        section_counts.update(map(GET_SECTION, records))
+        status_counts.update(map(GET_STATUS, records))
+        client_counts.update(map(GET_CLIENT, records))
+        for record in records:
+            section_size[record.section] += record.size
+            client_size[record.client] += record.size
+        for (section, size), count in Counter(
+            map(GET_SECTION_AND_SIZE, records)
+        ).items():
+            size_sketches[section].add(size, count)
+
+
+def interval_of(timestamp, origin, interval):
+    """
+    Returns:
+        int: Start of the stats interval a timestamp falls in. Lines from
+            before the first line go into the first interval
+    """
+    return origin + max(timestamp - origin, 0) // interval * interval
+
+
+def block_boundaries(input_file_path, block_size=1 << 22):
+    """
+    Finds where the blocks of read_blocks end, which is at the last line
+    boundary of each block_size chunk of the file
+
+    Args:
+        input_file_path (str): Path of the log file
+        block_size (int): Number of bytes read_blocks reads at a time
+
+    Returns:
+        list: Byte offset just after each block, the last one being the
+            size of the file
+    """
+    file_size = os.path.getsize(input_file_path)
+    boundaries = []
+    with open(input_file_path, "rb") as log_file:
+        for chunk_start in range(0, file_size, block_size):
+            # Looks for the last newline from the end of the chunk back
+            end = min(chunk_start + block_size, file_size)
+            while end > chunk_start:
+                start = max(end - (1 << 16), chunk_start)
+                log_file.seek(start)
+                newline = log_file.read(end - start).rfind(b'\n')
+                if newline >= 0:
+                    boundaries.append(start + newline + 1)
+                    break
+                end = start
+
+    if not boundaries or boundaries[-1] < file_size:
+        boundaries.append(file_size)
+    return boundaries
+
+
+def split_file(input_file_path, parts, block_size=1 << 22):
+    """
+    Splits a file into byte ranges that start and end on the block
+    boundaries of read_blocks, so that every range is read in the same
+    blocks as the sequential replay reads it in
+
+    Args:
+        input_file_path (str): Path of the log file
+        parts (int): Number of ranges to split into
+        block_size (int): Number of bytes read_blocks reads at a time
+
+    Returns:
+        list: (start, end) byte offsets of each non empty range
+    """
+    boundaries = block_boundaries(input_file_path, block_size)
+    file_size = boundaries[-1]
+    offsets = [0]
+    for part in range(1, parts):
+        offsets.append(
+            boundaries[bisect_left(boundaries, file_size * part // parts)]
+        )
+    offsets.append(file_size)
+
+    return [
+        (start, end) for start, end in zip(offsets, offsets[1:]) if end > start
+    ]
+
+
+def aggregate_range(input_file_path, start, end, origin=None, interval=None,
+                    time_window=None, block_size=1 << 22, history=False):
+    """
+    Parses a byte range of a log file into a RangeAggregate, one block of
+    read_blocks at a time. Used as the task of each worker process
+
+    Args:
+        input_file_path (str): Path of the log file
+        start (int): Offset of the first block of the range
+        end (int): Offset just after the last block of the range
+        origin (int): Log time the first stats interval starts at
+        interval (int): Seconds of log time per stats interval
+        time_window (int): Seconds covered by the alert window
+        block_size (int): Number of bytes read_blocks reads at a time
+        history (boolean): Also count hits per second for the history store
+
+    Returns:
+        RangeAggregate: Aggregates for the range
+    """
+    parser = LogParser()
+    aggregate = RangeAggregate(origin, interval, time_window, history)
+
+    with open(input_file_path, "rb") as log_file:
+        log_file.seek(start)
+        position = start
+        remainder = b''
+        while position < end:
+            # Reads up to the end of the chunk read_blocks would read
+            chunk_end = min((position // block_size + 1) * block_size, end)
+            chunk = log_file.read(chunk_end - position)
+            if not chunk:
+                break
+            position += len(chunk)
+
+            chunk = remainder + chunk
+            cut = chunk.rfind(b'\n') + 1 if position < end else len(chunk)
+            remainder = chunk[cut:]
+            if cut:
+                aggregate.add_block(parser.parse_block(chunk[:cut]))
+
+    aggregate.parsed_lines = parser.parsed_lines
+    aggregate.malformed_lines = parser.malformed_lines
+    return aggregate
+
+
+def _aggregate_task(task):
+    return aggregate_range(*task)
+
+
+def first_log_time(input_file_path):
+    """
+    Returns:
+        int: Timestamp of the first well formed line, None if there is none
+    """
+    parser = LogParser()
+    with open(input_file_path, "r") as log_file:
+        for log_line in log_file:
+            records = parser.parse_block(log_line)
+            if records:
+                return records[0].time
+    return None
+
+
+def replay_log_file_parallel(input_file_path, time_window, threshold,
+                             interval, workers=None, output=sys.stdout,
+                             top_k=None, history=None, block_size=1 << 22):
+    """Replays a whole log file using a pool of worker processes. Each
+    worker reduces each block of a range of the file to its hits
+    (BlockHits) and aggregates the per interval counts, which the parent
+    merges into the consumers in file order, once per block, as soon as
+    the ranges before are done
+
+    The ranges are read in the same blocks as the sequential replay and the
+    alerts and intervals are checked at the same lines, so the timeline is
+    the same even with out of order lines. Only the estimates of top_k and
+    of the client sketches can differ, their counts being merged once per
+    interval instead of once per block
+
+    Args:
+        input_file_path (str): Path of the log file to replay
+        time_window (int): Window of time that will be used for alerting
+        threshold (int): hits/second that on average should stay below
+        interval (int): Seconds of log time per stats interval
+        workers (int): Number of worker processes, defaults to CPU count
+        output (file): Where the timeline is written
+        top_k (int): Number of sections tracked per interval, None to count
+            every section exactly
+        history (HistoryStore): Store to write the rollups and alerts to
+        block_size (int): Number of bytes per block, as in read_blocks
+
+    Returns:
+        tuple: LogAlertConsumer and LogStatsConsumer with the final state
+    """
+    workers = workers or os.cpu_count()
+    alerts = LogAlertConsumer(time_window, threshold, None, use_log_time=True)
+    stats = LogStatsConsumer(interval, None, use_log_time=True, top_k=top_k)
+
+    timeline = ReplayTimeline(output)
+    alerts.add_listener(timeline.on_alert)
+    if history:
+        alerts.add_listener(history.add_alert)
+    stats.add_listener(timeline.on_stats)
+
+    # More ranges than workers so that uneven ranges still balance out
+    origin = first_log_time(input_file_path)
+    tasks = [
+        (input_file_path, start, end, origin, interval, time_window,
+         block_size, history is not None)
+        for start, end in split_file(input_file_path, workers * 4, block_size)
+    ]
+
+    # Counts of the intervals not saved yet, in the order they were counted
+    pending = defaultdict(list)
+    latest = None
+    parsed_lines = malformed_lines = 0
+
+    def save_intervals(before=None):
+        for start in sorted(pending):
+            if before is not None and start >= before:
+                break
+            stats.interval_start = start
+            for counts in pending.pop(start):
+                stats.merge_counts(*counts)
+            stats.save_stats()
+
+    with Pool(workers) as pool:
+        for aggregate in pool.imap(_aggregate_task, tasks):
+            parsed_lines += aggregate.parsed_lines
+            malformed_lines += aggregate.malformed_lines
+            if aggregate.history is not None:
+                history.add_counts(
+                    aggregate.history.section_counts,
+                    aggregate.history.section_size,
+                    aggregate.history.status_counts
+                )
+                history.flush()
+
+            # Lines before the latest timestamp of the ranges before are
+            # counted in its interval
+            floor = (
+                None if latest is None
+                else interval_of(latest, origin, interval)
+            )
+            for start, counts in aggregate.intervals.items():
+                if floor is not None and start < floor:
+                    start = floor
+                pending[start].append(counts)
+
+            for block in aggregate.blocks:
+                alerts.process_block_hits(block)
+                if block.peaks:
+                    if latest is None or block.peaks[-1] > latest:
+                        latest = block.peaks[-1]
+                    save_intervals(interval_of(latest, origin, interval))
+                timeline.flush()
+
+    save_intervals()
+    timeline.flush()
+
+    output.write(
+        f'{parsed_lines:,} lines replayed, '
+        f'{malformed_lines:,} malformed, '
+        f'{alerts.alert_data["alert_count"]} alerts\n'
+    )
+    output.flush()
+
+    return alerts, stats
@@ -0,0 +1,178 @@
+from datetime import datetime
+from http_monitor.compression import open_log_file
+from http_monitor.log_alert_consumer import LogAlertConsumer
+from http_monitor.log_parser import LogParser
+from http_monitor.log_stats_consumer import LogStatsConsumer
+from http_monitor.vectorized import ArrayParser
+import sys
+
+
+def read_blocks(log_file, block_size=1 << 22):
+    """
+    Reads a file in large blocks that always end on a line boundary
+
+    Args:
+        log_file (file): Open log file, text or binary
+        block_size (int): Number of characters or bytes to read at a time
+
+    Yields:
+        str: Block of complete log lines, bytes for a binary file
+    """
+    chunk = log_file.read(block_size)
+    newline = b'\n' if isinstance(chunk, bytes) else '\n'
+    remainder = chunk[:0]
+    while chunk:
+        end = chunk.rfind(newline) + 1
+        if not end:
+            remainder += chunk
+        else:
+            yield remainder + chunk[:end]
+            remainder = chunk[end:]
+        chunk = log_file.read(block_size)
+
+    if remainder:
+        yield remainder
+
+
+class ReplayTimeline:
+    """A class used to print the alert / recover timeline and the stats of
+    every interval while replaying a log file. Events from each block are
+    sorted by log time before printing since the consumers see the block
+    one after another
+
+    Attributes:
+        output (file): Where the timeline is written
+        events (list): Log time and text of events not printed yet
+        top_n (int): Number of top sections to print per interval
+    """
+
+    def __init__(self, output, top_n=2):
+        """
+        Args:
+            output (file): Where the timeline is written
+            top_n (int): Number of top sections to print per interval
+        """
+        self.output = output
+        self.events = []
+        self.top_n = top_n
+
+    def on_alert(self, alert_data):
+        """
+        Listener for alert / recover events from LogAlertConsumer
+        """
+        text = f'{alert_data["msg_line1"]} {alert_data["msg_line2"]}'
+        self.events.append((alert_data['time'], text))
+
+    def on_stats(self, stats_data):
+        """
+        Listener for interval stats from LogStatsConsumer
+        """
+        status_counts = stats_data['status_counts']
+
+        hits = sum(status_counts.values())
+        size = sum(stats_data['section_size'].values())
+        statuses = ', '.join(
+            f'{code}: {count}' for code, count in sorted(status_counts.items())
+        )
+        sections = ', '.join(
+            f'{section} ({count} hits, {section_size:,} bytes)'
+            for section, count, section_size
+            in stats_data['top_sections'][:self.top_n]
+        )
+
+        text = (
+            f'{hits} hits, {size:,} bytes | {statuses} | '
+            f'top sections: {sections}'
+        )
+        self.events.append((stats_data['interval_start'], text))
+
+    def flush(self):
+        """
+        Prints the pending events in log time order
+        """
+        self.events.sort(key=lambda event: event[0])
+        for timestamp, text in self.events:
+            date = datetime.fromtimestamp(timestamp).strftime(
+                '%b-%d-%Y %H:%M:%S'
+            )
+            self.output.write(f'[{date}] {text}\n')
+        self.events = []
+
+
+def replay_log_file(input_file_path, time_window, threshold, interval,
+                    output=sys.stdout, top_k=None, history=None, rules=None,
+                    vectorized=False, block_size=1 << 22):
+    """Replays a whole log file as fast as it can be read, driving the
+    alerting and stats on log time instead of real time. Compressed files
+    are decompressed on the fly and the blocks are parsed as bytes
+
+    With vectorized set, the blocks are parsed into NumPy arrays and the
+    consumers count them a column at a time, which gives the same timeline
+    without any Python work per line
+
+    Args:
+        input_file_path (str): Path of the log file to replay, which may be
+            gzip, bzip2, xz or zstd compressed
+        time_window (int): Window of time that will be used for alerting
+        threshold (int): hits/second that on average should stay below
+        interval (int): Seconds of log time per stats interval
+        output (file): Where the timeline is written
+        top_k (int): Number of sections tracked per interval, None to count
+            every section exactly
+        history (HistoryStore): Store to write the rollups and alerts to
+        rules (list): AlertRule to evaluate on top of the global threshold,
+            not supported when vectorized
+        vectorized (boolean): Parse and count the blocks with NumPy
+        block_size (int): Number of bytes to read at a time
+
+    Returns:
+        tuple: LogAlertConsumer and LogStatsConsumer with the final state
+    """
+    parser = ArrayParser() if vectorized else LogParser()
+    alerts = LogAlertConsumer(
+        time_window, threshold, None, use_log_time=True, rules=rules
+    )
+    stats = LogStatsConsumer(
+        interval, None, use_log_time=True, top_k=top_k, history=history
+    )
+
+    timeline = ReplayTimeline(output)
+    alerts.add_listener(timeline.on_alert)
+    if history:
+        alerts.add_listener(history.add_alert)
+    if alerts.rule_engine:
+        alerts.rule_engine.add_listener(timeline.on_alert)
+        if history:
+            alerts.rule_engine.add_listener(history.add_alert)
+    stats.add_listener(timeline.on_stats)
+
+    with open_log_file(input_file_path) as log_file:
+        for block in read_blocks(log_file, block_size):
+            if vectorized:
+                arrays = parser.parse_block(block)
+                alerts.process_arrays(arrays)
+                stats.process_arrays(arrays)
+            else:
+                records = parser.parse_block(block)
+                alerts.process_records(records)
+                stats.process_records(records)
+            timeline.flush()
+
+    if stats.interval_start is not None:
+        stats.save_stats()
+        timeline.flush()
+    if history:
+        history.flush()
+
+    rule_alerts = (
+        f', {alerts.rule_engine.alert_count} rule alerts'
+        if alerts.rule_engine else ''
+    )
+    output.write(
+        f'{parser.parsed_lines:,} lines replayed, '
+        f'{parser.malformed_lines:,} malformed, '
+        f'{alerts.alert_data["alert_count"]} alerts{rule_alerts}\n'
+    )
+    output.flush()
+
+    return alerts, stats
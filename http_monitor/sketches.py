@@ -0,0 +1,229 @@
+from collections import defaultdict
+from heapq import heappush
+from heapq import heapreplace
+from heapq import nlargest
+from math import ceil
+from math import log
+from operator import itemgetter
+
+
+class SpaceSaving:
+    """A class used to track the heaviest keys of a stream with a fixed
+    amount of memory, using the Space-Saving algorithm. At most capacity
+    keys are kept. A new key replaces the lightest one and inherits its
+    weight, so weights are overestimated by at most the weight of the
+    lightest key, which is itself at most total / capacity
+
+    Attributes:
+        capacity (int): Maximum number of keys tracked
+        counts (dict): Estimated weight of each tracked key
+        errors (dict): Maximum overestimation of each tracked key
+        heap (list): (weight, key) min heap with one entry per key. Entries
+            may be stale since weights only grow, and are refreshed lazily
+        total (int): Total weight added
+    """
+
+    def __init__(self, capacity):
+        """
+        Args:
+            capacity (int): Maximum number of keys tracked
+        """
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.heap = []
+        self.total = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, key):
+        return key in self.counts
+
+    def add(self, key, weight=1):
+        """
+        Args:
+            key (str): Key to add weight to
+            weight (int): Weight to add, eg. 1 hit or the bytes of a response
+        """
+        counts = self.counts
+        self.total += weight
+        if key in counts:
+            counts[key] += weight
+            return
+
+        if len(counts) < self.capacity:
+            counts[key] = weight
+            self.errors[key] = 0
+            heappush(self.heap, (weight, key))
+            return
+
+        # Find the lightest key, refreshing stale entries on the way
+        heap = self.heap
+        while True:
+            stored, victim = heap[0]
+            current = counts[victim]
+            if stored == current:
+                break
+            heapreplace(heap, (current, victim))
+
+        heapreplace(heap, (current + weight, key))
+        del counts[victim]
+        del self.errors[victim]
+        counts[key] = current + weight
+        self.errors[key] = current
+
+    def update(self, weights):
+        """
+        Adds the weights of many keys, eg. a Counter of a whole batch
+
+        Args:
+            weights (dict): Key to weight to add
+        """
+        add = self.add
+        for key, weight in weights.items():
+            add(key, weight)
+
+    def get(self, key, default=None):
+        """
+        Returns:
+            int: Estimated weight of the key, default if it is not tracked
+        """
+        return self.counts.get(key, default)
+
+    def most_common(self, n=None):
+        """
+        Args:
+            n (int): Number of keys to return, all of them if None
+
+        Returns:
+            list: (key, estimated weight) of the heaviest keys, heaviest first
+        """
+        if n is None:
+            n = len(self.counts)
+        # Ties are broken by key so the order does not depend on the order
+        # keys were added in, eg. when merging partials
+        return nlargest(n, self.counts.items(), key=itemgetter(1, 0))
+
+    def max_error(self):
+        """
+        Returns:
+            int: Bound on how much any tracked weight is overestimated
+        """
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+
+class QuantileSketch:
+    """A class used to estimate quantiles of a stream of non negative
+    values, eg. response sizes, with a fixed relative error. Values are
+    counted in logarithmic buckets (as in DDSketch), so any quantile is
+    within relative_accuracy of the true value and the number of buckets
+    only grows with the log of the largest value. Sketches with the same
+    accuracy can be merged, eg. across intervals or worker processes
+
+    Attributes:
+        relative_accuracy (float): Maximum relative error of a quantile
+        gamma (float): Ratio between the bounds of consecutive buckets
+        log_gamma (float): Natural log of gamma
+        buckets (defaultdict): Bucket index to number of values in it
+        zero_count (int): Number of values that were zero
+        count (int): Total number of values added
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        """
+        Args:
+            relative_accuracy (float): Maximum relative error of a quantile
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = log(self.gamma)
+        self.buckets = defaultdict(int)
+        self.zero_count = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value, count=1):
+        """
+        Args:
+            value (int): Value to add, eg. the bytes of a response
+            count (int): Number of times the value was seen
+        """
+        self.count += count
+        if value <= 0:
+            self.zero_count += count
+            return
+        self.buckets[ceil(log(value) / self.log_gamma)] += count
+
+    def update(self, counts):
+        """
+        Adds many values at once, eg. a Counter of the sizes of a batch
+
+        Args:
+            counts (dict): Value to the number of times it was seen
+        """
+        add = self.add
+        for value, count in counts.items():
+            add(value, count)
+
+    def merge(self, other):
+        """
+        Adds all of the values of another sketch with the same accuracy
+
+        Args:
+            other (QuantileSketch): Sketch to merge into this one
+        """
+        if other.gamma != self.gamma:
+            raise ValueError('Cannot merge sketches of different accuracy')
+        for index, count in other.buckets.items():
+            self.buckets[index] += count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantiles(self, qs):
+        """
+        Estimates several quantiles with a single pass over the buckets
+
+        Args:
+            qs (list): Quantiles between 0 and 1 in increasing order,
+                eg. [0.5, 0.95, 0.99]
+
+        Returns:
+            list: Estimated value of each quantile, None if empty
+        """
+        if not self.count:
+            return [None] * len(qs)
+
+        results = []
+        ranks = iter([q * (self.count - 1) for q in qs])
+        rank = next(ranks)
+        seen = self.zero_count
+        while rank is not None and rank < seen:
+            results.append(0)
+            rank = next(ranks, None)
+
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            # Middle of the bucket, which is within the relative accuracy
+            # of every value in the bucket
+            value = 2 * self.gamma ** index / (self.gamma + 1)
+            while rank is not None and rank < seen:
+                results.append(value)
+                rank = next(ranks, None)
+            if rank is None:
+                break
+        return results
+
+    def quantile(self, q):
+        """
+        Args:
+            q (float): Quantile between 0 and 1, eg. 0.99
+
+        Returns:
+            float: Estimated value of the quantile, None if empty
+        """
+        return self.quantiles([q])[0]
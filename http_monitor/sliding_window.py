@@ -0,0 +1,120 @@
+from array import array
+
+
+class SlidingWindowCounter:
+    """A class used to count hits per second over a sliding window of log
+    time. Counts are kept in a ring buffer with one slot per second, so
+    memory only depends on the size of the window and not the traffic
+
+    Attributes:
+        size (int): Number of seconds covered by the window
+        counts (array): Ring buffer of hit counts, slot is second % size
+        latest (int): Most recent second seen, window is (latest-size, latest]
+        total (int): Running total of the hits currently in the window
+    """
+
+    def __init__(self, size):
+        """
+        Args:
+            size (int): Number of seconds covered by the window
+        """
+        self.size = size
+        self.counts = array('q', [0]) * size
+        self.latest = None
+        self.total = 0
+
+    def add(self, timestamp, count=1):
+        """
+        Adds hits for a second, which may be out of order
+
+        Args:
+            timestamp (int): Second the hits happened at
+            count (int): Number of hits to add
+
+        Returns:
+            boolean: False if the second is already out of the window
+        """
+        if self.latest is None or timestamp > self.latest:
+            self.advance(timestamp)
+        elif timestamp <= self.latest - self.size:
+            return False
+
+        self.counts[timestamp % self.size] += count
+        self.total += count
+        return True
+
+    def advance(self, timestamp):
+        """
+        Slides the window forward so that it ends at the given second,
+        clearing the slots of any seconds that fall out of the window
+
+        Args:
+            timestamp (int): Second the window should end at
+        """
+        if self.latest is None:
+            self.latest = timestamp
+            return
+        if timestamp <= self.latest:
+            return
+
+        if timestamp - self.latest >= self.size:
+            self.counts = array('q', [0]) * self.size
+            self.total = 0
+        else:
+            counts, size = self.counts, self.size
+            for second in range(self.latest + 1, timestamp + 1):
+                slot = second % size
+                self.total -= counts[slot]
+                counts[slot] = 0
+
+        self.latest = timestamp
+
+    def average(self):
+        """
+        Returns:
+            float: Average hits / second over the window
+        """
+        return self.total / self.size
+
+    def state(self):
+        """
+        Returns:
+            dict: Compact copy of the window that can be serialized, with
+                only the seconds that have hits
+        """
+        counts, size = self.counts, self.size
+        seconds = (
+            range(self.latest - size + 1, self.latest + 1)
+            if self.latest is not None else ()
+        )
+        return {
+            'size': size,
+            'latest': self.latest,
+            'counts': [
+                [second, counts[second % size]] for second in seconds
+                if counts[second % size]
+            ]
+        }
+
+    def restore(self, state):
+        """
+        Replaces the window with one saved by state
+
+        Args:
+            state (dict): Window returned by state
+
+        Returns:
+            boolean: False if the window was saved with a different size,
+                in which case it is left empty
+        """
+        self.counts = array('q', [0]) * self.size
+        self.total = 0
+        self.latest = None
+        if state['size'] != self.size:
+            return False
+
+        self.latest = state['latest']
+        for second, count in state['counts']:
+            self.counts[second % self.size] += count
+            self.total += count
+        return True
@@ -0,0 +1,630 @@
+from array import array
+from collections import Counter
+from collections import namedtuple
+from http_monitor.log_parser import LOG_LINE_PATTERN
+from http_monitor.log_parser import STRING_CACHE_SIZE
+from http_monitor.sketches import QuantileSketch
+from math import ceil
+from math import log
+from sys import intern
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NEWLINE = ord('\n')
+QUOTE = ord('"')
+COMMA = ord(',')
+SPACE = ord(' ')
+SLASH = ord('/')
+# Longest parts of a line the lines are scanned for, lines with longer ones
+# are matched with the pattern
+METHOD_WIDTH = 16
+SECTION_WIDTH = 64
+TRAILING_BLANKS = 8
+MAX_DIGITS = 18
+# Zero bytes after each block, so that the scan can look past the end of the
+# last line by more than all of the widths above without running off the end
+PADDING = bytes(128)
+# FNV-1 64 bit prime, used to hash the strings being dictionary encoded
+HASH_PRIME = 1099511628211
+ALL_BITS = 0xffffffffffffffff
+
+LogArrays = namedtuple(
+    'LogArrays',
+    ['times', 'statuses', 'sizes', 'sections', 'section_names', 'clients',
+     'client_names']
+)
+LogArrays.__doc__ = """Columns of a block of parsed log lines, in order
+
+Sections and clients are dictionary encoded per block, with codes numbered
+in order of first appearance so that counting them keeps the insertion
+order of the record based path
+
+Attributes:
+    times (ndarray): Timestamp of each line in seconds
+    statuses (ndarray): Status class of each line, eg. 2 for a 2XX
+    sizes (ndarray): Size of each response in bytes
+    sections (ndarray): Code of the section of each line
+    section_names (list): Section of each code, interned
+    clients (ndarray): Code of the client of each line
+    client_names (list): Client of each code, interned
+"""
+
+
+def numpy_available():
+    """
+    Returns:
+        boolean: Whether NumPy is installed, which the vectorized path needs
+    """
+    return np is not None
+
+
+def require_numpy():
+    """
+    Raises:
+        RuntimeError: If NumPy is not installed
+    """
+    if np is None:
+        raise RuntimeError(
+            'numpy must be installed for vectorized replays: pip install numpy'
+        )
+
+
+class ArrayParser:
+    """A class used to parse blocks of log lines in bytes into NumPy arrays
+    instead of a record per line, giving the same lines and fields as
+    LogParser
+
+    Each line is located by its newline and its fields by its eight quotes,
+    and every part of LOG_LINE_PATTERN is checked with array operations
+    over the whole block. Lines that do not have that shape are matched one
+    at a time with the pattern instead, and a block with a quote that is
+    not closed on its line, which the pattern may match across lines, is
+    parsed entirely with the pattern
+
+    Attributes:
+        pattern (Pattern): Compiled pattern matching one line of the log,
+            as in LogParser
+        strings (dict): Byte string to its decoded and interned str
+        parsed_lines (int): Number of lines parsed
+        malformed_lines (int): Number of non empty lines that were skipped
+    """
+
+    def __init__(self):
+        require_numpy()
+        self.pattern = re.compile(LOG_LINE_PATTERN.encode(), re.MULTILINE)
+        self.strings = {}
+        self.parsed_lines = 0
+        self.malformed_lines = 0
+
+    def parse_block(self, block):
+        """
+        Parses a block of log lines
+
+        Args:
+            block (bytes): One or more complete log lines in UTF-8
+
+        Returns:
+            LogArrays: Columns of the well formed lines, in order
+        """
+        if not block.endswith(b'\n'):
+            block += b'\n'
+        arrays = self.__scan(np.frombuffer(block + PADDING, dtype=np.uint8))
+        if arrays is None:
+            arrays = self.__match(block)
+        return arrays
+
+    def __scan(self, text):
+        """
+        Parses the block with array operations
+
+        Returns:
+            LogArrays: Columns of the well formed lines, None when the block
+                has to be matched with the pattern
+        """
+        newlines = np.flatnonzero(text == NEWLINE)
+        starts = np.concatenate(([0], newlines[:-1] + 1))
+        quotes = np.flatnonzero(text == QUOTE)
+        quote_counts = np.diff(quotes.searchsorted(newlines), prepend=0)
+        if (quote_counts % 2).any():
+            return None
+
+        # "client","user_id","authuser",time,"method /section...",status,size
+        lines = np.flatnonzero(quote_counts == 8)
+        first_quotes = np.cumsum(quote_counts) - quote_counts
+        first_quotes = first_quotes[lines]
+        q = [quotes[first_quotes + quote] for quote in range(8)]
+        ends = newlines[lines]
+
+        well_formed = (
+            (q[0] == starts[lines]) & (q[2] == q[1] + 2) &
+            (text[q[1] + 1] == COMMA) & (q[4] == q[3] + 2) &
+            (text[q[3] + 1] == COMMA) & (text[q[5] + 1] == COMMA)
+        )
+
+        # ,time,
+        time_digits, times = _number(text, q[5] + 2, q[6] - 1)
+        well_formed &= time_digits & (text[q[6] - 1] == COMMA)
+
+        # The method runs up to the first whitespace and the section from
+        # the slash after it up to the next slash, space or quote. Either
+        # running past its width leaves the line to the pattern
+        method_end = _find(text, q[6] + 1, _is_whitespace, METHOD_WIDTH)
+        section_end = _find(
+            text, method_end + 2, _is_section_end, SECTION_WIDTH
+        )
+        well_formed &= (
+            (method_end > q[6] + 1) & (method_end < q[7]) &
+            (text[method_end] == SPACE) & (text[method_end + 1] == SLASH) &
+            (section_end <= q[7]) & _is_section_end(text[section_end])
+        )
+
+        # ,status,size then only blanks up to the end of the line
+        status_end, _ = _digits(text, q[7] + 2)
+        size_end, sizes = _digits(text, status_end + 1)
+        blanks_end = _find(
+            text, size_end, lambda found: ~_is_blank(found), TRAILING_BLANKS
+        )
+        well_formed &= (
+            (text[q[7] + 1] == COMMA) & (status_end > q[7] + 2) &
+            (text[status_end] == COMMA) &
+            (size_end > status_end + 1) & (blanks_end == ends)
+        )
+
+        # Lines of any other shape are only skipped if the pattern agrees
+        matched = np.zeros(len(newlines), dtype=bool)
+        matched[lines[well_formed]] = True
+        malformed = 0
+        for line in np.flatnonzero(~matched).tolist():
+            line_text = text[starts[line]:newlines[line]].tobytes()
+            for fields in self.pattern.findall(line_text):
+                if fields[2]:
+                    return None
+                malformed += 1
+
+        q = [quote[well_formed] for quote in q]
+        sections = self.__encode_spans(
+            text, method_end[well_formed] + 2, section_end[well_formed]
+        )
+        clients = self.__encode_spans(text, q[0] + 1, q[1])
+        if sections is None or clients is None:
+            return None
+
+        times = times[well_formed]
+        self.parsed_lines += len(times)
+        self.malformed_lines += malformed
+        return LogArrays(
+            times,
+            text[q[7] + 2].astype(np.int64) - ord('0'),
+            sizes[well_formed],
+            sections[0],
+            sections[1],
+            clients[0],
+            clients[1]
+        )
+
+    def __encode_spans(self, text, starts, ends):
+        """
+        Dictionary encodes the byte strings at the given spans of the block,
+        grouping them by a hash of their bytes and length
+
+        Returns:
+            tuple: Code of each string, numbered in order of first
+                appearance, and the decoded string of each code. None if
+                two different strings have the same hash
+        """
+        lengths = ends - starts
+        if not len(lengths):
+            return np.zeros(0, dtype=np.int64), []
+
+        # Every 8 bytes of the block from any position, as a word
+        words = -(-int(lengths.max()) // 8)
+        if int(starts.max()) + 8 * words > len(text):
+            text = np.concatenate((text, np.zeros(8 * words, np.uint8)))
+        text_words = np.ndarray(
+            (len(text) - 7,), dtype='<u8', buffer=text, strides=(1,)
+        )
+
+        # The strings as words padded with zeros, hashed with their length
+        padded = []
+        hashes = lengths.astype(np.uint64)
+        for word in range(words):
+            kept = np.clip(lengths - 8 * word, 0, 8).astype(np.uint64) * 8
+            padded.append(text_words[starts + 8 * word] & np.where(
+                kept == 64, ALL_BITS, (np.uint64(1) << kept) - np.uint64(1)
+            ))
+            hashes *= HASH_PRIME
+            hashes ^= padded[-1]
+        _, first, inverse = np.unique(
+            hashes, return_index=True, return_inverse=True
+        )
+        inverse = inverse.ravel()
+        if any((word != word[first][inverse]).any() for word in padded) or (
+            lengths != lengths[first][inverse]
+        ).any():
+            return None
+
+        order = np.argsort(first, kind='stable')
+        codes = np.empty(len(first), dtype=np.int64)
+        codes[order] = np.arange(len(first))
+        get = self.strings.get
+        names = []
+        for line in first[order].tolist():
+            value = text[starts[line]:ends[line]].tobytes()
+            names.append(get(value) or self.__decode(value))
+        return codes[inverse], names
+
+    def __match(self, block):
+        """
+        Parses the block with the pattern, as LogParser does
+
+        Returns:
+            LogArrays: Columns of the well formed lines
+        """
+        matches = self.pattern.findall(block)
+        rows = [fields for fields in matches if fields[2]]
+        self.parsed_lines += len(rows)
+        self.malformed_lines += len(matches) - len(rows)
+        if not rows:
+            empty = np.zeros(0, dtype=np.int64)
+            return LogArrays(empty, empty, empty, empty, [], empty, [])
+
+        clients, _, times, _, sections, statuses, sizes = zip(*rows)
+        section_codes, section_names = self.__encode(sections)
+        client_codes, client_names = self.__encode(clients)
+        return LogArrays(
+            np.array([int(time) for time in times], dtype=np.int64),
+            np.array([int(status[:1]) for status in statuses], np.int64),
+            np.array([int(size) for size in sizes], dtype=np.int64),
+            section_codes,
+            section_names,
+            client_codes,
+            client_names
+        )
+
+    def __encode(self, values):
+        """
+        Returns:
+            tuple: Code of each value, numbered in order of first appearance,
+                and the decoded value of each code
+        """
+        codes = {}
+        for value in values:
+            if value not in codes:
+                codes[value] = len(codes)
+        get = self.strings.get
+        return (
+            np.array([codes[value] for value in values], dtype=np.int64),
+            [get(value) or self.__decode(value) for value in codes]
+        )
+
+    def __decode(self, value):
+        """
+        Returns:
+            str: Decoded and interned value, cached for the next blocks
+        """
+        if len(self.strings) >= STRING_CACHE_SIZE:
+            self.strings.clear()
+        string = intern(value.decode('utf-8', errors='replace'))
+        self.strings[value] = string
+        return string
+
+
+def _is_whitespace(found):
+    return (found == SPACE) | (found - ord('\t') < 5)
+
+
+def _is_blank(found):
+    return (found == SPACE) | (found == ord('\t')) | (found == ord('\r'))
+
+
+def _is_section_end(found):
+    return (found == SLASH) | (found == SPACE) | (found == QUOTE)
+
+
+def _find(text, starts, looked_for, limit):
+    """
+    Args:
+        text (ndarray): Bytes of the block
+        starts (ndarray): Position to start looking from in each line
+        looked_for (callable): Whether each of an array of bytes is looked
+            for
+        limit (int): Number of bytes to look at from each start
+
+    Returns:
+        ndarray: First position at or after each start, and less than limit
+            bytes after it, whose byte is looked for. The position limit
+            bytes after the start if there is none
+    """
+    positions = starts + limit
+    searching = np.ones(len(starts), dtype=bool)
+    for offset in range(limit):
+        found = searching & looked_for(text[starts + offset])
+        positions[found] = starts[found] + offset
+        searching &= ~found
+        if not searching.any():
+            break
+    return positions
+
+
+def _number(text, starts, ends):
+    """
+    Reads the digits of each span, which are most often all as long, eg.
+    timestamps, so that they can be read as one matrix
+
+    Returns:
+        tuple: Whether each span is from 1 to MAX_DIGITS digits, and the
+            value of the digits
+    """
+    lengths = ends - starts
+    if not len(lengths) or lengths.min() != lengths.max() or not (
+        0 < lengths[0] <= MAX_DIGITS
+    ):
+        digits_end, values = _digits(text, starts)
+        return (digits_end == ends) & (lengths > 0), values
+
+    digits = np.lib.stride_tricks.sliding_window_view(
+        text, int(lengths[0])
+    )[starts] - ord('0')
+    powers = 10 ** np.arange(int(lengths[0]) - 1, -1, -1, dtype=np.int64)
+    return (digits < 10).all(axis=1), digits.astype(np.int64) @ powers
+
+
+def _digits(text, starts):
+    """
+    Reads the digits from each start up to the first byte that is not one
+
+    Returns:
+        tuple: Position of the first byte that is not a digit at or after
+            each start, and the value of the digits. Runs of more than
+            MAX_DIGITS digits end early, so that the values fit in 64 bits
+    """
+    ends = starts.copy()
+    values = np.zeros(len(starts), dtype=np.int64)
+    reading = np.ones(len(starts), dtype=bool)
+    for offset in range(MAX_DIGITS):
+        digits = text[starts + offset] - ord('0')
+        reading &= digits < 10
+        if not reading.any():
+            break
+        values = np.where(reading, values * 10 + digits, values)
+        ends += reading
+    return ends, values
+
+
+def _appearance_order(codes, ordered):
+    """
+    Args:
+        codes (ndarray): Codes of a range of lines
+        ordered (boolean): Whether the codes are numbered in order of first
+            appearance in the range, as when it starts at the first line
+
+    Returns:
+        ndarray: Distinct codes in order of first appearance
+    """
+    if ordered:
+        return np.flatnonzero(np.bincount(codes))
+    uniques, first = np.unique(codes, return_index=True)
+    return uniques[np.argsort(first, kind='stable')]
+
+
+def _totals(codes, names, order, weights=None):
+    """
+    Returns:
+        dict: Name of each code to its count, or the sum of its weights, in
+            the order given
+    """
+    totals = np.bincount(codes, weights=weights, minlength=len(names))
+    return {
+        names[code]: int(total)
+        for code, total in zip(order.tolist(), totals[order].tolist())
+    }
+
+
+def _size_buckets(sizes):
+    """
+    Returns:
+        ndarray: Index of the QuantileSketch bucket of each size, the same
+            as QuantileSketch.add picks. Sizes of 0 get the lowest index
+            less one
+    """
+    log_gamma = QuantileSketch().log_gamma
+    scaled = np.log(np.maximum(sizes, 1)) / log_gamma
+    buckets = np.ceil(scaled).astype(np.int64)
+
+    # NumPy and math may round a log differently, so sizes right at the
+    # edge of a bucket are put in one with math.log
+    edges = np.flatnonzero(
+        (np.abs(scaled - np.rint(scaled)) < 1e-9) & (sizes > 0)
+    )
+    for edge, size in zip(edges.tolist(), sizes[edges].tolist()):
+        buckets[edge] = ceil(log(size) / log_gamma)
+
+    buckets[sizes <= 0] = buckets.min() - 1 if len(buckets) else 0
+    return buckets
+
+
+def _size_sketches(sections, section_names, sizes, order):
+    """
+    Returns:
+        dict: Section to a QuantileSketch of its response sizes, in the
+            order given
+    """
+    sketches = {section_names[code]: QuantileSketch() for code in order}
+    if not len(sizes):
+        return sketches
+
+    buckets = _size_buckets(sizes)
+    lowest = int(buckets.min())
+    width = int(buckets.max()) - lowest + 1
+    keys = sections * width + (buckets - lowest)
+    if len(section_names) * width <= 4 * len(keys):
+        counts = np.bincount(keys)
+        keys = np.flatnonzero(counts)
+        counts = counts[keys]
+    else:
+        keys, counts = np.unique(keys, return_counts=True)
+
+    zero = lowest if (sizes <= 0).any() else None
+    for key, count in zip(keys.tolist(), counts.tolist()):
+        sketch = sketches[section_names[key // width]]
+        bucket = key % width + lowest
+        sketch.count += count
+        if bucket == zero:
+            sketch.zero_count += count
+        else:
+            sketch.buckets[bucket] += count
+    return sketches
+
+
+def interval_counts(arrays, start=0, end=None):
+    """
+    Counts a range of lines the way LogStatsConsumer counts records
+
+    Args:
+        arrays (LogArrays): Columns of a block of lines
+        start (int): Index of the first line to count
+        end (int): Index just after the last line to count, None for all
+
+    Returns:
+        tuple: (section_size, section_counts, status_counts, size_sketches,
+            client_counts, client_size) as taken by
+            LogStatsConsumer.merge_counts
+    """
+    window = slice(start, end)
+    sections = arrays.sections[window]
+    clients = arrays.clients[window]
+    sizes = arrays.sizes[window]
+    section_names = arrays.section_names
+    client_names = arrays.client_names
+
+    statuses = arrays.statuses[window]
+    section_order = _appearance_order(sections, start == 0)
+    client_order = _appearance_order(clients, start == 0)
+    status_order = _appearance_order(statuses, False)
+
+    status_names = [f'{status}XX' for status in range(10)]
+    return (
+        _totals(sections, section_names, section_order, sizes),
+        Counter(_totals(sections, section_names, section_order)),
+        Counter(_totals(statuses, status_names, status_order)),
+        _size_sketches(sections, section_names, sizes, section_order),
+        _totals(clients, client_names, client_order),
+        _totals(clients, client_names, client_order, sizes)
+    )
+
+
+def second_counts(arrays, start=0, end=None):
+    """
+    Counts a range of lines per second, the way HistoryStore.add_records
+    does
+
+    Args:
+        arrays (LogArrays): Columns of a block of lines
+        start (int): Index of the first line to count
+        end (int): Index just after the last line to count, None for all
+
+    Returns:
+        tuple: (section_counts, section_size, status_counts) as taken by
+            HistoryStore.add_counts
+    """
+    window = slice(start, end)
+    times = arrays.times[window]
+    if not len(times):
+        return Counter(), {}, Counter()
+
+    earliest = int(times.min())
+    seconds = times - earliest
+    sections = len(arrays.section_names)
+
+    keys, inverse, counts = np.unique(
+        seconds * sections + arrays.sections[window],
+        return_inverse=True, return_counts=True
+    )
+    sizes = np.bincount(inverse.ravel(), weights=arrays.sizes[window])
+    section_counts = Counter()
+    section_size = {}
+    for key, count, size in zip(
+        keys.tolist(), counts.tolist(), sizes.tolist()
+    ):
+        second = (earliest + key // sections, arrays.section_names[
+            key % sections
+        ])
+        section_counts[second] = count
+        section_size[second] = int(size)
+
+    keys, counts = np.unique(
+        seconds * 10 + arrays.statuses[window], return_counts=True
+    )
+    status_counts = Counter({
+        (earliest + key // 10, f'{key % 10}XX'): count
+        for key, count in zip(keys.tolist(), counts.tolist())
+    })
+    return section_counts, section_size, status_counts
+
+
+def latest_times(times):
+    """
+    Returns:
+        ndarray: Latest timestamp seen once each line has been read
+    """
+    return np.maximum.accumulate(times)
+
+
+def window_totals(window, times):
+    """
+    Adds the hits of many lines to a SlidingWindowCounter at once, giving
+    the same window as adding them one by one with SlidingWindowCounter.add
+
+    A line is only counted when it is within the window ending at the
+    latest second seen so far. Lines counted later can never be older than
+    the start of any earlier window, so the total of the window after each
+    line is the running count of counted lines, less the counted lines
+    older than the start of that window, found with a binary search
+
+    Args:
+        window (SlidingWindowCounter): Window to add the lines to
+        times (ndarray): Timestamp of each line, in the order they are read
+
+    Returns:
+        ndarray: Total of the window just after each line was added
+    """
+    size = window.size
+    latest = latest_times(times)
+    held_seconds = np.zeros(0, dtype=np.int64)
+    held_counts = np.zeros(0, dtype=np.int64)
+    if window.latest is not None:
+        latest = np.maximum(latest, window.latest)
+        held_seconds = np.arange(window.latest - size + 1, window.latest + 1)
+        held_counts = np.frombuffer(window.counts, dtype=np.int64)[
+            held_seconds % size
+        ]
+
+    window_starts = latest - size
+    counted = times > window_starts
+    running = window.total + np.cumsum(counted)
+
+    seconds = np.concatenate((held_seconds, times[counted]))
+    counts = np.concatenate(
+        (held_counts, np.ones(len(seconds) - len(held_seconds), np.int64))
+    )
+    order = np.argsort(seconds, kind='stable')
+    seconds = seconds[order]
+    dropped = np.concatenate(([0], np.cumsum(counts[order])))
+    totals = running - dropped[
+        np.searchsorted(seconds, window_starts, side='right')
+    ]
+
+    # The window ends up holding the counted lines of its last position
+    in_window = seconds > window_starts[-1]
+    slots = np.bincount(
+        seconds[in_window] % size, weights=counts[order][in_window],
+        minlength=size
+    )
+    window.counts = array('q', slots.astype(np.int64).tobytes())
+    window.latest = int(latest[-1])
+    window.total = int(totals[-1])
+    return totals
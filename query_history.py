@@ -0,0 +1,103 @@
+from datetime import datetime
+from http_monitor.history import HistoryStore
+from http_monitor.history import RESOLUTIONS
+import argparse
+import os
+import re
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_duration(text):
+    """
+    Args:
+        text (str): Duration such as 90s, 30m, 24h or 7d
+
+    Returns:
+        int: Duration in seconds
+    """
+    match = re.fullmatch(r'(\d+)([smhd]?)', text)
+    if not match:
+        raise argparse.ArgumentTypeError(f'invalid duration: {text}')
+    return int(match.group(1)) * DURATION_UNITS[match.group(2) or 's']
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%b-%d-%Y %H:%M:%S')
+
+
+def query_history(history_path, last, resolution='minute', section=None,
+                  top=None, statuses=False, alerts=False):
+    """Prints the history kept by the monitor. The time range ends at the
+    latest log time stored, so replayed logs can be queried the same way
+
+    Args:
+        history_path (str): Path of the SQLite history file
+        last (int): Seconds of history to print
+        resolution (str): second, minute or hour
+        section (str): Section to print hits for, None for every section
+        top (int): Print the top sections instead of hits per bucket
+        statuses (boolean): Print hits per status class instead
+        alerts (boolean): Print alerts and recoveries instead
+    """
+    history = HistoryStore(history_path)
+    latest = history.latest_time()
+    if latest is None:
+        print('No history stored')
+        return
+
+    until = latest + 1
+    since = until - last
+    seconds = RESOLUTIONS[resolution]
+
+    if top:
+        rows = history.top_sections(top, seconds, since, until)
+        for section_name, hits, size in rows:
+            print(f'{section_name:<20} {hits:>12,} hits {size:>16,} bytes')
+    elif statuses:
+        for status, hits in history.status_counts(
+                seconds, since, until).items():
+            print(f'{status}: {hits:,}')
+    elif alerts:
+        for timestamp, _, message in history.alerts(since, until):
+            print(f'[{format_time(timestamp)}] {message}')
+    else:
+        for start, hits, size in history.hits(section, seconds, since, until):
+            print(
+                f'{format_time(start)} {hits:>12,} hits {size:>16,} bytes'
+            )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query monitor history")
+    parser.version = '1.0'
+
+    parser.add_argument('HISTORY_FILE', type=str,
+                        help="SQLite file written with --history")
+    parser.add_argument('--last', action='store', type=parse_duration,
+                        default='24h',
+                        help='How far back to go from the latest log time, '
+                        'eg. 90s, 30m, 24h or 7d. Default is 24h.')
+    parser.add_argument('--resolution', action='store',
+                        choices=list(RESOLUTIONS), default='minute',
+                        help='Size of each bucket. Default is minute.')
+    parser.add_argument('--section', action='store', type=str,
+                        help='Only print hits for this section, eg. api')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--top', action='store', type=int,
+                       help='Print the top sections by hits instead.')
+    group.add_argument('--statuses', action='store_true',
+                       help='Print hits per status class instead.')
+    group.add_argument('--alerts', action='store_true',
+                       help='Print alerts and recoveries instead.')
+    parser.add_argument('--version', action='version')
+
+    args = parser.parse_args()
+    if not os.path.exists(args.HISTORY_FILE):
+        parser.error(f'{args.HISTORY_FILE} does not exist')
+
+    query_history(
+        args.HISTORY_FILE, args.last, args.resolution,
+        args.section.strip('/') if args.section else None,
+        args.top, args.statuses, args.alerts
+    )
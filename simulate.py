@@ -1,37 +1,238 @@
-from random import random
+from itertools import accumulate
 import argparse
+import random
+import re
 import time
 
+START_TIME_PATTERN = re.compile(r'^("[^"]*","[^"]*","[^"]*",)(\d+)(,.*)$')
+METHODS = ['GET', 'GET', 'GET', 'POST', 'PUT', 'DELETE']
+STATUSES = ['200'] * 16 + ['301', '404', '404', '500']
 
-def simulate(input_file, output_file):
-    """Starts up all of the services via threads
+# Number of times per second the lines generated so far are written
+TICKS_PER_SECOND = 10
+
+
+class LoadProfile:
+    """A class used to work out how many lines to write in each second of
+    a simulation: a steady rate, plus optional bursts and steps
+
+    Attributes:
+        rate (int): Lines per second outside of bursts
+        burst_rate (int): Lines per second during a burst
+        burst_length (int): Seconds each burst lasts
+        burst_every (int): Seconds from the start of one burst to the next,
+            0 for no bursts
+        step (int): Lines per second added to the rate every step_every
+        step_every (int): Seconds between steps, 0 for no steps
+    """
+
+    def __init__(self, rate, burst_rate=0, burst_length=0, burst_every=0,
+                 step=0, step_every=0):
+        self.rate = rate
+        self.burst_rate = burst_rate
+        self.burst_length = burst_length
+        self.burst_every = burst_every
+        self.step = step
+        self.step_every = step_every
+
+    def lines(self, second):
+        """
+        Args:
+            second (int): Seconds since the simulation started
+
+        Returns:
+            int: Number of lines to write in that second
+        """
+        if self.burst_every and second % self.burst_every < self.burst_length:
+            return self.burst_rate
+        if self.step_every:
+            return self.rate + self.step * (second // self.step_every)
+        return self.rate
+
+
+def synthetic_pool(size, sections=10, skew=0, seed=0):
+    """
+    Generates lines without their timestamp, with sections hit with a Zipf
+    like distribution so a few sections get most of the traffic
 
     Args:
-        input_file_path (str): Path of file that has log data
-        output_file (int): Path of file that will have logs written to
+        size (int): Number of lines in the pool
+        sections (int): Number of distinct sections
+        skew (int): Maximum number of seconds a line is late
+        seed (int): Seed so that runs are reproducible
+
+    Returns:
+        list: (before timestamp, seconds late, after timestamp) of each line
     """
-    try:
-        with open(input_file, "r") as log_lines:
-            with open(output_file, 'w', buffering=1) as log_file:
-                for log_line in log_lines:
-                    if log_line:
-                        log_file.write(log_line)
-                    time.sleep(random())
-    except IOError:
-        raise "Unable to open log files"
-    except KeyboardInterrupt:
-        print("\nSimulation interrupted")
-        with open(output_file, 'w') as log_file:
-            log_file.truncate(0)
+    rng = random.Random(seed)
+    names = [f'section{i}' for i in range(sections)]
+    cum_weights = list(accumulate(1 / (i + 1) for i in range(sections)))
+    clients = [f'10.0.{i // 256}.{i % 256}' for i in range(1000)]
+
+    return [
+        (
+            f'"{rng.choice(clients)}","-","apache",',
+            rng.randint(0, skew),
+            f',"{rng.choice(METHODS)} /{section}/{rng.randint(0, 99)} '
+            f'HTTP/1.0",{rng.choice(STATUSES)},{rng.randint(100, 5000)}\n'
+        )
+        for section in rng.choices(names, cum_weights=cum_weights, k=size)
+    ]
+
+
+def replay_pool(input_file, skew=0, seed=0):
+    """
+    Takes the lines of a log file such as sample_csv.txt to be written again
+    with new timestamps. Lines that were out of order in the file stay as
+    late as they were, and up to skew more seconds of lateness is added
+
+    Args:
+        input_file (str): Path of the log file to replay
+        skew (int): Maximum number of seconds of lateness added to a line
+        seed (int): Seed so that runs are reproducible
+
+    Returns:
+        list: (before timestamp, seconds late, after timestamp) of each line
+    """
+    rng = random.Random(seed)
+    pool = []
+    latest = None
+    with open(input_file, "r") as log_lines:
+        for log_line in log_lines:
+            match = START_TIME_PATTERN.match(log_line.rstrip('\n'))
+            if not match:
+                continue
+            timestamp = int(match.group(2))
+            latest = timestamp if latest is None else max(latest, timestamp)
+            late = latest - timestamp + (rng.randint(0, skew) if skew else 0)
+            pool.append((match.group(1), late, match.group(3) + '\n'))
+
+    if not pool:
+        raise ValueError(f'No log lines in {input_file}')
+    return pool
+
+
+def simulate(pool, output_file, profile, duration=None, start_time=None):
+    """Writes lines from the pool to the output file at the rates of the
+    profile. Lines are written in one buffered write TICKS_PER_SECOND times
+    a second, and the lines of each second all have the timestamp of that
+    second, less how late each line is. Given the same pool, profile and
+    start time the output is always the same, and when the writes keep up
+    the timestamps are the wall clock
+
+    Args:
+        pool (list): Lines to cycle through, from synthetic_pool or
+            replay_pool
+        output_file (str): Path of the log file to write to
+        profile (LoadProfile): Lines to write each second
+        duration (int): Seconds to run for, None to run until interrupted
+        start_time (int): Timestamp of the first second, defaults to now
+
+    Returns:
+        tuple: Number of lines written and seconds taken
+    """
+    if start_time is None:
+        start_time = int(time.time())
+    max_late = max(late for _, late, _ in pool)
+    position = 0
+    written = 0
+    second = 0
+    started = time.monotonic()
+
+    with open(output_file, 'w', buffering=1 << 20) as log_file:
+        try:
+            while duration is None or second < duration:
+                lines = profile.lines(second)
+                timestamp = start_time + second
+                stamps = [str(timestamp - late)
+                          for late in range(max_late + 1)]
+
+                for tick in range(TICKS_PER_SECOND):
+                    count = (
+                        lines * (tick + 1) // TICKS_PER_SECOND -
+                        lines * tick // TICKS_PER_SECOND
+                    )
+                    batch = []
+                    while len(batch) < count:
+                        end = min(len(pool), position + count - len(batch))
+                        batch += pool[position:end]
+                        position = end % len(pool)
+
+                    log_file.write(''.join([
+                        before + stamps[late] + after
+                        for before, late, after in batch
+                    ]))
+                    log_file.flush()
+                    written += count
+
+                    # Falling behind catches up by not sleeping
+                    delay = (
+                        started + second + (tick + 1) / TICKS_PER_SECOND -
+                        time.monotonic()
+                    )
+                    if delay > 0:
+                        time.sleep(delay)
+                second += 1
+        except KeyboardInterrupt:
+            print("\nSimulation interrupted")
+
+    return written, time.monotonic() - started
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Simulate logging")
     parser.version = '1.0'
 
-    parser.add_argument('DATA_FILE_PATH', type=str, help="path to data file")
+    parser.add_argument('DATA_FILE_PATH', type=str, nargs='?',
+                        help="path to data file to replay with new "
+                        "timestamps, synthetic lines are written without it")
     parser.add_argument('LOG_FILE', type=str, help="path to log file")
+    parser.add_argument('--rate', type=int, default=10,
+                        help='Lines per second. Default is 10.')
+    parser.add_argument('--duration', type=int,
+                        help='Seconds to run for. Default is until Ctrl-C.')
+    parser.add_argument('--burst_rate', type=int, default=0,
+                        help='Lines per second during bursts.')
+    parser.add_argument('--burst_length', type=int, default=10,
+                        help='Seconds each burst lasts. Default is 10.')
+    parser.add_argument('--burst_every', type=int, default=0,
+                        help='Seconds from one burst to the next.')
+    parser.add_argument('--step', type=int, default=0,
+                        help='Lines per second added every --step_every.')
+    parser.add_argument('--step_every', type=int, default=60,
+                        help='Seconds between steps. Default is 60.')
+    parser.add_argument('--sections', type=int, default=10,
+                        help='Number of distinct sections of synthetic '
+                        'lines. Default is 10.')
+    parser.add_argument('--skew', type=int, default=0,
+                        help='Maximum seconds a line is out of order.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the generated lines. Default is 0.')
+    parser.add_argument('--start_time', type=int,
+                        help='Timestamp of the first second, so that runs '
+                        'are identical. Default is now.')
 
     args = parser.parse_args()
 
-    simulate(args.DATA_FILE_PATH, args.LOG_FILE)
+    if args.DATA_FILE_PATH:
+        pool = replay_pool(args.DATA_FILE_PATH, args.skew, args.seed)
+    else:
+        pool = synthetic_pool(
+            max(65536, 2 * args.sections), args.sections, args.skew,
+            args.seed
+        )
+    profile = LoadProfile(
+        args.rate, args.burst_rate, args.burst_length if args.burst_rate
+        else 0, args.burst_every if args.burst_rate else 0,
+        args.step, args.step_every if args.step else 0
+    )
+
+    written, elapsed = simulate(
+        pool, args.LOG_FILE, profile, args.duration, args.start_time
+    )
+    print(f'{written:,} lines in {elapsed:.1f}s, '
+          f'{written / max(elapsed, 1e-9):,.0f} lines/s')
+    # Runs without a duration end with Ctrl-C and clean up after themselves
+    if args.duration is None:
+        with open(args.LOG_FILE, 'w') as log_file:
+            log_file.truncate(0)
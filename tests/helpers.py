@@ -0,0 +1,19 @@
+from http_monitor.log_record import LogRecord
+
+
+def record(timestamp, section='api', status='200', size=100,
+           client='10.0.0.2'):
+    return LogRecord(client, 'apache', timestamp, 'GET', section, status,
+                     size)
+
+
+def log_line(timestamp, section='api', status=200, client='10.0.0.2',
+             size=100):
+    return (
+        f'"{client}","-","apache",{timestamp},"GET /{section}/user '
+        f'HTTP/1.0",{status},{size}\n'
+    )
+
+
+def log_bytes(*args, **kwargs):
+    return log_line(*args, **kwargs).encode()
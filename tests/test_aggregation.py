@@ -0,0 +1,274 @@
+from http_monitor.aggregation import AggregateShipper
+from http_monitor.aggregation import Aggregator
+from http_monitor.aggregation import FRAME_HEADER
+from http_monitor.aggregation import Frame
+from http_monitor.aggregation import SecondStats
+from http_monitor.aggregation import decode_frame
+from http_monitor.aggregation import encode_frame
+from http_monitor.aggregation import parse_address
+from http_monitor.aggregation import read_frame
+from http_monitor.batch_queue import BatchQueue
+from http_monitor.log_alert_consumer import LogAlertConsumer
+from http_monitor.log_parser import LogParser
+from http_monitor.log_stats_consumer import LogStatsConsumer
+from http_monitor.parallel import PartialStats
+from multiprocessing import Barrier
+from multiprocessing import Process
+import io
+import random
+import time
+import unittest
+
+START = 1549573860
+
+
+def log_lines(node, seconds=120, burst=range(60, 90)):
+    """
+    Lines of one node, 3 hits/sec and 8 during the burst, so that only
+    the hits of all of the nodes together are over a threshold of 10
+    """
+    rand = random.Random(node)
+    lines = []
+    for t in range(seconds):
+        for _ in range(8 if t in burst else 3):
+            section = rand.choice(['api', 'report', 'help'])
+            lines.append(
+                f'"10.0.{node}.{rand.randint(1, 5)}","-","apache",'
+                f'{START + t},"GET /{section}/x HTTP/1.0",'
+                f'{rand.choice([200, 404, 500])},{rand.randint(0, 5000)}\n'
+            )
+    return ''.join(lines)
+
+
+def ship_node(address, node, barrier, block_size=50):
+    """
+    Ships the lines of a node to the aggregator, run in its own process.
+    Every node connects before any of them ships lines and stays connected
+    until they all have, so the seconds are only released once complete
+    """
+    records = LogParser().parse_block(log_lines(node))
+    shipper = AggregateShipper(address, f'node{node}', BatchQueue())
+    shipper.ship()
+    barrier.wait(10)
+    for start in range(0, len(records), block_size):
+        shipper.process_records(records[start:start + block_size])
+        shipper.ship()
+    shipper.flush(10)
+    barrier.wait(10)
+    shipper.close()
+
+
+def consumers(time_window=20, threshold=10, interval=10):
+    return (
+        LogAlertConsumer(time_window, threshold, None, use_log_time=True),
+        LogStatsConsumer(interval, None, use_log_time=True)
+    )
+
+
+def frame(node, latest, hits):
+    """
+    Frame with the given hits per second
+    """
+    seconds = {}
+    for timestamp, count in hits.items():
+        counts = SecondStats()
+        counts.hits = count
+        counts.section_counts['api'] = count
+        seconds[timestamp] = counts
+    return Frame(node, latest, sum(hits.values()), seconds)
+
+
+class TestFrames(unittest.TestCase):
+
+    def test_round_trip(self):
+        records = LogParser().parse_block(log_lines(1, 5))
+        partial = PartialStats(0, 1)
+        partial.add_records(records)
+
+        data = encode_frame('web1', partial, START + 4)
+        decoded = read_frame(io.BytesIO(data))
+
+        self.assertEqual(decoded.node, 'web1')
+        self.assertEqual(decoded.latest, START + 4)
+        self.assertEqual(decoded.lines, len(records))
+        self.assertEqual(sorted(decoded.seconds),
+                         list(range(START, START + 5)))
+        # Much smaller than the lines themselves
+        self.assertLess(len(data), len(log_lines(1, 5)) / 2)
+
+        second = decoded.seconds[START]
+        self.assertEqual(second.hits, partial.hits[START])
+        for (timestamp, section), count in partial.section_counts.items():
+            counts = decoded.seconds[timestamp]
+            self.assertEqual(counts.section_counts[section], count)
+            self.assertEqual(counts.section_size[section],
+                             partial.section_size[(timestamp, section)])
+            sketch = partial.size_sketches[(timestamp, section)]
+            self.assertEqual(dict(counts.size_sketches[section].buckets),
+                             dict(sketch.buckets))
+            self.assertEqual(counts.size_sketches[section].count,
+                             sketch.count)
+        self.assertEqual(
+            sum(second.status_counts.values()), partial.hits[START]
+        )
+        self.assertEqual(
+            second.client_counts,
+            dict(partial.client_counts[START].counts)
+        )
+
+    def test_heartbeat(self):
+        data = encode_frame('web1', PartialStats(0, 1), None)
+        decoded = read_frame(io.BytesIO(data))
+
+        self.assertEqual(decoded, Frame('web1', None, 0, {}))
+
+    def test_invalid_frames(self):
+        data = encode_frame('web1', PartialStats(0, 1), None)
+
+        self.assertIsNone(read_frame(io.BytesIO(b'')))
+        with self.assertRaises(ValueError):
+            read_frame(io.BytesIO(b'GET / HTTP/1.1\r\n\r\n'))
+        with self.assertRaises(ValueError):
+            read_frame(io.BytesIO(data[:-1]))
+        with self.assertRaises(ValueError):
+            decode_frame(data[FRAME_HEADER.size:][::-1])
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address('tcp://127.0.0.1:9000')[1],
+                         ('127.0.0.1', 9000))
+        self.assertEqual(parse_address('unix:///tmp/agg.sock')[1],
+                         '/tmp/agg.sock')
+        with self.assertRaises(ValueError):
+            parse_address('127.0.0.1:9000')
+
+
+class TestAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.alerts, self.stats = consumers()
+        self.aggregator = Aggregator(
+            'tcp://127.0.0.1:0', self.alerts, self.stats, max_lag=5
+        )
+
+    def tearDown(self):
+        self.aggregator.close()
+
+    def test_waits_for_every_node(self):
+        aggregator = self.aggregator
+        aggregator.add_frame(
+            frame('a', START + 2, {START: 3, START + 2: 1})
+        )
+        aggregator.add_frame(frame('b', START, {START: 2}))
+
+        # Node b has only shipped up to START
+        self.assertEqual(aggregator.release(), 1)
+        self.assertEqual(self.alerts.alert_window.total, 5)
+
+        aggregator.add_frame(frame('b', START + 3, {START + 2: 4}))
+        self.assertEqual(aggregator.release(), 1)
+        self.assertEqual(self.alerts.alert_window.total, 10)
+        self.assertEqual(aggregator.released, START + 2)
+
+    def test_lag_is_bounded(self):
+        aggregator = self.aggregator
+        aggregator.add_frame(frame('slow', START, {START: 1}))
+        aggregator.add_frame(frame('fast', START + 3, {START + 1: 1}))
+        self.assertEqual(aggregator.release(), 1)
+
+        # The slow node holds back the rest for at most max_lag seconds
+        aggregator.add_frame(frame('fast', START + 6, {START + 6: 1}))
+        self.assertEqual(aggregator.release(), 1)
+        self.assertEqual(aggregator.released, START + 1)
+
+        aggregator.max_lag = 0
+        self.assertEqual(aggregator.release(), 1)
+        self.assertEqual(aggregator.released, START + 6)
+
+    def test_late_seconds_are_still_counted(self):
+        aggregator = self.aggregator
+        aggregator.add_frame(frame('a', START + 5, {START + 5: 2}))
+        aggregator.release()
+        aggregator.add_frame(frame('a', START + 5, {START + 4: 3}))
+        aggregator.release(flush=True)
+
+        self.assertEqual(self.alerts.alert_window.total, 5)
+        self.assertEqual(self.stats.total_hits, 5)
+
+
+class TestDistributedAggregation(unittest.TestCase):
+
+    def test_alerts_on_hits_of_every_node(self):
+        nodes = 3
+        alerts, stats = consumers()
+        timeline = []
+        alerts.add_listener(lambda data: timeline.append(data['type']))
+        aggregator = Aggregator('tcp://127.0.0.1:0', alerts, stats, 3600)
+        aggregator.start()
+
+        barrier = Barrier(nodes)
+        processes = [
+            Process(target=ship_node,
+                    args=(aggregator.address, node, barrier))
+            for node in range(nodes)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(30)
+            self.assertEqual(process.exitcode, 0)
+
+        lines = sum(len(log_lines(node).splitlines())
+                    for node in range(nodes))
+        deadline = time.monotonic() + 10
+        while (aggregator.lines_received < lines and
+               time.monotonic() < deadline):
+            time.sleep(0.05)
+        aggregator.thread_terminated = True
+        aggregator.join()
+
+        self.assertEqual(aggregator.lines_received, lines)
+        self.assertEqual(stats.total_hits, lines)
+        # 9 hits/sec from the nodes together, then 24 during the bursts
+        self.assertEqual(timeline, ['alert', 'recovered'])
+
+        # A single node never goes over the threshold
+        alone, _ = consumers()
+        for record in LogParser().parse_block(log_lines(0)):
+            alone.process_records([record])
+        self.assertEqual(alone.alert_data['alert_count'], 0)
+
+    def test_shipper_keeps_frames_until_connected(self):
+        alerts, stats = consumers()
+        aggregator = Aggregator('tcp://127.0.0.1:0', alerts, stats, 0)
+        address = aggregator.address
+        aggregator.close()
+
+        shipper = AggregateShipper(address, 'web1', BatchQueue())
+        shipper.process_records(LogParser().parse_block(log_lines(1, 3)))
+        self.assertFalse(shipper.ship())
+        self.assertEqual(len(shipper.unsent), 1)
+        self.assertGreater(shipper.backoff, 0)
+
+        alerts, stats = consumers()
+        aggregator = Aggregator(address, alerts, stats, 0)
+        aggregator.start()
+        try:
+            # Not tried again until the backoff has passed
+            self.assertFalse(shipper.ship())
+            self.assertEqual(len(shipper.unsent), 2)
+            time.sleep(max(shipper.retry_at - time.monotonic(), 0))
+            self.assertTrue(shipper.flush())
+            shipper.close()
+            self.assertEqual(shipper.frames_sent, 2)
+            self.assertEqual(shipper.backoff, 0)
+            deadline = time.monotonic() + 10
+            while stats.total_hits < 9 and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            aggregator.thread_terminated = True
+            aggregator.join()
+        self.assertEqual(stats.total_hits, 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
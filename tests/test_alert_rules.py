@@ -0,0 +1,109 @@
+from http_monitor.alert_rules import AlertRule
+from http_monitor.alert_rules import RuleEngine
+from http_monitor.alert_rules import parse_rule
+from http_monitor.log_alert_consumer import LogAlertConsumer
+from tests.helpers import record
+import unittest
+
+
+class TestParseRule(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(
+            parse_rule('hits@api>5/10s'),
+            AlertRule('hits@api>5/10s', 'hits', 'api', 5.0, 10)
+        )
+        self.assertEqual(
+            parse_rule('error_rate>0.05/15m'),
+            AlertRule('error_rate>0.05/15m', 'error_rate', None, 0.05, 900)
+        )
+        self.assertEqual(parse_rule('bytes>1e6/120').threshold, 1e6)
+
+    def test_invalid(self):
+        for spec in ('hits>5', 'latency>5/10s', 'hits>five/10s', 'hits>5/0'):
+            with self.assertRaises(ValueError):
+                parse_rule(spec)
+
+
+class TestRuleEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.engine = RuleEngine([
+            parse_rule('hits@api>2/5s'),
+            parse_rule('hits>100/5s'),
+            parse_rule('error_rate>0.5/5s'),
+            parse_rule('bytes@report>1000/10s')
+        ])
+        self.engine.add_listener(self.events.append)
+
+    def tearDown(self):
+        self.engine = None
+
+    def test_windows_are_shared(self):
+        # hits@api, hits and error_rate over 5s share the overall hits
+        self.assertEqual(set(self.engine.windows), {
+            ('bytes', 'report', 10), ('errors', None, 5), ('hits', None, 5),
+            ('hits', 'api', 5)
+        })
+
+    def test_section_alert_and_recover(self):
+        # Quiet first window, then 3 api hits / second
+        self.engine.process_records([record(t) for t in range(100, 105)])
+        self.engine.process_records(
+            [record(t) for t in range(105, 110) for _ in range(3)]
+            + [record(t, 'report') for t in range(105, 110)]
+        )
+        self.assertEqual(
+            [(e['rule'], e['type']) for e in self.events],
+            [('hits@api>2/5s', 'alert')]
+        )
+        self.assertEqual(self.events[0]['hits'], 11)
+
+        self.engine.process_records([record(115, 'report')])
+        self.assertEqual(self.events[-1]['type'], 'recovered')
+        self.assertFalse(self.engine.alerted['hits@api>2/5s'])
+        self.assertEqual(self.engine.alert_count, 1)
+
+    def test_error_rate(self):
+        self.engine.process_records([record(t) for t in range(100, 105)])
+        self.engine.process_records(
+            [record(105, 'home', '500')] * 6 + [record(105, 'home', '404')]
+        )
+
+        # 6 of the 11 hits in the window (101, 105]
+        self.assertEqual(
+            [(e['rule'], e['value']) for e in self.events],
+            [('error_rate>0.5/5s', 6 / 11)]
+        )
+
+    def test_bytes_and_sampled_weight(self):
+        self.engine.process_records(
+            [record(t, 'report', size=200) for t in range(100, 111)],
+            weight=10
+        )
+
+        alert = self.events[0]
+        self.assertEqual(alert['rule'], 'bytes@report>1000/10s')
+        self.assertEqual(alert['value'], 2000)
+        self.assertIsNone(alert['hits'])
+
+    def test_rules_wait_out_their_first_window(self):
+        self.engine.process_records([record(100)] * 50)
+        self.assertEqual(self.events, [])
+
+
+class TestLogAlertConsumerRules(unittest.TestCase):
+
+    def test_rules_see_the_same_batches(self):
+        consumer = LogAlertConsumer(
+            5, 100, None, use_log_time=True, rules=[parse_rule('hits>1/2s')]
+        )
+        consumer.process_records([record(t) for t in range(100, 103)] * 2)
+
+        self.assertNotIn('type', consumer.alert_data)
+        self.assertEqual(consumer.rule_engine.alert_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
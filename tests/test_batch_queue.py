@@ -0,0 +1,109 @@
+from http_monitor.batch_queue import BatchQueue
+from http_monitor.batch_queue import DROP
+from http_monitor.batch_queue import SAMPLE
+import threading
+import unittest
+
+
+class TestBatchQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = BatchQueue()
+
+    def tearDown(self):
+        self.queue = None
+
+    def test_get_takes_all_batches(self):
+        self.queue.put([1, 2])
+        self.queue.put([3])
+
+        self.assertEqual(self.queue.get(0), [[1, 2], [3]])
+        self.assertEqual(len(self.queue), 0)
+
+    def test_empty_batches_are_ignored(self):
+        self.queue.put([])
+
+        self.assertEqual(self.queue.get(0), [])
+
+    def test_get_times_out(self):
+        self.assertEqual(self.queue.get(0.01), [])
+
+    def test_get_wakes_up_on_put(self):
+        timer = threading.Timer(0.05, self.queue.put, args=([1],))
+        timer.start()
+
+        self.assertEqual(self.queue.get(5), [[1]])
+        timer.join()
+
+    def test_close_wakes_up_consumer(self):
+        timer = threading.Timer(0.05, self.queue.close)
+        timer.start()
+
+        self.assertEqual(self.queue.get(5), [])
+        self.assertTrue(self.queue.closed)
+        timer.join()
+
+
+class TestBoundedBatchQueue(unittest.TestCase):
+
+    def test_block_waits_for_consumer(self):
+        queue = BatchQueue(capacity=3)
+        queue.put([1, 2])
+        timer = threading.Timer(0.05, queue.get, args=(0,))
+        timer.start()
+
+        # Blocks until the timer takes the first batch
+        self.assertEqual(queue.put([3, 4]), 0)
+        self.assertEqual(queue.get(0), [[3, 4]])
+        timer.join()
+
+    def test_block_gives_up_when_closed(self):
+        queue = BatchQueue(capacity=2)
+        queue.put([1, 2])
+        timer = threading.Timer(0.05, queue.close)
+        timer.start()
+
+        self.assertEqual(queue.put([3]), 1)
+        self.assertEqual(queue.dropped_lines, 1)
+        timer.join()
+
+    def test_batch_larger_than_capacity_fits_empty_queue(self):
+        queue = BatchQueue(capacity=2)
+
+        self.assertEqual(queue.put([1, 2, 3]), 0)
+        self.assertEqual(queue.pending_lines, 3)
+
+    def test_drop(self):
+        queue = BatchQueue(capacity=3, policy=DROP)
+        queue.put([1, 2])
+
+        self.assertEqual(queue.put([3, 4]), 2)
+        self.assertEqual(queue.put([5]), 0)
+        self.assertEqual(queue.get(0), [[1, 2], [5]])
+        self.assertEqual(queue.dropped_lines, 2)
+
+    def test_sample(self):
+        queue = BatchQueue(capacity=10, policy=SAMPLE, sample_rate=4)
+        queue.put(list(range(8)))
+
+        self.assertEqual(queue.put(list(range(8))), 6)
+        batches = queue.get(0)
+        self.assertEqual(batches[1], [0, 4])
+        self.assertEqual(batches[1].weight, 4)
+        self.assertFalse(hasattr(batches[0], 'weight'))
+
+    def test_memory_stays_bounded_under_overload(self):
+        queue = BatchQueue(capacity=1000, policy=SAMPLE, sample_rate=10)
+        for _ in range(1000):
+            queue.put([0] * 100)
+
+        self.assertLessEqual(queue.pending_lines, 1000)
+        self.assertEqual(queue.pending_lines + queue.dropped_lines, 100000)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            BatchQueue(policy='spill')
+
+
+if __name__ == '__main__':
+    unittest.main()
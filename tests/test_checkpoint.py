@@ -0,0 +1,169 @@
+from http_monitor.alert_rules import parse_rule
+from http_monitor.batch_queue import ReadBatch
+from http_monitor.checkpoint import Checkpointer
+from http_monitor.checkpoint import load_checkpoint
+from http_monitor.checkpoint import restore_checkpoint
+from http_monitor.checkpoint import start_positions
+from http_monitor.file_follower import FileFollower
+from http_monitor.log_alert_consumer import LogAlertConsumer
+from http_monitor.log_parser import LogParser
+from http_monitor.log_stats_consumer import LogStatsConsumer
+from tests.helpers import record
+import os
+import tempfile
+import unittest
+
+
+def read_batches(follower):
+    """
+    Reads the lines available in batches tagged with their read position,
+    as the LogReader queues them
+    """
+    parser = LogParser()
+    batches = []
+    log_block = follower.read_block()
+    while log_block:
+        batches.append(
+            ReadBatch(parser.parse_block(log_block), follower.position())
+        )
+        log_block = follower.read_block()
+    return batches
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.checkpoint_path = tempfile.mkstemp()
+        os.close(handle)
+        os.remove(self.checkpoint_path)
+
+    def tearDown(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def consumers(self, time_window=10):
+        alerts = LogAlertConsumer(
+            time_window, 2, None, use_log_time=True,
+            rules=[parse_rule('hits@api>1/5s')]
+        )
+        stats = LogStatsConsumer(10, None, use_log_time=True)
+        return alerts, stats
+
+    def test_restart_resumes_alerting(self):
+        alerts, stats = self.consumers()
+        # A warmed up window at 1 hit / second, then a burst that alerts
+        records = [record(t) for t in range(100, 111)]
+        records += [record(111)] * 20
+        alerts.process_records(records)
+        stats.process_records(records)
+        self.assertEqual(alerts.alert_data['type'], 'alert')
+
+        checkpointer = Checkpointer(self.checkpoint_path, alerts, stats)
+        self.assertTrue(checkpointer.save())
+        self.assertFalse(checkpointer.save())
+
+        restored_alerts, restored_stats = self.consumers()
+        self.assertTrue(restore_checkpoint(
+            self.checkpoint_path, restored_alerts, restored_stats
+        ))
+        self.assertTrue(restored_alerts.warmed_up)
+        self.assertEqual(restored_alerts.alert_window.total, 29)
+        self.assertEqual(restored_alerts.alert_data, alerts.alert_data)
+        self.assertTrue(
+            restored_alerts.rule_engine.alerted['hits@api>1/5s']
+        )
+        self.assertEqual(restored_stats.updated_stats_data()['hits'], 31)
+
+        # The first line after the restart can already recover
+        restored_alerts.process_records([record(125)])
+        self.assertEqual(restored_alerts.alert_data['type'], 'recovered')
+        self.assertEqual(restored_alerts.alert_data['alert_count'], 1)
+
+    def test_changed_time_window_keeps_alert_count(self):
+        alerts, stats = self.consumers()
+        alerts.process_records(
+            [record(t) for t in range(100, 111)] + [record(111)] * 20
+        )
+        Checkpointer(self.checkpoint_path, alerts, stats).save()
+
+        restored_alerts, restored_stats = self.consumers(time_window=20)
+        restore_checkpoint(
+            self.checkpoint_path, restored_alerts, restored_stats
+        )
+        self.assertFalse(restored_alerts.warmed_up)
+        self.assertEqual(restored_alerts.alert_window.total, 0)
+        self.assertEqual(restored_alerts.alert_data, {'alert_count': 1})
+
+    def test_missing_or_corrupt_checkpoint(self):
+        alerts, stats = self.consumers()
+        self.assertFalse(
+            restore_checkpoint(self.checkpoint_path, alerts, stats)
+        )
+
+        with open(self.checkpoint_path, 'w') as checkpoint_file:
+            checkpoint_file.write('{"version": 1, "alerts"')
+        self.assertIsNone(load_checkpoint(self.checkpoint_path))
+
+    def test_restart_reads_again_the_queued_batches(self):
+        self.assertRestartCountsEveryLineOnce(600, 600)
+
+    def test_restart_reads_again_in_larger_blocks(self):
+        # The blocks read again straddle the batches processed before
+        self.assertRestartCountsEveryLineOnce(600, 65536)
+
+    def assertRestartCountsEveryLineOnce(self, read_size, reread_size):
+        handle, log_path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, log_path)
+        follower = FileFollower(log_path, read_size=read_size)
+        with open(log_path, 'a') as log_file:
+            log_file.writelines(
+                f'"10.0.0.1","-","apache",{t},"GET /api/x HTTP/1.0",200,100\n'
+                for t in range(100, 160) for _ in range(t % 3 + 1)
+            )
+        lines = sum(t % 3 + 1 for t in range(100, 160))
+        batches = read_batches(follower)
+        follower.close()
+
+        # The stats consumer is further behind on the queued batches
+        alerts, stats = self.consumers()
+        for records in batches[:6]:
+            alerts.process_records(records)
+        for records in batches[:3]:
+            stats.process_records(records)
+        Checkpointer(self.checkpoint_path, alerts, stats).save()
+        for records in batches[6:]:
+            alerts.process_records(records)
+        for records in batches[3:]:
+            stats.process_records(records)
+
+        state = load_checkpoint(self.checkpoint_path)
+        positions = start_positions(state, log_path)
+        self.assertEqual([position['offset'] for position in positions],
+                         [batches[5].read_position['offset'],
+                          batches[2].read_position['offset']])
+        self.assertIsNone(start_positions(state, 'other.log'))
+
+        restored_alerts, restored_stats = self.consumers()
+        restore_checkpoint(
+            self.checkpoint_path, restored_alerts, restored_stats
+        )
+        follower = FileFollower(log_path, read_size=reread_size,
+                                start_positions=positions)
+        with follower:
+            for records in read_batches(follower):
+                restored_alerts.process_records(records)
+                restored_stats.process_records(records)
+
+        # Every line counted exactly once by both consumers
+        self.assertEqual(restored_stats.total_hits, lines)
+        self.assertEqual(stats.total_hits, lines)
+        self.assertEqual(restored_alerts.alert_window.state(),
+                         alerts.alert_window.state())
+        self.assertEqual(restored_alerts.alert_data, alerts.alert_data)
+        self.assertEqual(restored_alerts.rule_engine.checkpoint(),
+                         alerts.rule_engine.checkpoint())
+
+
+if __name__ == '__main__':
+    unittest.main()
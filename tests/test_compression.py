@@ -0,0 +1,105 @@
+from http_monitor.compression import ZSTD_MAGIC
+from http_monitor.compression import compression_format
+from http_monitor.compression import open_log_file
+from http_monitor.compression import zstandard
+from http_monitor.replay import replay_log_file
+from unittest import mock
+import bz2
+import gzip
+import io
+import lzma
+import os
+import tempfile
+import unittest
+
+LINES = b''.join(
+    b'"10.0.0.2","-","apache",%d,"GET /api/user HTTP/1.0",200,100\n' % t
+    for t in range(1549573860, 1549573920)
+)
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.paths = []
+
+    def tearDown(self):
+        for path in self.paths:
+            os.remove(path)
+
+    def write(self, data):
+        handle, path = tempfile.mkstemp()
+        with os.fdopen(handle, 'wb') as log_file:
+            log_file.write(data)
+        self.paths.append(path)
+        return path
+
+    def test_formats_are_detected_from_content(self):
+        for compress, expected in ((gzip.compress, 'gzip'),
+                                   (bz2.compress, 'bzip2'),
+                                   (lzma.compress, 'xz')):
+            path = self.write(compress(LINES))
+            self.assertEqual(compression_format(path), expected)
+            with open_log_file(path) as log_file:
+                self.assertEqual(log_file.read(), LINES)
+
+        self.assertIsNone(compression_format(self.write(LINES)))
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        path = self.write(zstandard.ZstdCompressor().compress(LINES))
+
+        self.assertEqual(compression_format(path), 'zstd')
+        with open_log_file(path) as log_file:
+            self.assertEqual(log_file.read(), LINES)
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd_frames(self):
+        # One frame per flush, as appended by a logger or written by pzstd
+        half = len(LINES) // 2
+        compressor = zstandard.ZstdCompressor()
+        path = self.write(compressor.compress(LINES[:half]) +
+                          compressor.compress(LINES[half:]))
+
+        plain, compressed = io.StringIO(), io.StringIO()
+        replay_log_file(self.write(LINES), 10, 0, 10, output=plain)
+        replay_log_file(path, 10, 0, 10, output=compressed)
+
+        self.assertEqual(compressed.getvalue(), plain.getvalue())
+
+    def test_zstd_reads_across_frames(self):
+        # Runs without the optional package too
+        fake = mock.Mock()
+        stream_reader = fake.ZstdDecompressor.return_value.stream_reader
+        stream_reader.return_value = io.BytesIO(LINES)
+        path = self.write(ZSTD_MAGIC + b'frames')
+
+        with mock.patch('http_monitor.compression.zstandard', fake):
+            with open_log_file(path) as log_file:
+                self.assertEqual(log_file.read(), LINES)
+
+        (source,), options = stream_reader.call_args
+        source.close()
+        self.assertEqual(options,
+                         {'read_across_frames': True, 'closefd': True})
+
+    def test_zstd_without_zstandard(self):
+        path = self.write(ZSTD_MAGIC + b'frames')
+
+        with mock.patch('http_monitor.compression.zstandard', None):
+            with self.assertRaises(RuntimeError):
+                open_log_file(path)
+
+    def test_replay_of_compressed_file_matches_plain(self):
+        plain, compressed = io.StringIO(), io.StringIO()
+        replay_log_file(self.write(LINES), 10, 0, 10, output=plain)
+        replay_log_file(
+            self.write(gzip.compress(LINES)), 10, 0, 10, output=compressed
+        )
+
+        self.assertEqual(compressed.getvalue(), plain.getvalue())
+        self.assertIn('60 lines replayed', plain.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+from http_monitor.file_follower import FileFollower
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestFileFollower(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.directory, 'access.log')
+        self.offset_path = os.path.join(self.directory, 'access.offset')
+        self.write('old line\n', 'w')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, text, mode='a'):
+        with open(self.log_path, mode) as log_file:
+            log_file.write(text)
+
+    def test_starts_at_end_of_file(self):
+        with FileFollower(self.log_path) as follower:
+            self.assertEqual(follower.read_block(), b'')
+            self.write('a\nb\n')
+            self.assertEqual(follower.read_block(), b'a\nb\n')
+
+    def test_holds_back_partial_lines(self):
+        with FileFollower(self.log_path) as follower:
+            self.write('a\npart')
+            self.assertEqual(follower.read_block(), b'a\n')
+            self.assertEqual(follower.read_block(), b'')
+
+            self.write('ial\n')
+            self.assertEqual(follower.read_block(), b'partial\n')
+
+    def test_drains_renamed_file_before_switching(self):
+        with FileFollower(self.log_path) as follower:
+            self.write('a\n')
+            os.rename(self.log_path, self.log_path + '.1')
+            self.assertEqual(follower.read_block(), b'a\n')
+
+            # Writers still holding the old file until it is reopened
+            with open(self.log_path + '.1', 'a') as old_file:
+                old_file.write('b\nlast')
+            self.write('c\n', 'w')
+
+            self.assertEqual(follower.read_block(), b'b\n')
+            self.assertEqual(follower.read_block(), b'last\nc\n')
+            self.write('d\n')
+            self.assertEqual(follower.read_block(), b'd\n')
+
+    def test_rewinds_truncated_file(self):
+        with FileFollower(self.log_path) as follower:
+            self.write('a\nb\n')
+            self.assertEqual(follower.read_block(), b'a\nb\n')
+
+            self.write('c\n', 'w')
+            self.assertEqual(follower.read_block(), b'c\n')
+
+    def test_resumes_from_persisted_offset(self):
+        with FileFollower(self.log_path, offset_path=self.offset_path) as f:
+            self.write('a\n')
+            self.assertEqual(f.read_block(), b'a\n')
+
+        self.write('b\n')
+        with FileFollower(self.log_path, offset_path=self.offset_path) as f:
+            self.assertEqual(f.read_block(), b'b\n')
+
+    def test_starts_new_file_from_beginning_after_restart(self):
+        with FileFollower(self.log_path, offset_path=self.offset_path):
+            pass
+
+        os.rename(self.log_path, self.log_path + '.1')
+        self.write('new\n', 'w')
+        with FileFollower(self.log_path, offset_path=self.offset_path) as f:
+            self.assertEqual(f.read_block(), b'new\n')
+
+    def test_resumes_from_earliest_start_position(self):
+        with FileFollower(self.log_path, offset_path=self.offset_path) as f:
+            self.write('a\nb\n')
+            self.assertEqual(f.read_block(), b'a\nb\n')
+            behind = dict(f.position(), offset=f.offset - 2)
+            ahead = f.position()
+
+        # Preferred over the persisted offset, which is further ahead
+        with FileFollower(self.log_path, offset_path=self.offset_path,
+                          start_positions=[ahead, behind]) as f:
+            self.assertEqual(f.read_block(), b'b\n')
+
+        moved = dict(ahead, inode=-1)
+        with FileFollower(self.log_path,
+                          start_positions=[ahead, moved]) as f:
+            self.assertEqual(f.read_block(), b'old line\na\nb\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+from http_monitor.history import HOUR
+from http_monitor.history import HistoryStore
+from http_monitor.history import MINUTE
+from http_monitor.history import OTHER_SECTIONS
+from http_monitor.history import SECOND
+from http_monitor.log_stats_consumer import LogStatsConsumer
+from tests.helpers import record
+import os
+import tempfile
+import unittest
+
+
+class TestHistoryStore(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.history_path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.history = HistoryStore(self.history_path)
+
+    def tearDown(self):
+        self.history.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.history_path + suffix):
+                os.remove(self.history_path + suffix)
+
+    def test_rollups_at_each_resolution(self):
+        self.history.add_records([
+            record(3600), record(3601, 'report', '404', 50), record(3661)
+        ])
+        self.history.flush()
+
+        self.assertEqual(
+            self.history.hits('api', SECOND),
+            [(3600, 1, 100), (3661, 1, 100)]
+        )
+        self.assertEqual(
+            self.history.hits(None, MINUTE), [(3600, 2, 150), (3660, 1, 100)]
+        )
+        self.assertEqual(self.history.hits(None, HOUR), [(3600, 3, 250)])
+        self.assertEqual(
+            self.history.status_counts(HOUR), {'2XX': 2, '4XX': 1}
+        )
+        self.assertEqual(
+            self.history.top_sections(1, HOUR), [('api', 2, 200)]
+        )
+
+    def test_buckets_add_up_across_flushes(self):
+        self.history.add_records([record(60)])
+        self.history.flush()
+        self.history.add_records([record(61), record(62)])
+        self.history.flush()
+
+        self.assertEqual(self.history.hits('api', MINUTE), [(60, 3, 300)])
+
+    def test_expired_rows_are_deleted(self):
+        history = HistoryStore(
+            self.history_path, retention={SECOND: 60}, prune_interval=0
+        )
+        history.add_records([record(0), record(100)])
+        history.flush()
+
+        self.assertEqual(history.hits('api', SECOND), [(100, 1, 100)])
+        self.assertEqual(history.hits('api', MINUTE), [(0, 1, 100),
+                                                       (60, 1, 100)])
+        history.close()
+
+    def test_query_range(self):
+        self.history.add_records([record(t) for t in range(0, 600, 30)])
+        self.history.flush()
+
+        self.assertEqual(
+            [start for start, _, _ in self.history.hits('api', MINUTE,
+                                                         120, 300)],
+            [120, 180, 240]
+        )
+
+    def test_top_k_keeps_top_sections_per_bucket(self):
+        history = HistoryStore(self.history_path, top_k=5)
+        for batch in range(3):
+            history.add_records(
+                [record(60, 'api')] * 50 + [record(60, 'report')] * 20 +
+                [record(61, f'bot{batch}_{i}') for i in range(30)]
+            )
+            history.flush()
+
+        # Totals are exact, the top sections are kept and the rest of the
+        # hits are in the other row
+        self.assertEqual(history.hits(None, MINUTE), [(60, 300, 30000)])
+        self.assertEqual(history.top_sections(2, MINUTE),
+                         [('api', 150, 15000), ('report', 60, 6000)])
+        rows = history.connection.execute(
+            'SELECT COUNT(*), SUM(hits), SUM(bytes) FROM section_rollups '
+            'WHERE resolution = ? AND section != ?', (SECOND, '')
+        ).fetchone()
+        self.assertLessEqual(rows[0], 2 + 3 * (5 + 1))
+        self.assertEqual(rows[1:], (300, 30000))
+        self.assertGreater(history.hits(OTHER_SECTIONS, SECOND)[0][1], 0)
+        history.close()
+
+    def test_stats_consumer_writes_history(self):
+        consumer = LogStatsConsumer(
+            10, None, use_log_time=True, history=self.history
+        )
+        consumer.process_records([record(100), record(105), record(112)])
+
+        # Written when the first interval is saved
+        self.assertEqual(
+            HistoryStore(self.history_path).hits('api', MINUTE),
+            [(60, 2, 200)]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
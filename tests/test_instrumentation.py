@@ -0,0 +1,132 @@
+from http_monitor.batch_queue import BatchQueue
+from http_monitor.instrumentation import PipelineMonitor
+from http_monitor.instrumentation import SamplingProfiler
+from http_monitor.instrumentation import StageStats
+from http_monitor.instrumentation import profile_thread
+from http_monitor.log_alert_consumer import LogAlertConsumer
+from tests.helpers import record
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+
+class TestPipelineMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.reader = StageStats()
+        self.queue = BatchQueue()
+        self.monitor = PipelineMonitor(
+            {'reader': self.reader}, {'alerts': self.queue}
+        )
+
+    def tearDown(self):
+        self.monitor = None
+
+    def test_stage_counters(self):
+        now = int(time.time())
+        self.reader.record_batch([record(now - 5)] * 3, 0.002, malformed=1)
+        self.reader.record_batch([record(now - 3)], 0.004)
+
+        stage = self.monitor.snapshot()['stages']['reader']
+
+        self.assertEqual(stage['lines'], 5)
+        self.assertEqual(stage['malformed'], 1)
+        self.assertEqual(stage['ms_per_batch'], 3.0)
+        self.assertEqual(stage['max_ms_per_batch'], 4.0)
+        self.assertAlmostEqual(stage['lag_seconds'], 3, delta=1)
+
+    def test_rates_between_snapshots(self):
+        # Pretend the previous snapshot was taken two seconds ago
+        since, counters = self.monitor.latest
+        self.monitor.previous = self.monitor.latest = (since - 2, counters)
+        self.reader.record_batch([record(0)] * 100, 0.5)
+
+        stage = self.monitor.snapshot()['stages']['reader']
+
+        self.assertAlmostEqual(stage['lines_per_second'], 50, delta=1)
+        self.assertAlmostEqual(stage['busy'], 0.25, delta=0.01)
+
+    def test_queue_depth(self):
+        self.queue.put([record(0)] * 3)
+        self.queue.put([record(0)] * 2)
+        self.assertEqual(
+            self.monitor.snapshot()['queues']['alerts'],
+            {'batches': 2, 'lines': 5, 'capacity': None, 'dropped': 0}
+        )
+
+        self.queue.get(0)
+        self.assertEqual(self.queue.pending_lines, 0)
+
+    def test_version_changes_with_new_data_only(self):
+        self.reader.record_batch([record(int(time.time()) - 5)], 0.001)
+        self.monitor.snapshot()
+        version = self.monitor.version
+
+        # The lag grows with the wall clock, which is not new data
+        time.sleep(0.2)
+        self.monitor.snapshot()
+        self.assertEqual(self.monitor.version, version)
+
+        self.reader.record_batch([record(int(time.time()))], 0.001)
+        self.monitor.snapshot()
+        self.assertEqual(self.monitor.version, version + 1)
+
+    def test_consumer_records_batches(self):
+        queue = BatchQueue()
+        consumer = LogAlertConsumer(120, 10, queue)
+        queue.put([record(0), record(1)])
+        queue.close()
+        consumer.run()
+
+        self.assertEqual(consumer.stage_stats.batches, 1)
+        self.assertEqual(consumer.stage_stats.lines, 2)
+        self.assertEqual(consumer.stage_stats.latest_log_time, 1)
+
+
+class Worker(threading.Thread):
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.stop = threading.Event()
+
+    def run(self):
+        self.stop.wait(5)
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_profile_thread(self):
+        with tempfile.TemporaryDirectory() as profile_dir:
+            worker = Worker()
+            worker.stop.set()
+            profile_thread(worker, profile_dir)
+            worker.start()
+            worker.join()
+
+            self.assertEqual(len(os.listdir(profile_dir)), 1)
+            self.assertTrue(os.listdir(profile_dir)[0].startswith('Worker-'))
+
+    def test_sampling_profiler(self):
+        worker = Worker()
+        worker.start()
+        with tempfile.TemporaryDirectory() as output_dir:
+            output_path = os.path.join(output_dir, 'stacks.txt')
+            profiler = SamplingProfiler(output_path, interval=0.001)
+            profiler.start()
+            time.sleep(0.05)
+            worker.stop.set()
+            worker.join()
+            profiler.join(5)
+
+            with open(output_path) as output_file:
+                stacks = output_file.read()
+
+        self.assertFalse(profiler.is_alive())
+        self.assertIn('Worker;', stacks)
+        self.assertIn('run (test_instrumentation.py)', stacks)
+
+
+if __name__ == '__main__':
+    unittest.main()
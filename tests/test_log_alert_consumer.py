@@ -1,5 +1,7 @@
-from collections import deque
+from http_monitor.alert_rules import parse_rule
+from http_monitor.batch_queue import BatchQueue
 from http_monitor.log_alert_consumer import LogAlertConsumer
+from http_monitor.log_record import LogRecord
 import unittest
 
 
@@ -8,11 +10,13 @@ class TestLogAlertConsumer(unittest.TestCase):
     def setUp(self):
         self.time_window = 6
         threshold = 5
-        self.consumer = LogAlertConsumer(self.time_window, threshold, deque())
+        self.consumer = LogAlertConsumer(
+            self.time_window, threshold, BatchQueue()
+        )
 
         # (10 / 6) = 1.6 - no alert
         times = [1549573860] * 3 + [1549573861] * 7
-        [self.consumer.alert_queue.append(t) for t in times]
+        [self.consumer.alert_window.add(t) for t in times]
         self.consumer._LogAlertConsumer__should_alert_or_recover(1549573861)
 
     def tearDown(self):
@@ -26,7 +30,7 @@ class TestLogAlertConsumer(unittest.TestCase):
 
         # (27 / 6) = 6.1 > threshold - alert
         breach_threshold_times = [1549573862] * 27
-        [self.consumer.alert_queue.append(t) for t in breach_threshold_times]
+        [self.consumer.alert_window.add(t) for t in breach_threshold_times]
         self.consumer._LogAlertConsumer__should_alert_or_recover(1549573862)
         alert_data = self.consumer.updated_alert_data()
 
@@ -35,13 +39,13 @@ class TestLogAlertConsumer(unittest.TestCase):
 
     def test_recovered_state(self):
         breach_threshold_times = [1549573862] * 27
-        [self.consumer.alert_queue.append(t) for t in breach_threshold_times]
+        [self.consumer.alert_window.add(t) for t in breach_threshold_times]
         self.consumer._LogAlertConsumer__should_alert_or_recover(1549573862)
 
         push_out = breach_threshold_times[0] + 2
         for _ in range(self.time_window):
             push_out += 1
-            self.consumer.alert_queue.append(push_out)
+            self.consumer.alert_window.add(push_out)
 
         self.consumer._LogAlertConsumer__should_alert_or_recover(push_out)
         alert_data = self.consumer.updated_alert_data()
@@ -52,20 +56,20 @@ class TestLogAlertConsumer(unittest.TestCase):
 
     def test_recover_then_alert_state(self):
         breach_threshold_times = [1549573862] * 27
-        [self.consumer.alert_queue.append(t) for t in breach_threshold_times]
+        [self.consumer.alert_window.add(t) for t in breach_threshold_times]
         self.consumer._LogAlertConsumer__should_alert_or_recover(1549573862)
 
         push_out = breach_threshold_times[0] + 2
         for _ in range(self.time_window):
             push_out += 1
-            self.consumer.alert_queue.append(push_out)
+            self.consumer.alert_window.add(push_out)
 
         self.consumer._LogAlertConsumer__should_alert_or_recover(push_out)
 
         # (55 / 6) - alert again
         breach = [push_out] * 50
 
-        [self.consumer.alert_queue.append(t) for t in breach]
+        [self.consumer.alert_window.add(t) for t in breach]
         self.consumer._LogAlertConsumer__should_alert_or_recover(breach[0])
         alert_data = self.consumer.updated_alert_data()
 
@@ -73,5 +77,31 @@ class TestLogAlertConsumer(unittest.TestCase):
         self.assertEqual(alert_data['alert_count'], 2)
 
 
+class TestLogAlertConsumerListeners(unittest.TestCase):
+
+    def test_listeners_are_called_outside_the_lock(self):
+        consumer = LogAlertConsumer(
+            2, 1, None, use_log_time=True, rules=[parse_rule('hits>1/2s')]
+        )
+        events = []
+
+        def listener(alert_data):
+            events.append((alert_data['type'], consumer.lock.locked()))
+
+        consumer.add_listener(listener)
+        consumer.rule_engine.add_listener(listener)
+        consumer.process_records([
+            LogRecord('10.0.0.1', 'apache', t, 'GET', 'api', '200', 100)
+            for t in range(100, 104) for _ in range(3)
+        ])
+        consumer.process_hits(110, 1)
+
+        # The rules are checked after the whole batch
+        self.assertEqual(events, [('alert', False), ('alert', False),
+                                  ('recovered', False)])
+        self.assertEqual(consumer.pending_alerts, [])
+        self.assertEqual(consumer.alert_version, 2)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,82 @@
+from http_monitor.log_parser import LogParser
+import unittest
+
+
+class TestLogParser(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = LogParser()
+
+    def tearDown(self):
+        self.parser = None
+
+    def test_parses_fields(self):
+        records = self.parser.parse_lines([
+            '"10.0.0.2","-","apache",1549573860,"GET /api/user HTTP/1.0",'
+            '200,1234\n'
+        ])
+
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual(record.client, '10.0.0.2')
+        self.assertEqual(record.user_id, 'apache')
+        self.assertEqual(record.time, 1549573860)
+        self.assertEqual(record.method, 'GET')
+        self.assertEqual(record.section, 'api')
+        self.assertEqual(record.status, '200')
+        self.assertEqual(record.size, 1234)
+
+    def test_quoted_field_with_comma(self):
+        records = self.parser.parse_block(
+            '"10.0.0.2","-","doe, jane",1549573860,'
+            '"POST /report?a=1,2 HTTP/1.0",500,10\r\n'
+        )
+
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].user_id, 'doe, jane')
+        self.assertEqual(records[0].section, 'report?a=1,2')
+        self.assertEqual(records[0].status, '500')
+
+    def test_counts_malformed_lines(self):
+        records = self.parser.parse_block(
+            '"remotehost","rfc931","authuser","date","request","status",'
+            '"bytes"\n'
+            '"10.0.0.2","-","apache",1549573860,"GET / HTTP/1.0",200,1\n'
+            '\n'
+            'garbage\n'
+            '"10.0.0.2","-","apache",not_a_time,"GET /a HTTP/1.0",200,1\n'
+            '"10.0.0.2","-","apache",1549573861,"GET /b/c HTTP/1.0",404,2'
+        )
+
+        self.assertEqual([r.section for r in records], ['', 'b'])
+        self.assertEqual(self.parser.parsed_lines, 2)
+        self.assertEqual(self.parser.malformed_lines, 3)
+
+    def test_interns_repeated_strings(self):
+        line = (
+            '"10.0.0.2","-","apache",1549573860,"GET /api/user HTTP/1.0",'
+            '200,1234\n'
+        )
+        first, second = self.parser.parse_lines([line, line])
+
+        self.assertIs(first.section, second.section)
+        self.assertIs(first.client, second.client)
+
+    def test_bytes_block_matches_str_block(self):
+        block = (
+            '"10.0.0.2","-","jos\u00e9",1549573860,'
+            '"GET /caf\u00e9/a HTTP/1.0",200,1234\n'
+            'garbage\n'
+            '"10.0.0.3","-","apache",1549573861,"POST / HTTP/1.0",500,1\n'
+        )
+        expected = LogParser().parse_block(block)
+        records = self.parser.parse_block(block.encode('utf-8'))
+
+        self.assertEqual(records, expected)
+        self.assertEqual(records[0].section, 'caf\u00e9')
+        self.assertIsInstance(records[1].status, str)
+        self.assertEqual(self.parser.malformed_lines, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+from http_monitor.batch_queue import BatchQueue
+from http_monitor.log_stats_consumer import LogStatsConsumer
+from tests.helpers import record
+import unittest
+
+
+class TestLogStatsConsumer(unittest.TestCase):
+
+    def setUp(self):
+        self.consumer = LogStatsConsumer(10, BatchQueue())
+
+    def tearDown(self):
+        self.consumer = None
+
+    def test_counts_are_published_on_save(self):
+        self.consumer.process_records([
+            record(1), record(1, 'report', '404', 50), record(2, 'api', '500')
+        ])
+        self.assertEqual(self.consumer.updated_stats_data()['hits'], 0)
+
+        self.consumer.save_stats()
+        stats_data = self.consumer.updated_stats_data()
+
+        self.assertEqual(stats_data['hits'], 3)
+        self.assertEqual(stats_data['size'], 250)
+        self.assertEqual(stats_data['section_counts']['api'], 2)
+        self.assertEqual(stats_data['section_size']['api'], 200)
+        self.assertEqual(
+            stats_data['status_counts'], {'2XX': 1, '4XX': 1, '5XX': 1}
+        )
+        self.assertEqual(self.consumer.stats_version, 1)
+
+    def test_published_snapshot_is_not_mutated(self):
+        self.consumer.process_records([record(1)])
+        self.consumer.save_stats()
+        stats_data = self.consumer.updated_stats_data()
+
+        self.consumer.process_records([record(2, 'report')])
+        self.consumer.save_stats()
+
+        self.assertEqual(stats_data['hits'], 1)
+        self.assertEqual(stats_data['section_counts'], {'api': 1})
+        self.assertEqual(
+            self.consumer.updated_stats_data()['section_counts'],
+            {'report': 1}
+        )
+
+    def test_log_time_intervals(self):
+        saved = []
+        consumer = LogStatsConsumer(10, None, use_log_time=True)
+        consumer.add_listener(saved.append)
+
+        consumer.process_records([record(100), record(105), record(109)])
+        self.assertEqual(saved, [])
+
+        # Crosses into the next interval, then skips an empty one
+        consumer.process_records([record(110), record(108), record(135)])
+        consumer.save_stats()
+
+        self.assertEqual(
+            [(s['interval_start'], s['hits']) for s in saved],
+            [(100, 3), (110, 5), (130, 6)]
+        )
+        self.assertEqual(saved[1]['section_counts']['api'], 2)
+
+    def test_top_sections_with_sketch(self):
+        consumer = LogStatsConsumer(10, None, top_k=4, top_n=2)
+        records = [record(1, 'api', size=10)] * 50
+        records += [record(1, 'user', size=1000)] * 30
+        records += [record(1, f'scan{i}', '404', 1) for i in range(20)]
+
+        consumer.process_records(records)
+        consumer.save_stats()
+        stats_data = consumer.updated_stats_data()
+
+        self.assertEqual(stats_data['hits'], 100)
+        self.assertEqual(len(stats_data['section_counts']), 4)
+        self.assertEqual(
+            [section for section, _, _ in stats_data['top_sections']],
+            ['api', 'user']
+        )
+        self.assertEqual(stats_data['top_sections_by_size'][0][0], 'user')
+        self.assertLessEqual(stats_data['section_error'], 100 / 4)
+
+    def test_size_percentiles_and_top_clients(self):
+        records = [
+            record(1, 'api', size=size, client='10.0.0.1')
+            for size in range(1, 101)
+        ]
+        records += [record(1, 'report', size=5000, client='10.0.0.9')] * 10
+
+        self.consumer.process_records(records)
+        self.consumer.save_stats()
+        stats_data = self.consumer.updated_stats_data()
+
+        p50, p95, p99 = stats_data['section_percentiles']['api']
+        self.assertAlmostEqual(p50, 50, delta=1)
+        self.assertAlmostEqual(p95, 95, delta=1)
+        self.assertAlmostEqual(p99, 99, delta=1)
+        self.assertAlmostEqual(
+            stats_data['section_percentiles']['report'][0], 5000, delta=50
+        )
+        self.assertEqual(
+            stats_data['top_clients'],
+            [('10.0.0.1', 100, 5050), ('10.0.0.9', 10, 50000)]
+        )
+        self.assertEqual(
+            stats_data['top_clients_by_size'][0], ('10.0.0.9', 50000)
+        )
+
+    def test_sampled_records_are_weighted(self):
+        self.consumer.process_records([
+            record(1), record(1, 'report', '404', 50)
+        ], weight=10)
+        self.consumer.save_stats()
+        stats_data = self.consumer.updated_stats_data()
+
+        self.assertEqual(stats_data['hits'], 20)
+        self.assertEqual(stats_data['size'], 1500)
+        self.assertEqual(stats_data['top_sections'][0], ('api', 10, 1000))
+        self.assertEqual(stats_data['status_counts'], {'2XX': 10, '4XX': 10})
+        self.assertEqual(stats_data['top_clients'], [('10.0.0.2', 20, 1500)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+from http_monitor.log_alert_consumer import LogAlertConsumer
+from http_monitor.log_stats_consumer import LogStatsConsumer
+from http_monitor.metrics_server import MetricsServer
+from http_monitor.metrics_server import escape_label
+from tests.helpers import record
+import http.client
+import json
+import unittest
+
+
+class TestMetricsServer(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = LogStatsConsumer(10, None)
+        self.alerts = LogAlertConsumer(2, 1, None, use_log_time=True)
+        self.server = MetricsServer(self.stats, self.alerts, port=0)
+        self.server.start()
+        self.connection = http.client.HTTPConnection(
+            '127.0.0.1', self.server.port, timeout=5
+        )
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.thread_terminated = True
+        self.server.join()
+
+    def get(self, path):
+        self.connection.request('GET', path)
+        response = self.connection.getresponse()
+        return response.status, response.read().decode('utf-8')
+
+    def test_serves_latest_stats(self):
+        status, body = self.get('/metrics')
+        self.assertEqual(status, 200)
+        self.assertIn('http_monitor_hits_total 0\n', body)
+
+        self.stats.process_records([record(1), record(2, 'report', '404')])
+        self.stats.save_stats()
+
+        # Same keep-alive connection sees the new snapshot
+        status, body = self.get('/metrics')
+        self.assertIn('http_monitor_hits_total 2\n', body)
+        self.assertIn('http_monitor_interval_status_hits{class="4XX"} 1\n',
+                      body)
+        self.assertIn('http_monitor_interval_section_hits{section="api"} 1\n',
+                      body)
+
+        status, body = self.get('/metrics.json')
+        self.assertEqual(json.loads(body)['hits'], 2)
+
+    def test_serves_alert_state(self):
+        self.assertFalse(json.loads(self.get('/alerts')[1])['alerting'])
+
+        self.alerts.process_records([record(t) for t in [0, 1, 2, 3, 3, 3]])
+        alerts = json.loads(self.get('/alerts')[1])
+
+        self.assertTrue(alerts['alerting'])
+        self.assertEqual(alerts['alert']['alert_count'], 1)
+        self.assertIn('http_monitor_alerting 1\n', self.get('/metrics')[1])
+
+    def test_unknown_path(self):
+        self.assertEqual(self.get('/nope')[0], 404)
+
+    def test_escape_label(self):
+        self.assertEqual(escape_label('a"b\\c\n'), 'a\\"b\\\\c\\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+from http_monitor.batch_queue import BatchQueue
+from http_monitor.inotify import inotify_available
+from http_monitor.multi_tailer import MultiFileTailer
+from tests.helpers import log_line
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class RecordingConsumer:
+
+    def __init__(self):
+        self.records = []
+
+    def process_records(self, records):
+        self.records.extend(records)
+
+
+class TestMultiFileTailer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log_paths = []
+        for i in range(3):
+            log_path = os.path.join(self.directory, f'vhost{i}.log')
+            with open(log_path, 'w') as log_file:
+                log_file.write(log_line(0))
+            self.log_paths.append(log_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def tail(self, use_inotify):
+        alert_queue, stats_queue = BatchQueue(), BatchQueue()
+        tailer = MultiFileTailer(
+            alert_queue, stats_queue, use_inotify=use_inotify
+        )
+        consumers = {}
+        for log_path in self.log_paths:
+            consumers[log_path] = RecordingConsumer()
+            tailer.add_file(log_path, [consumers[log_path]])
+        tailer.start()
+
+        for i, log_path in enumerate(self.log_paths):
+            with open(log_path, 'a') as log_file:
+                log_file.writelines(log_line(t) for t in range(i + 1))
+
+        records = []
+        deadline = time.time() + 5
+        while len(records) < 6 and time.time() < deadline:
+            for batch in alert_queue.get(0.1):
+                records.extend(batch)
+
+        tailer.thread_terminated = True
+        tailer.join()
+
+        self.assertEqual(len(records), 6)
+        self.assertTrue(stats_queue.closed)
+        for i, log_path in enumerate(self.log_paths):
+            self.assertEqual(len(consumers[log_path].records), i + 1)
+
+    def test_follows_rotated_file(self):
+        alert_queue, stats_queue = BatchQueue(), BatchQueue()
+        tailer = MultiFileTailer(alert_queue, stats_queue)
+        tailer.add_file(self.log_paths[0])
+        tailer.start()
+
+        os.rename(self.log_paths[0], self.log_paths[0] + '.1')
+        with open(self.log_paths[0], 'w') as log_file:
+            log_file.write(log_line(5))
+
+        batches = alert_queue.get(5)
+        tailer.thread_terminated = True
+        tailer.join()
+
+        self.assertEqual([r.time for r in batches[0]], [5])
+
+    def test_polling(self):
+        self.tail(use_inotify=False)
+
+    @unittest.skipUnless(inotify_available(), 'requires inotify')
+    def test_inotify(self):
+        self.tail(use_inotify=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+from collections import Counter
+from http_monitor.ndjson_sink import NdjsonSink
+from http_monitor.ndjson_sink import open_output
+import io
+import json
+import os
+import tempfile
+import unittest
+
+ALERT_DATA = {
+    'type': 'alert', 'time': 1549573960, 'hits': 1300, 'alert_count': 1,
+    'msg_line1': 'High traffic generated an alert:',
+    'msg_line2': 'hits = 1300, triggered at Feb-07-2019 21:12:40'
+}
+
+
+class TestNdjsonSink(unittest.TestCase):
+
+    def setUp(self):
+        self.output = io.BytesIO()
+        self.sink = NdjsonSink(self.output)
+
+    def tearDown(self):
+        self.sink = None
+
+    def events(self):
+        return [json.loads(line) for line in
+                self.output.getvalue().decode('utf-8').splitlines()]
+
+    def test_events_are_buffered_until_flush(self):
+        self.sink.on_alert(ALERT_DATA)
+        self.sink.on_alert(ALERT_DATA, 'vhost1.log')
+        self.assertEqual(self.output.getvalue(), b'')
+
+        self.sink.flush()
+        events = self.events()
+
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[0]['event'], 'alert')
+        self.assertEqual(events[0]['hits'], 1300)
+        self.assertNotIn('file', events[0])
+        self.assertEqual(events[1]['file'], 'vhost1.log')
+        self.assertEqual(self.sink.events_written, 2)
+
+    def test_stats_event(self):
+        self.sink.on_stats({
+            'hits': 3, 'status_counts': Counter({'2XX': 3}),
+            'top_sections': [('api', 3, 300)]
+        })
+        self.sink.flush()
+        event = self.events()[0]
+
+        self.assertEqual(event['event'], 'stats')
+        self.assertEqual(event['status_counts'], {'2XX': 3})
+        self.assertEqual(event['top_sections'], [['api', 3, 300]])
+
+    def test_thread_writes_file_and_flushes_on_stop(self):
+        handle, output_path = tempfile.mkstemp()
+        os.close(handle)
+        sink = NdjsonSink(open_output(output_path), flush_interval=60)
+        sink.start()
+        for _ in range(10):
+            sink.on_alert(ALERT_DATA)
+        sink.stop()
+        sink.join(5)
+
+        with open(output_path) as output_file:
+            lines = output_file.readlines()
+        os.remove(output_path)
+
+        self.assertFalse(sink.is_alive())
+        self.assertEqual(len(lines), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
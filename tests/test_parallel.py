@@ -0,0 +1,137 @@
+from http_monitor.log_alert_consumer import LogAlertConsumer
+from http_monitor.log_record import LogRecord
+from http_monitor.parallel import BlockHits
+from http_monitor.parallel import PartialStats
+from http_monitor.parallel import replay_log_file_parallel
+from http_monitor.parallel import split_file
+from http_monitor.replay import replay_log_file
+import io
+import os
+import random
+import tempfile
+import unittest
+
+
+class TestParallelReplay(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(7)
+        lines = []
+        for t in range(1549573860, 1549573860 + 300):
+            rate = 30 if 1549573960 <= t < 1549574020 else 5
+            for _ in range(rand.randint(0, rate)):
+                section = rand.choice(['api', 'report', 'help'])
+                status = rand.choice([200, 200, 404, 500])
+                lines.append(
+                    f'"10.0.0.{rand.randint(1, 9)}","-","apache",{t},'
+                    f'"GET /{section}/x HTTP/1.0",{status},'
+                    f'{rand.randint(1, 5000)}\n'
+                )
+
+        handle, self.log_path = tempfile.mkstemp()
+        with os.fdopen(handle, 'w') as log_file:
+            log_file.writelines(lines)
+        self.line_count = len(lines)
+
+    def tearDown(self):
+        os.remove(self.log_path)
+
+    def test_split_file_on_line_boundaries(self):
+        ranges = split_file(self.log_path, 7)
+
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(self.log_path))
+        with open(self.log_path, 'rb') as log_file:
+            data = log_file.read()
+        for start, end in ranges:
+            self.assertTrue(start == 0 or data[start - 1:start] == b'\n')
+            self.assertEqual(data[end - 1:end], b'\n')
+
+    def test_merge_partials(self):
+        first, second = PartialStats(), PartialStats()
+        first.hits.update({1: 2, 2: 1})
+        second.hits.update({2: 3})
+        first.merge(second)
+
+        self.assertEqual(first.hits, {1: 2, 2: 4})
+
+    def test_matches_sequential_replay(self):
+        sequential_output, parallel_output = io.StringIO(), io.StringIO()
+        alerts, stats = replay_log_file(
+            self.log_path, 30, 10, 10, sequential_output
+        )
+        parallel_alerts, parallel_stats = replay_log_file_parallel(
+            self.log_path, 30, 10, 10, 2, parallel_output
+        )
+
+        self.assertEqual(stats.stats_data['hits'], self.line_count)
+        self.assertEqual(stats.stats_data, parallel_stats.stats_data)
+        self.assertGreater(alerts.alert_data['alert_count'], 0)
+        self.assertEqual(
+            alerts.alert_data['alert_count'],
+            parallel_alerts.alert_data['alert_count']
+        )
+        self.assertEqual(
+            alerts.alert_data['time'], parallel_alerts.alert_data['time']
+        )
+
+
+class TestParallelReplayOutOfOrder(unittest.TestCase):
+
+    def replay(self, workers=None):
+        # Small blocks so that the ranges are several blocks long
+        output = io.StringIO()
+        path = os.path.join(
+            os.path.dirname(__file__), '..', 'log_files', 'sample_csv.txt'
+        )
+        if workers:
+            alerts, stats = replay_log_file_parallel(
+                path, 120, 10, 10, workers, output, block_size=1 << 14
+            )
+        else:
+            alerts, stats = replay_log_file(
+                path, 120, 10, 10, output, block_size=1 << 14
+            )
+        return output.getvalue(), alerts.alert_data, stats.stats_data
+
+    def test_same_timeline_as_sequential_replay(self):
+        timeline, alert_data, stats_data = self.replay()
+
+        self.assertIn('High traffic generated an alert', timeline)
+        self.assertEqual((timeline, alert_data, stats_data), self.replay(3))
+
+
+class TestBlockHits(unittest.TestCase):
+
+    def test_same_alerts_as_every_line(self):
+        rand = random.Random(3)
+        records = []
+        for t in range(1000, 1400):
+            # Bursts, jumps forward and lines up to 10 seconds late
+            jump = rand.randint(0, 40) if rand.random() < 0.05 else 0
+            for _ in range(rand.choice([0, 1, 2, 5, 30, 60])):
+                records.append(LogRecord(
+                    '10.0.0.1', 'apache', t + jump - rand.randint(0, 10),
+                    'GET', 'api', '200', 100
+                ))
+
+        for time_window, threshold, block in [(10, 5, 100), (3, 2.5, 20),
+                                              (30, 10, 50)]:
+            lines = LogAlertConsumer(time_window, threshold, None,
+                                     use_log_time=True)
+            blocks = LogAlertConsumer(time_window, threshold, None,
+                                      use_log_time=True)
+            for start in range(0, len(records), block):
+                lines.process_records(records[start:start + block])
+                blocks.process_block_hits(
+                    BlockHits(records[start:start + block], time_window)
+                )
+                self.assertEqual(blocks.alert_data, lines.alert_data)
+                self.assertEqual(blocks.alert_window.state(),
+                                 lines.alert_window.state())
+
+            self.assertGreater(lines.alert_data['alert_count'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
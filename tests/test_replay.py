@@ -0,0 +1,56 @@
+from http_monitor.replay import read_blocks
+from http_monitor.replay import replay_log_file
+from tests.helpers import log_line
+import io
+import os
+import tempfile
+import unittest
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        start = 1549573860
+        # 1 hit/sec, then 20 hits/sec for 10 seconds, then 1 hit/sec again
+        lines = [log_line(start + t) for t in range(20)]
+        lines += [log_line(start + t, 'report', 500)
+                  for t in range(20, 30) for _ in range(20)]
+        lines += [log_line(start + t) for t in range(30, 60)]
+
+        handle, self.log_path = tempfile.mkstemp()
+        with os.fdopen(handle, 'w') as log_file:
+            log_file.writelines(lines)
+
+    def tearDown(self):
+        os.remove(self.log_path)
+
+    def test_read_blocks_end_on_line_boundary(self):
+        blocks = list(read_blocks(io.StringIO('a,1\nb,2\nc,3'), block_size=5))
+
+        self.assertEqual(''.join(blocks), 'a,1\nb,2\nc,3')
+        for block in blocks[:-1]:
+            self.assertTrue(block.endswith('\n'))
+
+    def test_alert_timeline_uses_log_time(self):
+        output = io.StringIO()
+        alerts, stats = replay_log_file(self.log_path, 10, 10, 10, output)
+        timeline = output.getvalue()
+
+        self.assertEqual(alerts.alert_data['alert_count'], 1)
+        self.assertEqual(alerts.alert_data['type'], 'recovered')
+        self.assertLess(
+            timeline.index('High traffic'), timeline.index('Traffic normal')
+        )
+
+    def test_stats_per_log_time_interval(self):
+        output = io.StringIO()
+        alerts, stats = replay_log_file(self.log_path, 10, 10, 10, output)
+
+        self.assertEqual(stats.stats_data['hits'], 20 + 200 + 30)
+        self.assertEqual(stats.stats_data['interval_start'], 1549573910)
+        self.assertEqual(output.getvalue().count(' bytes | '), 6)
+        self.assertIn('200 hits, 20,000 bytes | 5XX: 200', output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+from http_monitor.log_parser import LogParser
+from simulate import LoadProfile
+from simulate import replay_pool
+from simulate import simulate
+from simulate import synthetic_pool
+import os
+import tempfile
+import unittest
+
+
+class TestLoadProfile(unittest.TestCase):
+
+    def test_bursts(self):
+        profile = LoadProfile(10, burst_rate=1000, burst_length=2,
+                              burst_every=5)
+        self.assertEqual(
+            [profile.lines(second) for second in range(7)],
+            [1000, 1000, 10, 10, 10, 1000, 1000]
+        )
+
+    def test_steps(self):
+        profile = LoadProfile(10, step=5, step_every=2)
+        self.assertEqual(
+            [profile.lines(second) for second in range(5)],
+            [10, 10, 15, 15, 20]
+        )
+
+
+class TestPools(unittest.TestCase):
+
+    def test_synthetic_pool_is_seeded(self):
+        pool = synthetic_pool(1000, sections=20, skew=3, seed=7)
+
+        self.assertEqual(pool, synthetic_pool(1000, 20, 3, seed=7))
+        self.assertNotEqual(pool, synthetic_pool(1000, 20, 3, seed=8))
+        self.assertTrue(all(0 <= late <= 3 for _, late, _ in pool))
+
+        sections = {after.split('/')[1] for _, _, after in pool}
+        self.assertLessEqual(len(sections), 20)
+        self.assertGreater(len(sections), 10)
+
+    def test_replay_pool_keeps_lateness(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'sample.txt')
+            with open(path, 'w') as sample:
+                sample.write(
+                    '"remotehost","rfc931","authuser","date","request",'
+                    '"status","bytes"\n'
+                    '"10.0.0.1","-","apache",100,"GET /a HTTP/1.0",200,10\n'
+                    '"10.0.0.2","-","apache",102,"GET /b HTTP/1.0",200,10\n'
+                    '"10.0.0.3","-","apache",99,"GET /c HTTP/1.0",500,10\n'
+                )
+            pool = replay_pool(path)
+
+        # The header is skipped
+        self.assertEqual([late for _, late, _ in pool], [0, 0, 3])
+        self.assertEqual(pool[2][0], '"10.0.0.3","-","apache",')
+
+
+class TestSimulate(unittest.TestCase):
+
+    def test_lines_are_reproducible(self):
+        pool = synthetic_pool(100, skew=2, seed=1)
+        outputs = []
+
+        with tempfile.TemporaryDirectory() as directory:
+            for run in range(2):
+                path = os.path.join(directory, f'{run}.log')
+                written, _ = simulate(pool, path, LoadProfile(250), 1, 1000)
+                self.assertEqual(written, 250)
+                with open(path) as log_file:
+                    outputs.append(log_file.read())
+
+        self.assertEqual(outputs[0], outputs[1])
+
+        # Every line parses, stamped with the second less its lateness
+        records = LogParser().parse_block(outputs[0])
+        self.assertEqual(len(records), 250)
+        self.assertTrue(all(998 <= r.time <= 1000 for r in records))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+from collections import Counter
+from http_monitor.sketches import QuantileSketch
+from http_monitor.sketches import SpaceSaving
+import random
+import unittest
+
+
+class TestSpaceSaving(unittest.TestCase):
+
+    def setUp(self):
+        self.sketch = SpaceSaving(10)
+
+    def tearDown(self):
+        self.sketch = None
+
+    def test_exact_under_capacity(self):
+        keys = ['api', 'api', 'user', 'api', 'report', 'user']
+        for key in keys:
+            self.sketch.add(key)
+
+        self.assertEqual(self.sketch.most_common(),
+                         Counter(keys).most_common())
+        self.assertEqual(self.sketch.max_error(), 0)
+
+    def test_weighted_update(self):
+        self.sketch.update({'api': 100, 'user': 20})
+        self.sketch.add('api', 5)
+
+        self.assertEqual(self.sketch.get('api'), 105)
+        self.assertEqual(self.sketch.total, 125)
+
+    def test_memory_is_bounded(self):
+        for i in range(10000):
+            self.sketch.add(f'scan{i}')
+
+        self.assertEqual(len(self.sketch), 10)
+        self.assertEqual(len(self.sketch.heap), 10)
+
+    def test_heavy_hitters_among_unique_keys(self):
+        # Heavy sections mixed into a stream of sections seen only once
+        rng = random.Random(1)
+        stream = ['api'] * 3000 + ['user'] * 2000 + [
+            f'scan{i}' for i in range(20000)
+        ]
+        rng.shuffle(stream)
+        for key in stream:
+            self.sketch.add(key)
+
+        top = self.sketch.most_common(2)
+        self.assertEqual([key for key, _ in top], ['api', 'user'])
+
+        # Never underestimated and overestimated by at most total / capacity
+        error = self.sketch.max_error()
+        self.assertLessEqual(error, self.sketch.total / 10)
+        self.assertTrue(3000 <= self.sketch.get('api') <= 3000 + error)
+        self.assertTrue(2000 <= self.sketch.get('user') <= 2000 + error)
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def setUp(self):
+        self.sketch = QuantileSketch(0.01)
+
+    def tearDown(self):
+        self.sketch = None
+
+    def test_quantiles_within_relative_accuracy(self):
+        rng = random.Random(3)
+        values = sorted(rng.randint(1, 100000) for _ in range(20000))
+        self.sketch.update(Counter(values))
+
+        qs = [0.5, 0.95, 0.99]
+        for q, estimate in zip(qs, self.sketch.quantiles(qs)):
+            actual = values[int(q * (len(values) - 1))]
+            self.assertLessEqual(abs(estimate - actual), actual * 0.01)
+
+    def test_zero_and_empty(self):
+        self.assertEqual(self.sketch.quantile(0.5), None)
+
+        self.sketch.add(0, 3)
+        self.sketch.add(100)
+        self.assertEqual(self.sketch.quantile(0.5), 0)
+        self.assertAlmostEqual(self.sketch.quantile(1), 100, delta=1)
+
+    def test_merge_matches_single_sketch(self):
+        other = QuantileSketch(0.01)
+        for value in range(1, 1000):
+            (self.sketch if value % 2 else other).add(value)
+        self.sketch.merge(other)
+
+        single = QuantileSketch(0.01)
+        for value in range(1, 1000):
+            single.add(value)
+
+        self.assertEqual(self.sketch.count, 999)
+        self.assertEqual(self.sketch.quantiles([0.5, 0.99]),
+                         single.quantiles([0.5, 0.99]))
+
+        with self.assertRaises(ValueError):
+            self.sketch.merge(QuantileSketch(0.05))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+from http_monitor.sliding_window import SlidingWindowCounter
+import unittest
+
+
+class TestSlidingWindowCounter(unittest.TestCase):
+
+    def setUp(self):
+        self.window = SlidingWindowCounter(5)
+
+    def tearDown(self):
+        self.window = None
+
+    def test_counts_within_window(self):
+        for t in [100, 100, 101, 104]:
+            self.window.add(t)
+
+        self.assertEqual(self.window.total, 4)
+        self.assertEqual(self.window.average(), 0.8)
+
+    def test_old_seconds_slide_out(self):
+        for t in [100, 100, 101, 104]:
+            self.window.add(t)
+
+        # Window is now (100, 105]
+        self.window.advance(105)
+        self.assertEqual(self.window.total, 2)
+
+        self.window.advance(200)
+        self.assertEqual(self.window.total, 0)
+
+    def test_out_of_order_timestamps(self):
+        self.window.add(104)
+        self.assertTrue(self.window.add(101, 3))
+        self.assertFalse(self.window.add(99))
+        self.assertEqual(self.window.total, 4)
+
+        self.window.advance(106)
+        self.assertEqual(self.window.total, 1)
+
+    def test_counts_match_naive_window(self):
+        timestamps = [100, 102, 101, 103, 107, 105, 106, 112, 110, 111, 111]
+        for i, t in enumerate(timestamps):
+            self.window.add(t)
+            latest = max(timestamps[:i + 1])
+            expected = len([
+                s for s in timestamps[:i + 1] if latest - 5 < s <= latest
+            ])
+            self.assertEqual(self.window.total, expected)
+
+    def test_state_round_trip(self):
+        for t in [100, 100, 101, 104]:
+            self.window.add(t)
+        state = self.window.state()
+
+        self.assertEqual(state['counts'], [[100, 2], [101, 1], [104, 1]])
+        restored = SlidingWindowCounter(5)
+        self.assertTrue(restored.restore(state))
+        self.assertEqual(restored.total, 4)
+        restored.advance(105)
+        self.assertEqual(restored.total, 2)
+
+        self.assertFalse(SlidingWindowCounter(6).restore(state))
+
+
+if __name__ == '__main__':
+    unittest.main()
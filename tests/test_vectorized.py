@@ -0,0 +1,179 @@
+from http_monitor.log_parser import LogParser
+from http_monitor.replay import replay_log_file
+from http_monitor.sliding_window import SlidingWindowCounter
+from http_monitor.vectorized import numpy_available
+from tests.helpers import log_bytes
+import io
+import os
+import random
+import tempfile
+import unittest
+
+if numpy_available():
+    from http_monitor.vectorized import ArrayParser
+    from http_monitor.vectorized import window_totals
+    import numpy as np
+
+HEADER = (
+    b'"remotehost","rfc931","authuser","date","request","status","bytes"\n'
+)
+
+
+def columns(arrays):
+    return [
+        (time, arrays.section_names[section], arrays.client_names[client],
+         status, size)
+        for time, section, client, status, size in zip(
+            arrays.times.tolist(), arrays.sections.tolist(),
+            arrays.clients.tolist(), arrays.statuses.tolist(),
+            arrays.sizes.tolist()
+        )
+    ]
+
+
+def record_columns(records):
+    return [
+        (record.time, record.section, record.client, int(record.status[0]),
+         record.size)
+        for record in records
+    ]
+
+
+@unittest.skipUnless(numpy_available(), 'numpy is not installed')
+class TestArrayParser(unittest.TestCase):
+
+    def assertParsedAsLogParser(self, block):
+        parser = ArrayParser()
+        log_parser = LogParser()
+        self.assertEqual(
+            columns(parser.parse_block(block)),
+            record_columns(log_parser.parse_block(block))
+        )
+        self.assertEqual(parser.parsed_lines, log_parser.parsed_lines)
+        self.assertEqual(parser.malformed_lines, log_parser.malformed_lines)
+
+    def test_well_formed_lines(self):
+        block = b''.join(
+            log_bytes(1000 + i % 7, f'section{i % 5}', 200 + 100 * (i % 4),
+                      f'10.0.0.{i % 3}', i)
+            for i in range(50)
+        )
+        arrays = ArrayParser().parse_block(block)
+
+        # Codes are numbered in order of first appearance
+        self.assertEqual(arrays.section_names[:2], ['section0', 'section1'])
+        self.assertEqual(arrays.clients.tolist()[:4], [0, 1, 2, 0])
+        self.assertParsedAsLogParser(block)
+
+    def test_malformed_lines_are_skipped(self):
+        self.assertParsedAsLogParser(
+            HEADER + log_bytes(1000) + b'not a log line\n\n' +
+            b'"10.0.0.1","-","apache",1001,"GET /api HTTP/1.0",200,\n' +
+            b'"10.0.0.1","-","apache",x,"GET /api HTTP/1.0",200,1\n' +
+            log_bytes(1002, 'report') + b'"10.0.0.1","-",1003,"GET /a",200,1'
+        )
+
+    def test_unusual_lines(self):
+        self.assertParsedAsLogParser(
+            # Trailing blanks, no section, a long method and a long section
+            log_bytes(1000).replace(b'\n', b' \t\r\n') +
+            b'"a","-","b",1001,"GET / HTTP/1.0",200,5\n' +
+            b'"a","-","b",1002,"' + b'M' * 20 + b' /x HTTP/1.0",200,5\n' +
+            log_bytes(1003, 's' * 100) +
+            b'"a,b","-","c",1004,"GET /x,y HTTP/1.0",404,5\n' +
+            b'"a","-","b",1005,"GET /x\t1 HTTP/1.0",200,5\n'
+        )
+
+    def test_long_sections(self):
+        # Without a method long enough to leave the block to the pattern,
+        # so sections past SECTION_WIDTH are checked by the scan
+        self.assertParsedAsLogParser(
+            log_bytes(1000, 'a' * 100) + log_bytes(1001) +
+            log_bytes(1002, 'b' * 64) + log_bytes(1003, 'c' * 63) +
+            b'"a","-","b",1004,"GET /' + b'd' * 80 + b'",200,5\n'
+        )
+
+    def test_unclosed_quote_is_matched_with_the_pattern(self):
+        self.assertParsedAsLogParser(
+            log_bytes(1000) + b'"a","-","b",1001,"GET /x\n' + log_bytes(1002)
+        )
+
+    def test_empty_block(self):
+        arrays = ArrayParser().parse_block(b'')
+
+        self.assertEqual(len(arrays.times), 0)
+        self.assertEqual(arrays.section_names, [])
+
+
+@unittest.skipUnless(numpy_available(), 'numpy is not installed')
+class TestWindowTotals(unittest.TestCase):
+
+    def test_same_as_adding_one_by_one(self):
+        rng = random.Random(3)
+        times = [1000 + second - rng.randint(0, 12)
+                 for second in range(60) for _ in range(rng.randint(0, 5))]
+        window = SlidingWindowCounter(10)
+        expected = []
+        for time in times:
+            window.add(time)
+            expected.append(window.total)
+
+        vectorized = SlidingWindowCounter(10)
+        totals = []
+        for start in range(0, len(times), 40):
+            totals += window_totals(
+                vectorized, np.array(times[start:start + 40])
+            ).tolist()
+
+        self.assertEqual(totals, expected)
+        self.assertEqual(vectorized.state(), window.state())
+
+
+@unittest.skipUnless(numpy_available(), 'numpy is not installed')
+class TestVectorizedReplay(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(5)
+        lines = [HEADER]
+        for second in range(300):
+            hits = 40 if 100 <= second < 130 else 5
+            lines += [
+                log_bytes(
+                    1549573860 + second - rng.randint(0, 3),
+                    f'section{int(rng.paretovariate(1)) % 20}',
+                    rng.choice([200, 200, 404, 500]),
+                    f'10.0.0.{rng.randint(0, 30)}',
+                    rng.randint(0, 5000)
+                )
+                for _ in range(hits)
+            ]
+        lines.insert(500, b'not a log line\n')
+
+        handle, self.log_path = tempfile.mkstemp()
+        with os.fdopen(handle, 'wb') as log_file:
+            log_file.writelines(lines)
+
+    def tearDown(self):
+        os.remove(self.log_path)
+
+    def replay(self, vectorized, top_k=None):
+        output = io.StringIO()
+        alerts, stats = replay_log_file(
+            self.log_path, 20, 15, 10, output=output, top_k=top_k,
+            vectorized=vectorized
+        )
+        return output.getvalue(), alerts.alert_data, stats.stats_data
+
+    def test_same_timeline_as_records(self):
+        timeline, alert_data, stats_data = self.replay(True)
+
+        self.assertIn('High traffic generated an alert', timeline)
+        self.assertEqual((timeline, alert_data, stats_data),
+                         self.replay(False))
+
+    def test_same_timeline_with_top_k(self):
+        self.assertEqual(self.replay(True, 5), self.replay(False, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()